@@ -0,0 +1,141 @@
+"""Counters kept on write so lists needn't aggregate.
+
+``User.post_count`` and ``User.last_post_at`` are updated in the same
+flush, and so the same transaction, as the post that changes them;
+``user_initials`` likewise counts users by the initial of their last name
+as users are added, renamed and deleted. Bulk writes through Core bypass
+the ORM; ``flask reconcile-activity`` rebuilds the counters afterwards, as
+``flask generate-data`` does for its own rows.
+"""
+
+import string
+import time
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event, func, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import attributes, object_session
+from sqlalchemy.orm.util import identity_key
+
+from models import db, Post, User, UserInitial
+
+users = User.__table__
+posts = Post.__table__
+initials = UserInitial.__table__
+
+
+def newest_post(user_id):
+    """Correlated subquery for a user's newest post, off the user_id index"""
+    return (select(func.max(posts.c.created_at))
+            .where(posts.c.user_id == user_id).scalar_subquery())
+
+
+def post_total(user_id):
+    return (select(func.count()).select_from(posts)
+            .where(posts.c.user_id == user_id).scalar_subquery())
+
+
+def adjust(connection, user_id, delta):
+    connection.execute(update(users).where(users.c.id == user_id).values(
+        post_count=users.c.post_count + delta,
+        last_post_at=newest_post(users.c.id)))
+
+
+@event.listens_for(Post, 'after_insert')
+def _post_added(mapper, connection, post):
+    if post.user_id is not None:
+        adjust(connection, post.user_id, 1)
+
+
+@event.listens_for(Post, 'after_delete')
+def _post_removed(mapper, connection, post):
+    if post.user_id is None:
+        return
+    # Deleting a user cascades to their posts; the row is going anyway.
+    session = object_session(post)
+    owner = session.identity_map.get(identity_key(User, post.user_id))
+    if owner is not None and owner in session.deleted:
+        return
+    adjust(connection, post.user_id, -1)
+
+
+def initial(last_name):
+    """The jump link letter ``last_name`` is listed under, or None"""
+    letter = (last_name or '')[:1].upper()
+    return letter if len(letter) == 1 and \
+        letter in string.ascii_uppercase else None
+
+
+def count_initial(connection, letter, delta):
+    if letter is None:
+        return
+    dialect = postgresql if connection.dialect.name == 'postgresql' \
+        else sqlite
+    insert = dialect.insert(initials).values(letter=letter, user_count=delta)
+    connection.execute(insert.on_conflict_do_update(
+        index_elements=[initials.c.letter],
+        set_={'user_count': initials.c.user_count +
+              insert.excluded.user_count}))
+
+
+def _stored_last_name(user):
+    history = attributes.get_history(user, 'last_name')
+    return history.deleted[0] if history.deleted else user.last_name
+
+
+@event.listens_for(User, 'after_insert')
+def _user_added(mapper, connection, user):
+    count_initial(connection, initial(user.last_name), 1)
+
+
+@event.listens_for(User, 'after_update')
+def _user_renamed(mapper, connection, user):
+    before, after = initial(_stored_last_name(user)), initial(user.last_name)
+    if before != after:
+        count_initial(connection, before, -1)
+        count_initial(connection, after, 1)
+
+
+@event.listens_for(User, 'after_delete')
+def _user_removed(mapper, connection, user):
+    count_initial(connection, initial(_stored_last_name(user)), -1)
+
+
+def reconcile_initials():
+    """Recount ``user_initials`` from ``users``"""
+    letter = func.upper(func.substr(users.c.last_name, 1, 1))
+    db.session.execute(initials.delete())
+    db.session.execute(initials.insert().from_select(
+        ['letter', 'user_count'],
+        select(letter, func.count())
+        .where(letter.in_(list(string.ascii_uppercase)))
+        .group_by(letter)))
+    db.session.commit()
+
+
+def reconcile(batch_size=10_000, first_id=0):
+    """Recompute users' counters, one committed id range at a time"""
+    last_id = db.session.scalar(select(func.max(users.c.id))) or 0
+    updated = 0
+    for low in range(first_id, last_id + 1, batch_size):
+        updated += db.session.execute(
+            update(users)
+            .where(users.c.id.between(low, low + batch_size - 1))
+            .values(post_count=post_total(users.c.id),
+                    last_post_at=newest_post(users.c.id))).rowcount
+        db.session.commit()
+    return updated
+
+
+@click.command('reconcile-activity')
+@click.option('--batch-size', default=10_000, show_default=True,
+              help='Users updated per transaction.')
+@with_appcontext
+def reconcile_activity(batch_size):
+    """Rebuild users.post_count, users.last_post_at and user_initials."""
+    started = time.perf_counter()
+    updated = reconcile(batch_size)
+    reconcile_initials()
+    click.echo(f"users: {updated} rows reconciled in "
+               f"{time.perf_counter() - started:.2f}s")
@@ -0,0 +1,239 @@
+"""JSON API for Blogly users and posts, mounted at /api/v1.
+
+Reads select only the requested columns (``?fields=id,title``) and
+serialize the rows directly, without building ORM instances. Lists are
+keyset paged like the HTML pages; ``?ids=1,2,3`` fetches a batch of
+objects in one query instead of a page.
+"""
+
+from datetime import datetime
+from operator import attrgetter
+
+from flask import Blueprint, request, jsonify, abort, url_for
+from werkzeug.exceptions import HTTPException
+
+from cache import page_cache
+from models import db, User, Post
+from pagination import keyset_page, InvalidCursor
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# Most ids one batch request may ask for.
+MAX_IDS = 100
+
+USER_FIELDS = {name: getattr(User, name) for name in (
+    'id', 'first_name', 'middle_name', 'last_name', 'image_url',
+    'post_count', 'last_post_at')}
+POST_FIELDS = {name: getattr(Post, name) for name in (
+    'id', 'title', 'content', 'created_at', 'modified_on', 'user_id')}
+
+USER_ORDER = ['last_name', 'first_name', 'id']
+POST_ORDERS = {'created': ['created_at', 'id'],
+               'modified': ['modified_on', 'id']}
+
+
+@api.errorhandler(HTTPException)
+def json_error(e):
+    return jsonify(error=e.name, message=e.description), e.code
+
+
+# The app's own 404 page is registered by code, which beats a class.
+api.register_error_handler(404, json_error)
+
+
+def requested_fields(available):
+    """Names asked for with ``?fields=``, all of ``available`` by default"""
+    fields = request.args.get('fields')
+    if not fields:
+        return list(available)
+    names = [name.strip() for name in fields.split(',') if name.strip()]
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        abort(400, f"Unknown fields: {', '.join(unknown)}")
+    return names
+
+
+def requested_ids():
+    try:
+        ids = [int(value) for value in request.args['ids'].split(',')]
+    except ValueError:
+        abort(400, "ids must be a comma-separated list of integers")
+    if len(ids) > MAX_IDS:
+        abort(400, f"At most {MAX_IDS} ids per request")
+    return ids
+
+
+def encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def serialize(rows, names):
+    """Rows as dicts of ``names``, straight from the result tuples"""
+    return [{name: encode(getattr(row, name)) for name in names}
+            for row in rows]
+
+
+def read(available, order, descending, *criteria):
+    """A list, batch or page of rows with only the requested columns"""
+    names = requested_fields(available)
+    # The paging key is always selected, even if not returned.
+    selected = names + [name for name in order if name not in names]
+    query = db.session.query(*(available[name].label(name)
+                               for name in selected)).filter(*criteria)
+    if 'ids' in request.args:
+        ids = requested_ids()
+        rows = {row.id: row for row in
+                query.filter(available['id'].in_(ids))}
+        return jsonify(data=serialize([rows[i] for i in ids if i in rows],
+                                      names))
+    try:
+        page = keyset_page(query, [available[name] for name in order],
+                           attrgetter(*order),
+                           min(max(request.args.get('limit', 50, int), 1),
+                               500),
+                           before=request.args.get('before'),
+                           after=request.args.get('after'),
+                           descending=descending)
+    except InvalidCursor:
+        abort(400, "Invalid cursor")
+    return jsonify(data=serialize(page, names), next=page.next_cursor,
+                   prev=page.prev_cursor)
+
+
+def read_one(available, id):
+    names = requested_fields(available)
+    row = (db.session.query(*(available[name].label(name) for name in names))
+           .filter(available['id'] == id).first())
+    if row is None:
+        abort(404, "No such object")
+    return jsonify(data=serialize([row], names)[0])
+
+
+def payload(required, optional):
+    """Validated fields from the JSON body, lengths checked per column"""
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        abort(400, "Expected a JSON object")
+    unknown = set(body) - set(required) - set(optional)
+    if unknown:
+        abort(400, f"Unknown fields: {', '.join(sorted(unknown))}")
+    for name in required:
+        if body.get(name) in (None, ''):
+            abort(400, f"{name} is required")
+    for name, value in body.items():
+        column = (required | optional)[name]
+        if value is None:
+            if not column.nullable:
+                abort(400, f"{name} cannot be null")
+        elif column.type.python_type is str:
+            if not isinstance(value, str):
+                abort(400, f"{name} must be a string")
+            if len(value) > column.type.length:
+                abort(400, f"{name} is too long")
+        elif not isinstance(value, int) or isinstance(value, bool):
+            abort(400, f"{name} must be an integer")
+    return body
+
+
+USER_WRITABLE = {name: USER_FIELDS[name]
+                 for name in ('first_name', 'last_name')}
+USER_OPTIONAL = {name: USER_FIELDS[name]
+                 for name in ('middle_name', 'image_url')}
+POST_WRITABLE = {name: POST_FIELDS[name] for name in ('title', 'content')}
+
+
+@api.route('/users')
+def list_users():
+    """Users by name, or a batch with ``?ids=``"""
+    return read(USER_FIELDS, USER_ORDER, descending=False)
+
+
+@api.route('/users/<int:user_id>')
+def get_user(user_id):
+    return read_one(USER_FIELDS, user_id)
+
+
+@api.route('/users', methods=['POST'])
+def create_user():
+    body = payload(USER_WRITABLE, USER_OPTIONAL)
+    user = User(**body)
+    db.session.add(user)
+    db.session.commit()
+    page_cache.invalidate_users()
+    return (jsonify(data={'id': user.id}), 201,
+            {'Location': url_for('api.get_user', user_id=user.id)})
+
+
+@api.route('/users/<int:user_id>', methods=['PATCH'])
+def update_user(user_id):
+    user = db.get_or_404(User, user_id)
+    body = payload({}, USER_WRITABLE | USER_OPTIONAL)
+    for name, value in body.items():
+        setattr(user, name, value)
+    db.session.commit()
+    page_cache.invalidate_posts(*(post.id for post in user.posts))
+    page_cache.invalidate_users()
+    return read_one(USER_FIELDS, user_id)
+
+
+@api.route('/users/<int:user_id>', methods=['DELETE'])
+def delete_user(user_id):
+    user = db.get_or_404(User, user_id)
+    post_ids = [post.id for post in user.created_posts]
+    db.session.delete(user)
+    db.session.commit()
+    page_cache.invalidate_posts(*post_ids)
+    page_cache.invalidate_users()
+    return '', 204
+
+
+@api.route('/posts')
+def list_posts():
+    """Posts newest first, or a batch with ``?ids=``.
+
+    ``?sort=modified`` lists edited posts, most recently modified first.
+    """
+    sort = request.args.get('sort', 'created')
+    if sort not in POST_ORDERS:
+        abort(400, f"Unknown sort {sort!r}")
+    criteria = [Post.modified_on.is_not(None)] if sort == 'modified' else []
+    return read(POST_FIELDS, POST_ORDERS[sort], True, *criteria)
+
+
+@api.route('/posts/<int:post_id>')
+def get_post(post_id):
+    return read_one(POST_FIELDS, post_id)
+
+
+@api.route('/posts', methods=['POST'])
+def create_post():
+    body = payload({'title': Post.title, 'user_id': Post.user_id},
+                   {'content': Post.content})
+    db.get_or_404(User, body['user_id'], description="No such user")
+    post = Post(**body)
+    db.session.add(post)
+    db.session.commit()
+    page_cache.invalidate_posts()
+    return (jsonify(data={'id': post.id}), 201,
+            {'Location': url_for('api.get_post', post_id=post.id)})
+
+
+@api.route('/posts/<int:post_id>', methods=['PATCH'])
+def update_post(post_id):
+    post = db.get_or_404(Post, post_id)
+    body = payload({}, POST_WRITABLE)
+    for name, value in body.items():
+        setattr(post, name, value)
+    db.session.commit()
+    page_cache.invalidate_posts(post_id)
+    return read_one(POST_FIELDS, post_id)
+
+
+@api.route('/posts/<int:post_id>', methods=['DELETE'])
+def delete_post(post_id):
+    db.session.delete(db.get_or_404(Post, post_id))
+    db.session.commit()
+    page_cache.invalidate_posts(post_id)
+    return '', 204
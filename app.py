@@ -1,109 +1,358 @@
 """Blogly application."""
 import datetime
-
-from flask import Flask, request, redirect, render_template, flash
-
-from models import db, connect_db, User, Post
+import string
+from operator import attrgetter
+
+from flask import (Flask, Blueprint, current_app, request, redirect,
+                   render_template, flash, abort, jsonify, Response)
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from config import load_config
+from models import (db, connect_db, User, Post, UserInitial,
+                    DEFAULT_IMAGE_URL)
+from pagination import (keyset_query, keyset_result, encode_cursor,
+                        InvalidCursor)
+from instrumentation import connect_instrumentation
+from cache import page_cache, connect_cache
+from conditional import conditional
+from timefmt import annotate, friendly
+from datagen import generate_data
+from search import search_posts
+from activity import reconcile_activity
+from excerpts import backfill_excerpts
+from migrate import db_cli
+from streaming import render_list, stream_rows
+from writebehind import (post_writer, connect_writer, WriteFailed,
+                         WriteTimedOut)
+from api import api
+from routing import connect_routing
+from notfound import recent_posts, not_found_limiter, connect_not_found
+from metrics import registry
+from assets import connect_assets, build_assets
+from avatars import connect_avatars
 # from flask_debugtoolbar import DebugToolbarExtension
 
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///blogly_part2'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SECRET_KEY'] = 'ihaveasecret2'
-app.config['SQLALCHEMY_ECHO'] = True
-
-connect_db(app)
-
-app.config['SECRET_KEY'] = "SECRET11!"
-# debug = DebugToolbarExtension(app)
-
-
-@app.errorhandler(404)
+blog = Blueprint('blog', __name__)
+
+
+def create_app(profile=None, overrides=None):
+    """Build the Blogly app for the ``profile`` settings (see config.py).
+
+    ``overrides`` are applied on top of the profile before any engine is
+    created. The extensions in ``cache``, ``writebehind``, ``notfound`` and
+    ``avatars`` are per process, so each process builds one app.
+    """
+
+    app = Flask(__name__)
+    load_config(app, profile, overrides)
+    if app.config['PROXY_COUNT']:
+        proxies = app.config['PROXY_COUNT']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies,
+                                x_host=proxies)
+
+    connect_db(app)
+    connect_routing(app)
+    connect_instrumentation(app, db)
+    connect_cache(app)
+    connect_writer(app)
+    connect_not_found(app)
+    connect_assets(app)
+    connect_avatars(app)
+    app.register_blueprint(blog)
+    app.register_blueprint(api)
+    app.cli.add_command(generate_data)
+    app.cli.add_command(reconcile_activity)
+    app.cli.add_command(backfill_excerpts)
+    app.cli.add_command(db_cli)
+    app.cli.add_command(build_assets)
+
+    # debug = DebugToolbarExtension(app)
+    return app
+
+
+def __getattr__(name):
+    # ``from app import app`` and ``flask --app app`` get a default app,
+    # built on first use so that importing create_app builds nothing.
+    global app
+    if name == 'app':
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+@blog.app_errorhandler(404)
 def page_not_found(e):
     """Default 404 Page"""
+    if not not_found_limiter.allow(request.remote_addr):
+        return Response("Not Found", 404, mimetype='text/plain')
     flash("Page not found!" + request.url, 'success')
-    return render_template('404.html',
-                           posts=Post.query.order_by(Post.created_at.desc())
-                           .limit(5)), 404
+    return render_template('404.html', posts=recent_posts.get()), 404
 
 
-@app.route("/")
+@blog.route("/")
 def home():
     """To Fix Again Later"""
     return redirect("/posts")
 
 
-@app.route("/posts")
-def show_posts():
-    """Show 10 more recent posts"""
-    return render_template("posts.html",
-                           posts=Post.query.order_by(Post.created_at.desc())
-                           .limit(5))
+def feed_query(query):
+    """``query`` narrowed to the /posts page selected by the request's cursor.
+
+    Returns the narrowed query or ``select()`` and a function making the
+    :class:`KeysetPage` from its rows.
+    """
+    before = request.args.get('before')
+    after = request.args.get('after')
+    per_page = current_app.config['POSTS_PER_PAGE']
+    try:
+        query = keyset_query(query, [Post.created_at, Post.id], per_page,
+                             before=before, after=after)
+    except InvalidCursor:
+        abort(400)
+    return query, lambda rows: keyset_result(
+        rows, attrgetter('created_at', 'id'), per_page, before, after)
+
+
+def feed_key():
+    """Page cache key for the requested feed page"""
+    return page_cache.feed_key(request.args.get('before', ''),
+                               request.args.get('after', ''))
+
+
+def validator_parts(rows):
+    """Rows plus the relative times a page renders from them"""
+    now = datetime.datetime.now(datetime.UTC)
+    return [(*row, friendly(row.created_at, now),
+             row.modified_on and friendly(row.modified_on, now))
+            for row in rows]
+
+
+def post_parts(*criteria):
+    """What the ETags of posts matching ``criteria`` cover"""
+    return (db.select(Post.id, Post.title, Post.created_at,
+                      Post.modified_on, User.first_name, User.middle_name,
+                      User.last_name)
+            .outerjoin(Post.user).where(*criteria))
+
+
+def post_etag(rows):
+    """ETag inputs for a post page, from its :func:`post_parts` rows"""
+    if not rows:
+        abort(404)
+    row = rows[0]
+    return validator_parts([row]), [row.created_at, row.modified_on]
+
+
+def user_parts(user_id):
+    """What a user page's ETag covers, in one aggregate row.
+
+    The row stands in for the posts: adding or deleting one changes the
+    count or the highest id, and editing one its modified_on.
+    """
+    return (db.select(User.first_name, User.middle_name, User.last_name,
+                      User.image_url, db.func.count(Post.id),
+                      db.func.max(Post.id), db.func.max(Post.modified_on))
+            .outerjoin(User.posts).where(User.id == user_id)
+            .group_by(User.id))
+
+
+def user_etag(rows):
+    """ETag inputs for a user page, from its :func:`user_parts` rows.
 
+    The minute makes the ETag follow the "N minutes ago" texts.
+    """
+    if not rows:
+        abort(404)
+    minute = datetime.datetime.now(datetime.UTC).timestamp() // 60
+    return [tuple(rows[0]), minute], []
 
-@app.route("/posts/<int:post_id>")
+
+def feed_validators():
+    """ETag inputs for a feed page, without loading whole posts.
+
+    List pages get no Last-Modified: deleting a post leaves the newest
+    timestamp among the rest unchanged, so only the ETag notices.
+    """
+    query, paginate = feed_query(post_parts())
+    page = paginate(db.session.execute(query).all())
+    return [validator_parts(page), page.next_cursor, page.prev_cursor], []
+
+
+def post_validators(post_id):
+    """ETag inputs for a post page"""
+    return post_etag(db.session.execute(
+        post_parts(Post.id == post_id)).all())
+
+
+def user_validators(user_id):
+    """ETag inputs for a user page and its list of posts; ETag only"""
+    return user_etag(db.session.execute(user_parts(user_id)).all())
+
+
+@blog.route("/posts")
+@page_cache.cached(feed_key)
+@conditional(feed_validators)
+def show_posts():
+    """Show a page of posts, newest first.
+
+    ``?before=<cursor>`` pages to older posts, ``?after=<cursor>`` to newer.
+    """
+    query, paginate = feed_query(Post.query.options(db.joinedload(Post.user),
+                                                    db.defer(Post.content)))
+    page = annotate(paginate(query.all()))
+    return render_list("posts.html", posts=page, page=page)
+
+
+@blog.route("/search")
+def search():
+    """Search post titles and content, best matches first"""
+    terms = request.args.get('q', '').strip()
+    results = None
+    if terms:
+        try:
+            results = search_posts(
+                terms, current_app.config['SEARCH_RESULTS_PER_PAGE'],
+                before=request.args.get('before'),
+                after=request.args.get('after'))
+        except InvalidCursor:
+            abort(400)
+    return render_template("search.html", terms=terms, results=results)
+
+
+@blog.route("/posts/<int:post_id>")
+@page_cache.cached(page_cache.post_key)
+@conditional(post_validators)
 def show_post(post_id):
     """Show Post"""
     return render_template("post.html",
-                           post=Post.query.get_or_404(post_id))
+                           post=Post.query.options(db.joinedload(Post.user))
+                           .get_or_404(post_id))
 
 
-@app.route("/users/<int:user_id>/posts/new")
+@blog.route("/users/<int:user_id>/posts/new")
 def new_post(user_id):
     """New Post"""
     return render_template("add_new_post.html",
                            user=User.query.get_or_404(user_id))
 
 
-@app.route("/users/<int:user_id>/posts/new", methods=["POST"])
+@blog.route("/users/<int:user_id>/posts/new", methods=["POST"])
 def new_post_apply(user_id):
     """New Post Apply"""
     user = User.query.get_or_404(user_id)
-    title = request.form.get('title', None)
-    content = request.form.get('content', None)
-    post = Post(title=title, content=content, user_id=user.id)
-    db.session.add(post)
-    db.session.commit()
-    flash("Post has been added to the list!", 'success')
+    title = request.form.get('title', '').strip()
+    content = request.form.get('content', '')
+    if not title or len(title) > Post.title.type.length or \
+            len(content) > Post.content.type.length:
+        flash("A post needs a title, and both title and content must fit!",
+              'error')
+        return redirect(f"/users/{user_id}/posts/new")
+    try:
+        saved = post_writer.submit(user.id, title, content)
+    except WriteFailed:
+        flash("The post could not be saved, please try again.", 'error')
+        return redirect(f"/users/{user_id}/posts/new")
+    except WriteTimedOut:
+        flash("The post is taking a while to save; check for it here "
+              "before posting it again.", 'warning')
+        return redirect(f"/users/{user_id}")
+    if saved:
+        flash("Post has been added to the list!", 'success')
+    else:
+        flash("Post has been added and will appear shortly!", 'success')
     return redirect(f"/users/{user_id}")
 
 
-@app.route("/posts/<int:post_id>/edit")
+@blog.route("/posts/<int:post_id>/edit")
 def edit_post(post_id):
     """Edit Post"""
     return render_template("edit_post.html",
                            post=Post.query.get_or_404(post_id))
 
 
-@app.route("/posts/<int:post_id>/edit", methods=["POST"])
+@blog.route("/posts/<int:post_id>/edit", methods=["POST"])
 def edit_post_apply(post_id):
     """Edit Post Apply"""
     post = Post.query.get_or_404(post_id)
     post.title = request.form.get('title', None)
     post.content = request.form.get('content', None)
-    post.modified_on = datetime.datetime.now(datetime.UTC)
     post.verified = True
     db.session.commit()
+    page_cache.invalidate_posts(post.id)
     flash("Post modified successfully!", 'success')
     return redirect(f"/posts/{post.id}")
 
 
-@app.route("/users")
+def letter_links(counts):
+    """(letter, users) pairs A-Z from ``{letter: users}``"""
+    return [(letter, counts.get(letter, 0))
+            for letter in string.ascii_uppercase]
+
+
+def letter_counts():
+    """(letter, users) pairs by initial of last name, for the jump links"""
+
+    def count():
+        return dict(db.session.query(UserInitial.letter,
+                                     UserInitial.user_count).all())
+    return letter_links(page_cache.memoize(page_cache.users_key('letters'),
+                                           count))
+
+
+def users_query(query):
+    """``query`` of users narrowed to the /users page the request asks for.
+
+    Users are ordered by name, or with ``?sort=active`` the most recent
+    posters come first. ``?letter=M`` jumps to the last names starting at M;
+    ``?before=``/``?after=`` cursors page forward and back. Returns the
+    sort, the narrowed query and a function making the
+    :class:`KeysetPage` from its rows.
+    """
+    sort = request.args.get('sort')
+    before = request.args.get('before')
+    after = request.args.get('after')
+    if sort == 'active':
+        query = query.filter(User.last_post_at.isnot(None))
+        columns = [User.last_post_at, User.id]
+        key = attrgetter('last_post_at', 'id')
+        descending = True
+    else:
+        sort = None
+        letter = request.args.get('letter', '').upper()
+        if before is None and after is None and len(letter) == 1 and \
+                letter in string.ascii_uppercase:
+            # A cursor sitting just ahead of the letter's first user.
+            before = encode_cursor([letter, '', 0])
+        columns = [User.last_name, User.first_name, User.id]
+        key = attrgetter('last_name', 'first_name', 'id')
+        descending = False
+    per_page = current_app.config['USERS_PER_PAGE']
+    try:
+        query = keyset_query(query, columns, per_page, before=before,
+                             after=after, descending=descending)
+    except InvalidCursor:
+        abort(400)
+    return sort, query, lambda rows: keyset_result(rows, key, per_page,
+                                                   before, after)
+
+
+@blog.route("/users")
 def list_users():
-    """List Users"""
-    return render_template("user.html",
-                           users=(User.query.order_by(User.last_name.asc())
-                                  .order_by(User.first_name.asc())
-                                  .all()))
+    """List Users a page at a time (see users_query)"""
+    sort, query, paginate = users_query(User.query)
+    letters = None if sort else letter_counts()
+    page = paginate(query.all())
+    return render_list("user.html", users=page, page=page, sort=sort,
+                       letters=letters)
 
 
-@app.route("/users/new")
+@blog.route("/users/new")
 def add_new_user_form():
     """Show New User Form"""
     return render_template("new_user.html")
 
 
-@app.route("/users/new", methods=["POST"])
+@blog.route("/users/new", methods=["POST"])
 def add_new_user():
     """Add New User"""
     first_name = request.form['first_name']
@@ -117,25 +366,33 @@ def add_new_user():
                 image_url=image_url)
     db.session.add(user)
     db.session.commit()
+    page_cache.invalidate_users()
     flash("New user added successfully!", 'success')
     return redirect(f"/users")
 
 
-@app.route("/users/<int:user_id>")
+@blog.route("/users/<int:user_id>")
+@conditional(user_validators)
 def show_user(user_id):
     """Show User Details"""
-    return render_template("user_details.html",
-                           user=User.query.get_or_404(user_id))
+    user = User.query.get_or_404(user_id)
+    posts = stream_rows(db.select(Post).filter_by(user_id=user.id)
+                        .options(db.defer(Post.content))
+                        .order_by(Post.id))
+    return render_list("user_details.html", user=user, posts=posts)
 
 
-@app.route("/users/<int:user_id>/edit")
+@blog.route("/users/<int:user_id>/edit")
 def edit_user(user_id):
     """Edit User"""
-    return render_template("edit_user.html",
-                           user=User.query.get_or_404(user_id))
+    user = (User.query.options(db.selectinload(User.posts)
+                               .defer(Post.content))
+            .get_or_404(user_id))
+    annotate(user.posts)
+    return render_template("edit_user.html", user=user)
 
 
-@app.route("/users/<int:user_id>/edit", methods=["POST"])
+@blog.route("/users/<int:user_id>/edit", methods=["POST"])
 def edit_user_apply(user_id):
     """Edit User Apply"""
     user = User.query.get_or_404(user_id)
@@ -151,27 +408,54 @@ def edit_user_apply(user_id):
         else ''
     user.last_name = last_name if last_name and len(str(last_name)) > 0 else ' '
     user.image_url = image_url if image_url and len(str(image_url)) > 0 else \
-        'https://via.placeholder.com/50'
+        DEFAULT_IMAGE_URL
 
     user.verified = True
     db.session.commit()
+    page_cache.invalidate_posts(*(post.id for post in user.posts))
+    page_cache.invalidate_users()
     flash("User modified successfully!", 'success')
     return redirect(f"/users")
 
 
-@app.route("/users/<int:user_id>/delete", methods=["POST"])
+@blog.route("/users/<int:user_id>/delete", methods=["POST"])
 def delete_user(user_id):
     """Delete User"""
-    db.session.delete(User.query.get_or_404(user_id))
+    user = User.query.get_or_404(user_id)
+    post_ids = [post.id for post in user.created_posts]
+    db.session.delete(user)
     db.session.commit()
+    page_cache.invalidate_posts(*post_ids)
+    page_cache.invalidate_users()
     flash("User deleted successfully!", 'success')
     return redirect(f"/users")
 
 
-@app.route("/posts/<int:post_id>/delete", methods=["POST"])
+@blog.route("/posts/<int:post_id>/delete", methods=["POST"])
 def delete_post(post_id):
     """Delete Post"""
     db.session.delete(Post.query.get_or_404(post_id))
     db.session.commit()
+    page_cache.invalidate_posts(post_id)
     flash("Post deleted successfully!", 'success')
-    return redirect(f"/posts")
\ No newline at end of file
+    return redirect(f"/posts")
+
+
+@blog.route("/_stats/cache")
+def cache_stats():
+    """Page cache counters, for sizing the cache"""
+    return jsonify(page_cache.stats())
+
+
+@blog.route("/_stats/pool")
+def pool_stats():
+    """Connection pool gauges and histograms, per bind"""
+    return jsonify({key: metrics.snapshot() for key, metrics
+                    in current_app.extensions['pool_metrics'].items()})
+
+
+@blog.route("/_metrics")
+def metrics():
+    """Request, pool and cache metrics in Prometheus text format"""
+    return Response(registry.exposition(),
+                    mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,128 @@
+"""ASGI entry point for Blogly: ``uvicorn asgi:app``.
+
+Requests run on the Flask app from :func:`app.create_app`, in a pool of
+``ASGI_THREADS`` threads. With ``ASYNC_READS`` set, GET and HEAD requests
+for the feed, post, user and user list pages instead run as coroutines
+on the server's event loop (see asyncreads.py). Such a request holds no
+thread while it waits on the database or on a slow client, so one
+process keeps many more of them open at once. The coroutine views go
+through the app's own request handling (before/after request hooks,
+error handlers, sessions and metrics) and serve the same pages;
+streamed pages stay on the threads. Templates render on the loop, and
+the 404 page's snapshot and replica health probes still query
+synchronously, each at most once per its interval.
+"""
+
+from io import BytesIO
+
+from a2wsgi import WSGIMiddleware
+from a2wsgi.wsgi import build_environ
+from flask import request, request_started
+from werkzeug.exceptions import HTTPException
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from app import create_app
+from asyncreads import VIEWS, async_reads, connect_async_reads
+from streaming import wants_stream
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+
+class BloglyASGI:
+    """ASGI app sending the read pages to :data:`asyncreads.VIEWS`"""
+
+    def __init__(self, app):
+        self.app = app
+        self.wsgi = WSGIMiddleware(app, workers=app.config['ASGI_THREADS'])
+        self.views = VIEWS if app.config['ASYNC_READS'] else {}
+        proxies = app.config['PROXY_COUNT']
+        # Applies create_app's ProxyFix to the environs built here.
+        self.proxy_fix = proxies and ProxyFix(
+            lambda environ, start_response: environ, x_for=proxies,
+            x_proto=proxies, x_host=proxies)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        view = environ = None
+        if scope['type'] == 'http' and scope['method'] in SAFE_METHODS and \
+                self.views:
+            environ = build_environ(scope, BytesIO())
+            if self.proxy_fix:
+                environ = self.proxy_fix(environ, None)
+            view = self.views.get(self.endpoint(environ))
+        response = view and await self.dispatch(view, environ)
+        if response is None:
+            return await self.wsgi(scope, receive, send)
+        body, status, headers = response.get_wsgi_response(environ)
+        await send({'type': 'http.response.start',
+                    'status': int(status.split(' ', 1)[0]),
+                    'headers': [(name.lower().encode('latin-1'),
+                                 value.encode('latin-1'))
+                                for name, value in headers]})
+        try:
+            body = b''.join(body)
+        finally:
+            response.close()
+        await send({'type': 'http.response.body', 'body': body})
+
+    def endpoint(self, environ):
+        try:
+            return self.app.url_map.bind_to_environ(environ).match()[0]
+        except HTTPException:
+            return None
+
+    async def dispatch(self, view, environ):
+        """``view``'s response, through Flask's request handling.
+
+        The steps of ``Flask.wsgi_app`` and ``full_dispatch_request``, with
+        the view awaited. None for a streamed page, which the threads serve.
+        """
+        app = self.app
+        ctx = app.request_context(environ)
+        error = None
+        try:
+            ctx.push()
+            if wants_stream():
+                return None
+            try:
+                request_started.send(app, _async_wrapper=app.ensure_sync)
+                rv = app.preprocess_request()
+                if rv is None:
+                    rv = await view(**request.view_args)
+            except Exception as e:
+                rv = app.handle_user_exception(e)
+            return app.finalize_request(rv)
+        except Exception as e:
+            error = e
+            return app.handle_exception(e)
+        finally:
+            if error is not None and app.should_ignore_error(error):
+                error = None
+            ctx.pop(error)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await async_reads.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def create_asgi_app(profile=None, overrides=None):
+    """The Blogly app for ``profile`` (see create_app), served over ASGI"""
+    app = create_app(profile, overrides)
+    connect_async_reads(app)
+    return BloglyASGI(app)
+
+
+def __getattr__(name):
+    # ``uvicorn asgi:app`` gets a default app, as ``app:app`` does.
+    global app
+    if name == 'app':
+        app = create_asgi_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
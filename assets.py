@@ -0,0 +1,166 @@
+"""Fingerprinted, precompressed static files for Blogly.
+
+``flask build-assets`` (or app startup, with ``ASSETS_BUILD``) copies each
+file in ``static/`` to ``static/build/`` under a name carrying a hash of
+its contents, next to gzip and, when the ``brotli`` package is installed,
+brotli versions of it. ``static/build/manifest.json`` maps the original
+names to the built ones, and ``url_for('static', filename=...)`` uses it,
+so a changed file gets a new URL on deploy. Built files never change, and
+are served with a year-long ``immutable`` ``Cache-Control``.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import tempfile
+
+import click
+from flask import abort, current_app, request, send_from_directory
+from flask.cli import with_appcontext
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BUILD_DIRECTORY = 'build'
+MANIFEST = 'manifest.json'
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# Smaller files gain nothing from compression.
+MIN_COMPRESS_SIZE = 256
+COMPRESSIBLE = ('text/', 'application/javascript', 'application/json',
+                'image/svg+xml')
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def fingerprint(content):
+    return hashlib.blake2b(content, digest_size=8).hexdigest()
+
+
+def _sources(static_folder):
+    for directory, subdirectories, filenames in os.walk(static_folder):
+        if directory == static_folder:
+            subdirectories[:] = [name for name in subdirectories
+                                 if name != BUILD_DIRECTORY]
+        for filename in sorted(filenames):
+            path = os.path.join(directory, filename)
+            yield os.path.relpath(path, static_folder).replace(os.sep, '/')
+
+
+def _replace(path, content):
+    """Write ``path`` in one step, so no reader sees it half written.
+
+    Several workers may build at once; each writes a private temporary file
+    next to ``path`` and renames it into place.
+    """
+    descriptor, temporary = tempfile.mkstemp(
+        dir=os.path.dirname(path), prefix='.' + os.path.basename(path))
+    try:
+        with os.fdopen(descriptor, 'wb') as f:
+            f.write(content)
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def _write(path, content):
+    """Write ``path`` unless it is already there: built names never change"""
+    if not os.path.exists(path):
+        _replace(path, content)
+
+
+def _compressible(name, content):
+    mimetype = mimetypes.guess_type(name)[0] or ''
+    return (len(content) >= MIN_COMPRESS_SIZE and
+            mimetype.startswith(COMPRESSIBLE))
+
+
+def build(static_folder):
+    """Fingerprint and precompress ``static_folder``; returns the manifest"""
+    output = os.path.join(static_folder, BUILD_DIRECTORY)
+    manifest = {}
+    for name in _sources(static_folder):
+        with open(os.path.join(static_folder, name), 'rb') as f:
+            content = f.read()
+        root, extension = os.path.splitext(name)
+        built = f"{root}.{fingerprint(content)}{extension}"
+        path = os.path.join(output, built)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write(path, content)
+        if _compressible(name, content):
+            _write(path + '.gz', gzip.compress(content, 9, mtime=0))
+            if brotli is not None:
+                _write(path + '.br', brotli.compress(content))
+        manifest[name] = f"{BUILD_DIRECTORY}/{built}"
+    os.makedirs(output, exist_ok=True)
+    _replace(os.path.join(output, MANIFEST),
+             json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+def load_manifest(static_folder):
+    try:
+        with open(os.path.join(static_folder, BUILD_DIRECTORY,
+                               MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def serve_built(filename):
+    """A built file, precompressed if the client accepts it"""
+    built = current_app.extensions['assets']
+    if filename not in built:
+        abort(404)
+    directory = os.path.join(current_app.static_folder, BUILD_DIRECTORY)
+    mimetype = mimetypes.guess_type(filename)[0]
+    encoding = None
+    for candidate, suffix in ENCODINGS:
+        if (candidate in request.accept_encodings and
+                os.path.exists(os.path.join(directory, filename + suffix))):
+            encoding = candidate
+            filename += suffix
+            break
+    response = send_from_directory(directory, filename, mimetype=mimetype,
+                                   max_age=31536000)
+    if encoding:
+        response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = IMMUTABLE
+    return response
+
+
+@click.command('build-assets')
+@with_appcontext
+def build_assets():
+    """Fingerprint and precompress the static files."""
+    manifest = build(current_app.static_folder)
+    for name, built in manifest.items():
+        click.echo(f"{name} -> {built}")
+
+
+def connect_assets(app):
+    """Point ``url_for('static')`` at fingerprinted copies of static files.
+
+    With ``ASSETS_BUILD`` the files are built at startup; otherwise an
+    existing manifest from ``flask build-assets`` is used, and without one
+    static URLs are left as they are.
+    """
+
+    if app.config.get('ASSETS_BUILD'):
+        manifest = build(app.static_folder)
+    else:
+        manifest = load_manifest(app.static_folder)
+    app.extensions['assets'] = {
+        built[len(BUILD_DIRECTORY) + 1:] for built in manifest.values()}
+    app.add_url_rule(f"{app.static_url_path}/{BUILD_DIRECTORY}/"
+                     "<path:filename>", 'assets', serve_built)
+
+    @app.url_defaults
+    def fingerprinted(endpoint, values):
+        if endpoint == 'static' and values.get('filename') in manifest:
+            values['filename'] = manifest[values['filename']]
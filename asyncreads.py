@@ -0,0 +1,198 @@
+"""Read pages as coroutines on SQLAlchemy's asyncio engine.
+
+With ``ASYNC_READS`` set, :mod:`asgi` runs the feed, post, user and user
+list pages through the coroutine views below instead of the Flask ones.
+Their queries go to an async engine (asyncpg for PostgreSQL, aiosqlite
+for SQLite) that mirrors the bind the request would have used: the
+primary, or the read replica chosen for it (see routing.py). Results are
+detached once a query's session closes, so everything a page shows is
+loaded eagerly. Neither driver is needed with ``ASYNC_READS`` off.
+"""
+
+from flask import abort, g, render_template
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app import (feed_query, feed_key, post_parts, post_etag, user_parts,
+                 user_etag, users_query, letter_links, validator_parts)
+from cache import page_cache
+from conditional import conditional
+from instrumentation import instrument_pool
+from models import db, Post, User, UserInitial
+from timefmt import annotate
+
+DRIVERS = {'postgresql': 'postgresql+asyncpg', 'sqlite': 'sqlite+aiosqlite'}
+
+
+def async_url(url):
+    """``url`` with its driver swapped for the asyncio one"""
+    url = make_url(url)
+    try:
+        return url.set(drivername=DRIVERS[url.get_backend_name()])
+    except KeyError:
+        raise ValueError(f"No async driver for {url.get_backend_name()!r}") \
+            from None
+
+
+def async_engine_options(config, url):
+    """Pool settings for an async engine, from ``config``"""
+    url = make_url(url)
+    options = {'pool_pre_ping': config['DB_PRE_PING']}
+    if url.get_backend_name() == 'sqlite':
+        return options
+    options.update(pool_size=config['DB_POOL_SIZE'],
+                   max_overflow=config['DB_MAX_OVERFLOW'],
+                   pool_timeout=config['DB_POOL_TIMEOUT'],
+                   pool_recycle=config['DB_POOL_RECYCLE'])
+    if url.get_backend_name() == 'postgresql':
+        # asyncpg takes server settings directly, not libpq's "options".
+        settings = {'timezone': 'UTC'}
+        if config['DB_STATEMENT_TIMEOUT_MS']:
+            settings['statement_timeout'] = str(
+                config['DB_STATEMENT_TIMEOUT_MS'])
+        options['connect_args'] = {'server_settings': settings}
+    return options
+
+
+class AsyncReads:
+    """An async engine for the primary and for each read replica"""
+
+    def __init__(self):
+        self.engines = {}
+
+    def init_app(self, app):
+        self.engines = {}
+        if not app.config.get('ASYNC_READS'):
+            return
+        with app.app_context():
+            binds = [('default', None, db.engine)]
+        router = app.extensions.get('replica_router')
+        if router is not None:
+            binds.extend((replica.name, replica, replica.engine)
+                         for replica in router.replicas)
+        pools = app.extensions.get('pool_metrics', {})
+        for name, replica, engine in binds:
+            url = async_url(engine.url)
+            # Fail at startup, not on the first request, if the driver is
+            # missing.
+            url.get_dialect().import_dbapi()
+            async_engine = create_async_engine(
+                url, **async_engine_options(app.config, url))
+            if replica is not None:
+                event.listen(async_engine.sync_engine, 'handle_error',
+                             replica._failed)
+            pools[f'{name}_async'] = instrument_pool(async_engine.sync_engine)
+            self.engines[None if replica is None else engine] = async_engine
+
+    def session(self):
+        """A session on the async engine for this request's bind"""
+        engine = self.engines.get(g.get('replica_engine'),
+                                  self.engines[None])
+        return AsyncSession(engine, expire_on_commit=False)
+
+    async def scalars(self, statement):
+        """``session.scalars(statement)``, unique and as a list"""
+        async with self.session() as session:
+            return (await session.scalars(statement)).unique().all()
+
+    async def rows(self, statement):
+        """``session.execute(statement).all()``"""
+        async with self.session() as session:
+            return (await session.execute(statement)).all()
+
+    async def dispose(self):
+        """Close the pooled connections, e.g. before the event loop stops"""
+        for engine in self.engines.values():
+            await engine.dispose()
+
+
+async_reads = AsyncReads()
+
+
+def connect_async_reads(app):
+    """Set up the async engines if ``ASYNC_READS`` is on."""
+
+    async_reads.init_app(app)
+
+
+async def feed_validators():
+    """ETag inputs for a feed page; see app.feed_validators"""
+    statement, paginate = feed_query(post_parts())
+    page = paginate(await async_reads.rows(statement))
+    return [validator_parts(page), page.next_cursor, page.prev_cursor], []
+
+
+async def post_validators(post_id):
+    """ETag inputs for a post page"""
+    return post_etag(await async_reads.rows(post_parts(Post.id == post_id)))
+
+
+async def user_validators(user_id):
+    """ETag inputs for a user page; ETag only"""
+    return user_etag(await async_reads.rows(user_parts(user_id)))
+
+
+@page_cache.cached(feed_key)
+@conditional(feed_validators)
+async def show_posts():
+    """Show a page of posts, newest first"""
+    statement, paginate = feed_query(
+        db.select(Post).options(db.joinedload(Post.user),
+                                db.defer(Post.content)))
+    page = annotate(paginate(await async_reads.scalars(statement)))
+    return render_template("posts.html", posts=page, page=page)
+
+
+@page_cache.cached(page_cache.post_key)
+@conditional(post_validators)
+async def show_post(post_id):
+    """Show Post"""
+    posts = await async_reads.scalars(
+        db.select(Post).options(db.joinedload(Post.user))
+        .where(Post.id == post_id))
+    if not posts:
+        abort(404)
+    return render_template("post.html", post=posts[0])
+
+
+@conditional(user_validators)
+async def show_user(user_id):
+    """Show User Details"""
+    users = await async_reads.scalars(db.select(User)
+                                      .where(User.id == user_id))
+    if not users:
+        abort(404)
+    posts = await async_reads.scalars(
+        db.select(Post).filter_by(user_id=user_id)
+        .options(db.defer(Post.content)).order_by(Post.id))
+    return render_template("user_details.html", user=users[0],
+                           posts=annotate(posts))
+
+
+async def letter_counts():
+    """Jump link counts; see app.letter_counts"""
+
+    async def count():
+        return dict(await async_reads.rows(
+            db.select(UserInitial.letter, UserInitial.user_count)))
+    return letter_links(await page_cache.memoize_async(
+        page_cache.users_key('letters'), count))
+
+
+async def list_users():
+    """List Users a page at a time"""
+    sort, statement, paginate = users_query(db.select(User))
+    letters = None if sort else await letter_counts()
+    page = paginate(await async_reads.scalars(statement))
+    return render_template("user.html", users=page, page=page, sort=sort,
+                           letters=letters)
+
+
+# Flask endpoint -> coroutine view serving it.
+VIEWS = {
+    'blog.show_posts': show_posts,
+    'blog.show_post': show_post,
+    'blog.show_user': show_user,
+    'blog.list_users': list_users,
+}
@@ -0,0 +1,317 @@
+"""User avatars served from a local thumbnail cache.
+
+``/avatars/<user_id>`` fetches the user's ``image_url`` once, scales it to
+one of ``AVATAR_SIZES`` (``?size=``, the smallest by default) and keeps the
+result on disk, so pages no longer send visitors to third-party hosts for
+full-size images. Thumbnails are stored under the hash of their contents,
+which is also their ETag; the same picture used by many users is kept once.
+An index maps each source URL and size to its thumbnail. The oldest
+thumbnails are evicted once the cache grows past ``AVATAR_CACHE_MAX_BYTES``,
+along with the index entries pointing at them.
+A source that cannot be fetched is remembered for ``AVATAR_FAILURE_TTL``
+seconds, during which the avatar redirects to it without fetching again.
+Images under ``static/``, like the default avatar, are redirected to.
+
+Thumbnails are scaled with Pillow and stored as PNG. Hosts that resolve
+to private or loopback addresses are not fetched from unless
+``AVATAR_ALLOW_PRIVATE`` is set.
+"""
+
+import hashlib
+import io
+import ipaddress
+import os
+import socket
+import tempfile
+import threading
+import time
+import urllib.request
+from urllib.parse import urlsplit
+
+from flask import (abort, current_app, redirect, request, make_response,
+                   url_for)
+from PIL import Image, ImageOps
+
+from models import db, User
+
+
+class FetchError(Exception):
+    """The source image could not be fetched or read"""
+
+
+def _write_atomic(path, data):
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(handle, 'wb') as f:
+        f.write(data)
+    os.replace(temporary, path)
+
+
+class _CheckedRedirects(urllib.request.HTTPRedirectHandler):
+    """Follow redirects only to hosts ``check`` accepts"""
+
+    def __init__(self, check):
+        self.check = check
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        self.check(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+class AvatarCache:
+    """Content-addressed thumbnails on disk, bounded to ``max_bytes``.
+
+    The blobs' total size is counted once, then kept up to date as this
+    process adds and evicts them, so a ``put`` only scans the directory
+    when the cache is over budget. Blobs written by other processes are
+    counted at the next scan.
+    """
+
+    # Eviction goes this far below max_bytes, so scans stay rare.
+    EVICT_TO = 0.9
+
+    def __init__(self, directory=None, max_bytes=64 << 20, failure_ttl=300):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.failure_ttl = failure_ttl
+        self.evictions = 0
+        self._failures_pruned_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def directory(self):
+        return self._directory
+
+    @directory.setter
+    def directory(self, directory):
+        self._directory = directory
+        # Counted again by the next put.
+        self._size = None
+
+    def _path(self, *parts):
+        return os.path.join(self.directory, *parts)
+
+    @staticmethod
+    def key(url, size):
+        return hashlib.blake2b(f"{size}:{url}".encode(),
+                               digest_size=16).hexdigest()
+
+    def get(self, key):
+        """``(digest, mimetype, data)`` cached under ``key``, or None"""
+        try:
+            with open(self._path('index', key)) as f:
+                digest, mimetype = f.read().split()
+            path = self._path('blobs', digest)
+            with open(path, 'rb') as f:
+                data = f.read()
+        except (FileNotFoundError, ValueError):
+            return None
+        # Eviction goes by modification time; reading keeps a blob fresh.
+        os.utime(path)
+        return digest, mimetype, data
+
+    def failed(self, key):
+        """Whether fetching for ``key`` failed within ``failure_ttl``"""
+        try:
+            failed_at = os.stat(self._path('failures', key)).st_mtime
+        except FileNotFoundError:
+            return False
+        return time.time() - failed_at < self.failure_ttl
+
+    def put_failure(self, key):
+        """Remember that fetching for ``key`` failed just now.
+
+        Expired markers are swept at most once per ``failure_ttl``.
+        """
+        os.makedirs(self._path('failures'), exist_ok=True)
+        _write_atomic(self._path('failures', key), b'')
+        with self._lock:
+            due = time.monotonic() - self._failures_pruned_at >= \
+                self.failure_ttl
+            if due:
+                self._failures_pruned_at = time.monotonic()
+        if due:
+            self.prune_failures()
+
+    def prune_failures(self):
+        """Remove the failure markers older than ``failure_ttl``"""
+        expired = time.time() - self.failure_ttl
+        with os.scandir(self._path('failures')) as entries:
+            for entry in entries:
+                try:
+                    if entry.stat().st_mtime < expired:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    continue
+
+    def put(self, key, mimetype, data):
+        """Store ``data`` under ``key`` and return its digest"""
+        digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+        os.makedirs(self._path('index'), exist_ok=True)
+        os.makedirs(self._path('blobs'), exist_ok=True)
+        path = self._path('blobs', digest)
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            _write_atomic(path, data)
+            with self._lock:
+                if self._size is not None:
+                    self._size += len(data)
+        _write_atomic(self._path('index', key),
+                      f"{digest} {mimetype}".encode())
+        if self._size is None or self._size > self.max_bytes:
+            self.evict()
+        return digest
+
+    def evict(self):
+        """Remove the least recently used blobs once over ``max_bytes``.
+
+        Index entries left pointing at a removed blob go with it.
+        """
+        with self._lock:
+            with os.scandir(self._path('blobs')) as entries:
+                blobs = [(entry.stat().st_mtime, entry.stat().st_size,
+                          entry.path) for entry in entries
+                         if entry.is_file()]
+            total = sum(size for _, size, _ in blobs)
+            target = (self.max_bytes if total <= self.max_bytes
+                      else self.max_bytes * self.EVICT_TO)
+            evicted = False
+            for _, size, path in sorted(blobs):
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                total -= size
+                self.evictions += 1
+                evicted = True
+            self._size = total
+            if evicted:
+                self._prune_index()
+
+    def _prune_index(self):
+        with os.scandir(self._path('index')) as entries:
+            for entry in entries:
+                try:
+                    with open(entry.path) as f:
+                        digest = f.read().split()[0]
+                    if not os.path.exists(self._path('blobs', digest)):
+                        os.remove(entry.path)
+                except (FileNotFoundError, IndexError):
+                    continue
+
+
+class Avatars:
+    """Fetching, scaling and serving avatars (see the module docstring)"""
+
+    def __init__(self):
+        self.cache = AvatarCache()
+        self.sizes = (50, 100)
+        self.timeout = 5
+        self.max_source_bytes = 5 << 20
+        self.max_age = 3600
+        self.allow_private = False
+
+    def check_host(self, url):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise FetchError(f"Not an http(s) URL: {url!r}")
+        if self.allow_private:
+            return
+        try:
+            addresses = socket.getaddrinfo(parts.hostname, parts.port,
+                                           proto=socket.IPPROTO_TCP)
+        except OSError as e:
+            raise FetchError(str(e)) from e
+        for *_, sockaddr in addresses:
+            address = ipaddress.ip_address(sockaddr[0])
+            if not address.is_global:
+                raise FetchError(f"{parts.hostname} is not a public host")
+
+    def fetch(self, url):
+        """``(mimetype, bytes)`` of the image at ``url``"""
+        self.check_host(url)
+        opener = urllib.request.build_opener(
+            _CheckedRedirects(self.check_host))
+        try:
+            with opener.open(url, timeout=self.timeout) as resp:
+                mimetype = resp.headers.get_content_type()
+                data = resp.read(self.max_source_bytes + 1)
+        except (OSError, ValueError) as e:
+            raise FetchError(str(e)) from e
+        if not mimetype.startswith('image/'):
+            raise FetchError(f"{url} is {mimetype}, not an image")
+        if len(data) > self.max_source_bytes:
+            raise FetchError(f"{url} is over {self.max_source_bytes} bytes")
+        return mimetype, data
+
+    def thumbnail(self, mimetype, data, size):
+        """``(mimetype, bytes)`` scaled to fit ``size`` pixels square"""
+        try:
+            image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+            image.thumbnail((size, size))
+            output = io.BytesIO()
+            image.convert('RGBA').save(output, 'PNG', optimize=True)
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            raise FetchError(str(e)) from e
+        return 'image/png', output.getvalue()
+
+    def load(self, url, size):
+        """``(digest, mimetype, data)`` for ``url`` at ``size``, cached"""
+        key = self.cache.key(url, size)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        if self.cache.failed(key):
+            raise FetchError(
+                f"{url} failed in the last {self.cache.failure_ttl}s")
+        try:
+            mimetype, data = self.thumbnail(*self.fetch(url), size)
+        except FetchError:
+            self.cache.put_failure(key)
+            raise
+        return self.cache.put(key, mimetype, data), mimetype, data
+
+
+avatars = Avatars()
+
+
+def show_avatar(user_id):
+    """A user's avatar thumbnail"""
+    size = request.args.get('size', avatars.sizes[0], int)
+    if size not in avatars.sizes:
+        abort(400)
+    url = db.session.scalar(db.select(User.image_url)
+                            .where(User.id == user_id))
+    if url is None:
+        abort(404)
+    static = current_app.static_url_path + '/'
+    if url.startswith(static):
+        return redirect(url_for('static', filename=url[len(static):]))
+    try:
+        digest, mimetype, data = avatars.load(url, size)
+    except FetchError:
+        # Let the browser try the original, as pages used to.
+        return redirect(url)
+    response = make_response(data)
+    response.mimetype = mimetype
+    response.set_etag(digest)
+    response.headers['Cache-Control'] = f'public, max-age={avatars.max_age}'
+    return response.make_conditional(request)
+
+
+def connect_avatars(app):
+    """Serve ``/avatars/<user_id>`` with the app's avatar settings."""
+
+    avatars.cache.directory = app.config['AVATAR_CACHE_DIR']
+    avatars.cache.max_bytes = app.config.get('AVATAR_CACHE_MAX_BYTES',
+                                             64 << 20)
+    avatars.sizes = tuple(app.config.get('AVATAR_SIZES', (50, 100)))
+    avatars.timeout = app.config.get('AVATAR_FETCH_TIMEOUT', 5)
+    avatars.max_source_bytes = app.config.get('AVATAR_MAX_SOURCE_BYTES',
+                                              5 << 20)
+    avatars.max_age = app.config.get('AVATAR_MAX_AGE', 3600)
+    avatars.cache.failure_ttl = app.config.get('AVATAR_FAILURE_TTL', 300)
+    avatars.allow_private = app.config.get('AVATAR_ALLOW_PRIVATE', False)
+    app.add_url_rule('/avatars/<int:user_id>', 'avatar', show_avatar)
@@ -0,0 +1,85 @@
+"""Benchmark a /posts page of long posts: whole bodies vs stored excerpts.
+
+Usage: python bench_excerpts.py [rows] [body_kb] [per_page]
+
+"before" loads full Post rows, as the feed did; "after" defers
+Post.content and renders from Post.excerpt. Bytes are the text columns
+each page moves from the database.
+
+Runs against BENCH_DATABASE_URI (default: in-memory SQLite), e.g.
+BENCH_DATABASE_URI=postgresql:///blogly_bench python bench_excerpts.py
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+from sqlalchemy.orm import Session, defer, joinedload
+
+from models import db, Post, User, excerpt_of
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000
+BODY_KB = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+PER_PAGE = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+REPEAT = 20
+
+
+def load(engine):
+    db.metadata.drop_all(engine)
+    db.metadata.create_all(engine)
+    start = datetime(2021, 5, 1)
+    body = ("lorem ipsum dolor sit amet " * (BODY_KB * 40))[:BODY_KB * 1024]
+    with engine.begin() as conn:
+        user_id = conn.execute(sa.insert(User.__table__)
+                               .values(first_name="Bench", last_name="User")
+                               .returning(User.__table__.c.id)).scalar_one()
+        for offset in range(0, ROWS, 1_000):
+            conn.execute(sa.insert(Post.__table__), [
+                {"title": f"Post {i}", "content": body,
+                 "excerpt": excerpt_of(body), "content_length": len(body),
+                 "created_at": start + timedelta(seconds=i * 37),
+                 "modified_on": None, "user_id": user_id}
+                for i in range(offset, min(offset + 1_000, ROWS))])
+
+
+def page(session, *options):
+    return session.scalars(
+        sa.select(Post).options(joinedload(Post.user), *options)
+        .order_by(Post.created_at.desc(), Post.id.desc())
+        .limit(PER_PAGE)).unique().all()
+
+
+def before(session):
+    posts = page(session)
+    return sum(len(post.title) + len(post.content) for post in posts)
+
+
+def after(session):
+    posts = page(session, defer(Post.content))
+    return sum(len(post.title) + len(post.homepage_content)
+               for post in posts)
+
+
+def timed(engine, fn):
+    begin = time.perf_counter()
+    for _ in range(REPEAT):
+        with Session(engine) as session:
+            moved = fn(session)
+    return (time.perf_counter() - begin) / REPEAT * 1000, moved
+
+
+def main():
+    engine = sa.create_engine(os.environ.get("BENCH_DATABASE_URI",
+                                             "sqlite://"))
+    print(f"loading {ROWS} posts of {BODY_KB} KiB into "
+          f"{engine.url.render_as_string()}")
+    load(engine)
+    print(f"{'':>6} {'page ms':>10} {'bytes/row':>10}")
+    for name, fn in (("before", before), ("after", after)):
+        ms, moved = timed(engine, fn)
+        print(f"{name:>6} {ms:>10.3f} {moved // PER_PAGE:>10}")
+
+
+if __name__ == "__main__":
+    main()
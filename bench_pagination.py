@@ -0,0 +1,88 @@
+"""Benchmark deep /posts pages: OFFSET paging vs keyset cursors.
+
+Usage: python bench_pagination.py [rows] [per_page]
+
+Runs against BENCH_DATABASE_URI (default: in-memory SQLite), e.g.
+BENCH_DATABASE_URI=postgresql:///blogly_bench python bench_pagination.py
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+
+from models import db, Post, User
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+PER_PAGE = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+REPEAT = 20
+
+posts = Post.__table__
+
+
+def load(engine):
+    db.metadata.drop_all(engine)
+    db.metadata.create_all(engine)
+    start = datetime(2021, 5, 1)
+    with engine.begin() as conn:
+        user_id = conn.execute(sa.insert(User.__table__)
+                               .values(first_name="Bench", last_name="User")
+                               .returning(User.__table__.c.id)).scalar_one()
+        for offset in range(0, ROWS, 10_000):
+            conn.execute(sa.insert(posts), [
+                {"title": f"Post {i}", "content": "Lorem ipsum",
+                 "created_at": start + timedelta(seconds=i * 37),
+                 "modified_on": None, "user_id": user_id}
+                for i in range(offset, min(offset + 10_000, ROWS))])
+
+
+def feed():
+    return sa.select(posts.c.id, posts.c.title, posts.c.created_at) \
+        .order_by(posts.c.created_at.desc(), posts.c.id.desc()) \
+        .limit(PER_PAGE)
+
+
+def offset_page(conn, depth):
+    return conn.execute(feed().offset(depth * PER_PAGE)).all()
+
+
+def cursor_before(conn, depth):
+    """Cursor a reader would hold after paging ``depth`` pages in"""
+    row = conn.execute(sa.select(posts.c.created_at, posts.c.id)
+                       .order_by(posts.c.created_at.desc(), posts.c.id.desc())
+                       .offset(depth * PER_PAGE - 1).limit(1)).one()
+    return tuple(row)
+
+
+def keyset_page(conn, cursor):
+    return conn.execute(feed().where(
+        sa.tuple_(posts.c.created_at, posts.c.id) < sa.tuple_(*cursor))).all()
+
+
+def timed(fn, *args):
+    begin = time.perf_counter()
+    for _ in range(REPEAT):
+        rows = fn(*args)
+    return (time.perf_counter() - begin) / REPEAT * 1000, rows
+
+
+def main():
+    engine = sa.create_engine(os.environ.get("BENCH_DATABASE_URI",
+                                             "sqlite://"))
+    print(f"loading {ROWS} posts into {engine.url.render_as_string()}")
+    load(engine)
+    pages = ROWS // PER_PAGE
+    print(f"{'page':>10} {'offset ms':>10} {'keyset ms':>10}")
+    with engine.connect() as conn:
+        for depth in sorted({1, 10, 100, pages // 100, pages // 10,
+                             pages // 2, pages - 1} - {0}):
+            cursor = cursor_before(conn, depth)
+            offset_ms, expected = timed(offset_page, conn, depth)
+            keyset_ms, rows = timed(keyset_page, conn, cursor)
+            assert [r.id for r in rows] == [r.id for r in expected]
+            print(f"{depth:>10} {offset_ms:>10.3f} {keyset_ms:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+"""Load test every Blogly route through the real WSGI app.
+
+Usage: python bench_routes.py [--users N] [--posts N] [--workers N]
+                              [--requests N] [--out FILE] [--compare FILE]
+
+Seeds a fresh dataset with ``flask generate-data``, then has ``--workers``
+threads each issue ``--requests`` requests drawn from a weighted mix of
+reads (feed, deep feed pages, post and user pages, search, forms) and
+write flows (create, edit and delete posts and users). Reports p50/p95/p99
+latency and requests/sec per route.
+
+Runs against BENCH_DATABASE_URI (default: a throwaway SQLite file). Its
+tables are dropped and recreated unless --reuse is given, e.g.
+BENCH_DATABASE_URI=postgresql:///blogly_bench python bench_routes.py
+
+``--out`` saves the results as JSON; ``--compare`` checks them against an
+earlier run and exits 1 if any route's p95 grew by more than
+``--threshold`` or its throughput fell by as much.
+"""
+import argparse
+import atexit
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, UTC
+
+SCENARIOS = {}
+
+
+def scenario(weight):
+    def register(fn):
+        SCENARIOS[fn.__name__] = (weight, fn)
+        return fn
+    return register
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--posts', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=250,
+                        help='Requests per worker.')
+    parser.add_argument('--warmup', type=int, default=20,
+                        help='Untimed requests per worker.')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--reuse', action='store_true',
+                        help='Keep the existing tables and data.')
+    parser.add_argument('--out', help='Write results to this JSON file.')
+    parser.add_argument('--compare', help='Baseline results JSON.')
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help='Allowed relative regression (default 0.15).')
+    return parser.parse_args(argv)
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    rank = max(int(round(fraction * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def summarize(latencies, errors, elapsed):
+    ordered = sorted(latencies)
+    return {
+        'requests': len(ordered),
+        'errors': errors,
+        'rps': round(len(ordered) / elapsed, 2) if elapsed else 0.0,
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3)
+        if ordered else 0.0,
+        'p50_ms': round(percentile(ordered, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(ordered, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(ordered, 0.99) * 1000, 3),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Routes that got slower than ``baseline`` by more than ``threshold``"""
+    regressions = []
+    for route, now in results['routes'].items():
+        before = baseline['routes'].get(route)
+        if not before or not before['requests']:
+            continue
+        if before['p95_ms'] and \
+                now['p95_ms'] > before['p95_ms'] * (1 + threshold):
+            regressions.append(f"{route}: p95 {before['p95_ms']:.2f} -> "
+                               f"{now['p95_ms']:.2f} ms")
+        if before['rps'] and now['rps'] < before['rps'] * (1 - threshold):
+            regressions.append(f"{route}: {before['rps']:.1f} -> "
+                               f"{now['rps']:.1f} req/s")
+    return regressions
+
+
+class Recorder:
+    """Per-route latencies shared by the worker threads"""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, route, seconds, ok):
+        with self._lock:
+            self.latencies.setdefault(route, []).append(seconds)
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+
+class Worker:
+    """One simulated client with its own cookie jar"""
+
+    def __init__(self, app, data, recorder, rng):
+        self.client = app.test_client()
+        self.data = data
+        self.recorder = recorder
+        self.rng = rng
+
+    def request(self, route, method, url, expect=(200,), **kwargs):
+        started = time.perf_counter()
+        resp = self.client.open(url, method=method, **kwargs)
+        elapsed = time.perf_counter() - started
+        if self.recorder is not None:
+            self.recorder.record(route, elapsed,
+                                 resp.status_code in expect)
+        return resp
+
+    def post_id(self):
+        return self.rng.choice(self.data['post_ids'])
+
+    def user_id(self):
+        return self.rng.choice(self.data['user_ids'])
+
+
+@scenario(20)
+def feed(worker):
+    worker.request('GET /posts', 'GET', '/posts')
+
+
+@scenario(8)
+def feed_deep(worker):
+    cursor = worker.rng.choice(worker.data['cursors'])
+    worker.request('GET /posts?before', 'GET', f'/posts?before={cursor}')
+
+
+@scenario(2)
+def home(worker):
+    worker.request('GET /', 'GET', '/', expect=(302,))
+
+
+@scenario(20)
+def post_detail(worker):
+    worker.request('GET /posts/<id>', 'GET', f'/posts/{worker.post_id()}')
+
+
+@scenario(6)
+def user_list(worker):
+    worker.request('GET /users', 'GET', '/users')
+
+
+@scenario(12)
+def user_detail(worker):
+    worker.request('GET /users/<id>', 'GET', f'/users/{worker.user_id()}')
+
+
+@scenario(6)
+def search(worker):
+    term = worker.rng.choice(('lorem', 'dolor sit', 'magna', 'tempor'))
+    worker.request('GET /search', 'GET', '/search', query_string={'q': term})
+
+
+@scenario(2)
+def not_found(worker):
+    worker.request('GET 404', 'GET', '/posts/0', expect=(404,))
+
+
+@scenario(3)
+def forms(worker):
+    worker.request('GET /users/new', 'GET', '/users/new')
+    worker.request('GET /users/<id>/posts/new', 'GET',
+                   f'/users/{worker.user_id()}/posts/new')
+    worker.request('GET /posts/<id>/edit', 'GET',
+                   f'/posts/{worker.post_id()}/edit')
+    worker.request('GET /users/<id>/edit', 'GET',
+                   f'/users/{worker.user_id()}/edit')
+
+
+@scenario(4)
+def create_edit_delete_post(worker):
+    title = f"Bench {worker.rng.getrandbits(48):x}"
+    worker.request('POST /users/<id>/posts/new', 'POST',
+                   f'/users/{worker.user_id()}/posts/new', expect=(302,),
+                   data={'title': title, 'content': 'Lorem ipsum'})
+    post_id = worker.data['post_titled'](title)
+    worker.request('POST /posts/<id>/edit', 'POST', f'/posts/{post_id}/edit',
+                   expect=(302,),
+                   data={'title': title, 'content': 'Dolor sit'})
+    worker.request('POST /posts/<id>/delete', 'POST',
+                   f'/posts/{post_id}/delete', expect=(302,))
+
+
+@scenario(2)
+def create_edit_delete_user(worker):
+    name = f"Bench{worker.rng.getrandbits(48):x}"
+    worker.request('POST /users/new', 'POST', '/users/new', expect=(302,),
+                   data={'first_name': 'Load', 'middle_name': '',
+                         'last_name': name, 'image_url': ''})
+    user_id = worker.data['user_named'](name)
+    worker.request('POST /users/<id>/edit', 'POST', f'/users/{user_id}/edit',
+                   expect=(302,),
+                   data={'first_name': 'Load', 'middle_name': 'B',
+                         'last_name': name, 'image_url': ''})
+    worker.request('POST /users/<id>/delete', 'POST',
+                   f'/users/{user_id}/delete', expect=(302,))
+
+
+def run_worker(app, data, recorder, seed, warmup, count):
+    rng = random.Random(seed)
+    names = list(SCENARIOS)
+    weights = [SCENARIOS[name][0] for name in names]
+    worker = Worker(app, data, None, rng)
+    for _ in range(warmup):
+        SCENARIOS[rng.choices(names, weights)[0]][1](worker)
+    worker.recorder = recorder
+    for _ in range(count):
+        SCENARIOS[rng.choices(names, weights)[0]][1](worker)
+
+
+def prepare(app, args):
+    """Seed the database and collect the ids the scenarios draw from"""
+    from sqlalchemy import select, func
+
+    from datagen import generate_data
+    from models import db, User, Post
+    from pagination import encode_cursor
+
+    with app.app_context():
+        if not args.reuse:
+            db.drop_all()
+            db.create_all()
+            result = app.test_cli_runner().invoke(
+                generate_data, ['--users', str(args.users),
+                                '--posts', str(args.posts)])
+            if result.exit_code:
+                raise SystemExit(result.output)
+            print(result.output.strip())
+        user_ids = db.session.scalars(select(User.id)).all()
+        posts = db.session.execute(
+            select(Post.id, Post.created_at).order_by(func.random())
+            .limit(10_000)).all()
+        db.session.remove()
+    if not user_ids or not posts:
+        raise SystemExit("benchmark database has no users or posts")
+
+    def post_titled(title):
+        with app.app_context():
+            return db.session.scalar(select(Post.id)
+                                     .filter(Post.title == title))
+
+    def user_named(last_name):
+        with app.app_context():
+            return db.session.scalar(select(User.id)
+                                     .filter(User.last_name == last_name))
+
+    return {'user_ids': user_ids,
+            'post_ids': [post.id for post in posts],
+            'cursors': [encode_cursor([post.created_at, post.id])
+                        for post in posts[:500]],
+            'post_titled': post_titled,
+            'user_named': user_named}
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if 'BENCH_DATABASE_URI' in os.environ:
+        os.environ['DATABASE_URL'] = os.environ['BENCH_DATABASE_URI']
+    else:
+        directory = tempfile.mkdtemp()
+        atexit.register(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, 'bench_routes.db')
+        os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    os.environ.setdefault('BLOGLY_ENV', 'production')
+    from app import app
+
+    print(f"database {app.config['SQLALCHEMY_DATABASE_URI']}")
+    data = prepare(app, args)
+    recorder = Recorder()
+    threads = [threading.Thread(target=run_worker,
+                                args=(app, data, recorder, args.seed + n,
+                                      args.warmup, args.requests))
+               for n in range(args.workers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    routes = {route: summarize(latencies, recorder.errors.get(route, 0),
+                               elapsed)
+              for route, latencies in sorted(recorder.latencies.items())}
+    results = {
+        'meta': {'date': datetime.now(UTC).isoformat(timespec='seconds'),
+                 'database': app.config['SQLALCHEMY_DATABASE_URI']
+                 .split(':', 1)[0],
+                 'python': platform.python_version(),
+                 'users': args.users, 'posts': args.posts,
+                 'workers': args.workers, 'requests': args.requests,
+                 'seed': args.seed},
+        'total': summarize([s for latencies in recorder.latencies.values()
+                            for s in latencies],
+                           sum(recorder.errors.values()), elapsed),
+        'routes': routes,
+    }
+
+    print(f"{'route':<28} {'reqs':>6} {'err':>4} {'req/s':>8} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for route, stats in [*routes.items(), ('TOTAL', results['total'])]:
+        print(f"{route:<28} {stats['requests']:>6} {stats['errors']:>4} "
+              f"{stats['rps']:>8.1f} {stats['p50_ms']:>8.2f} "
+              f"{stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}")
+
+    if args.out:
+        with open(args.out, 'w') as out:
+            json.dump(results, out, indent=2)
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(results, json.load(baseline),
+                                  args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
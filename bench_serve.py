@@ -0,0 +1,146 @@
+"""Benchmark how serve.py's throughput scales with its worker count.
+
+Usage: python bench_serve.py [--workers 1,2,4] [--threads N] [--clients N]
+                             [--seconds N] [--users N] [--posts N]
+
+Seeds a dataset as bench_routes.py does, then for each worker count starts
+serve.py and has ``--clients`` client processes request feed, post and user
+pages as fast as they can for ``--seconds``. Reports requests/sec and p50 /
+p95 latency per worker count.
+
+Runs against BENCH_DATABASE_URI (default: a throwaway SQLite file), e.g.
+BENCH_DATABASE_URI=postgresql:///blogly_bench python bench_serve.py
+"""
+import argparse
+import atexit
+import http.client
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_routes import percentile, prepare
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--workers', default='1,2,4',
+                        help='Worker counts to compare.')
+    parser.add_argument('--threads', type=int, default=4,
+                        help='Threads per worker.')
+    parser.add_argument('--clients', type=int, default=os.cpu_count() or 4,
+                        help='Client processes, each with one connection.')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--posts', type=int, default=5000)
+    parser.add_argument('--reuse', action='store_true',
+                        help='Keep the existing tables and data.')
+    return parser.parse_args(argv)
+
+
+def client(address, paths, seconds, seed, results):
+    rng = random.Random(seed)
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            # serve.py speaks HTTP/1.0: one connection per request.
+            connection = http.client.HTTPConnection(*address, timeout=30)
+            connection.request('GET', rng.choice(paths))
+            ok = connection.getresponse().status == 200
+            connection.close()
+        except OSError:
+            ok = False
+        if ok:
+            latencies.append(time.perf_counter() - started)
+        else:
+            errors += 1
+    results.put((latencies, errors))
+
+
+def start_server(workers, threads):
+    server = subprocess.Popen(
+        [sys.executable, '-W', 'ignore', 'serve.py', '--port', '0',
+         '--workers', str(workers), '--threads', str(threads)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.PIPE, text=True)
+    host, port = re.search(r'http://([^:]+):(\d+)',
+                           server.stdout.readline()).groups()
+    address = (host, int(port))
+    for _ in range(100):
+        try:
+            connection = http.client.HTTPConnection(*address, timeout=5)
+            connection.request('GET', '/posts')
+            connection.getresponse().read()
+            break
+        except OSError:
+            time.sleep(0.1)
+    # Let every worker finish starting before timing.
+    time.sleep(1)
+    return server, address
+
+
+def measure(address, paths, args):
+    results = multiprocessing.Queue()
+    clients = [multiprocessing.Process(
+        target=client, args=(address, paths, args.seconds, n, results))
+        for n in range(args.clients)]
+    for process in clients:
+        process.start()
+    gathered = [results.get() for _ in clients]
+    for process in clients:
+        process.join()
+    latencies = sorted(s for found, _ in gathered for s in found)
+    return (len(latencies) / args.seconds, percentile(latencies, 0.5),
+            percentile(latencies, 0.95), sum(e for _, e in gathered))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if 'BENCH_DATABASE_URI' in os.environ:
+        os.environ['DATABASE_URL'] = os.environ['BENCH_DATABASE_URI']
+    else:
+        directory = tempfile.mkdtemp()
+        atexit.register(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, 'bench_serve.db')
+        os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    os.environ.setdefault('BLOGLY_ENV', 'production')
+    from app import create_app
+    from models import db
+
+    app = create_app()
+    print(f"database {app.config['SQLALCHEMY_DATABASE_URI']}")
+    data = prepare(app, args)
+    with app.app_context():
+        db.engine.dispose()
+    paths = (['/posts', '/users'] * 10 +
+             [f"/posts/{post_id}" for post_id in data['post_ids'][:50]] +
+             [f"/users/{user_id}" for user_id in data['user_ids'][:50]])
+
+    print(f"{args.clients} clients, {args.threads} threads per worker, "
+          f"{os.cpu_count()} CPUs")
+    print(f"{'workers':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'err':>5} {'speedup':>8}")
+    baseline = None
+    for workers in map(int, args.workers.split(',')):
+        server, address = start_server(workers, args.threads)
+        try:
+            rps, p50, p95, errors = measure(address, paths, args)
+        finally:
+            server.terminate()
+            server.wait()
+            server.stdout.close()
+        baseline = baseline or rps
+        print(f"{workers:>7} {rps:>9.1f} {p50 * 1000:>8.2f} "
+              f"{p95 * 1000:>8.2f} {errors:>5} {rps / baseline:>7.2f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,52 @@
+"""Microbenchmark: per-post cost of the friendly timestamps on a feed.
+
+Usage: python bench_timestamps.py [posts]
+
+"before" is the original per-property path (tzlocal lookup and an
+isoformat round-trip per timestamp); "after" is timefmt.annotate over the
+whole result set.
+"""
+import sys
+import timeit
+from datetime import datetime, timedelta, UTC
+from random import randint
+from types import SimpleNamespace
+
+import tzlocal
+
+from models import Post
+from timefmt import annotate
+
+POSTS = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+
+
+def before(posts):
+    for post in posts:
+        for timestamp in (post.created_at, post.modified_on):
+            Post.get_friendly(datetime.now(UTC) -
+                              datetime.fromisoformat(
+                                  timestamp.replace(
+                                      tzinfo=tzlocal.get_localzone())
+                                  .isoformat()))
+        (post.modified_on - post.created_at).total_seconds() // 1 > 0
+
+
+def after(posts):
+    annotate(posts)
+
+
+def main():
+    start = datetime(2021, 5, 1)
+    posts = []
+    for _ in range(POSTS):
+        created_at = start + timedelta(seconds=randint(0, 365 * 86400))
+        posts.append(SimpleNamespace(
+            created_at=created_at,
+            modified_on=created_at + timedelta(seconds=randint(0, 86400))))
+    for name, fn in (("before", before), ("after", after)):
+        best = min(timeit.repeat(lambda: fn(posts), number=1, repeat=5))
+        print(f"{name:>6}: {best / POSTS * 1e6:8.2f} us/post")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Benchmark sustained post creation: synchronous vs write-behind commits.
+
+Usage: python bench_writes.py [posts] [workers]
+
+Each mode in writebehind.MODES has ``workers`` threads submit ``posts``
+posts in total through POST /users/<id>/posts/new. Throughput counts a post
+once it is committed, so ``async`` includes draining the queue.
+
+Runs against BENCH_DATABASE_URI (default: a throwaway SQLite file), whose
+tables are dropped and recreated, e.g.
+BENCH_DATABASE_URI=postgresql:///blogly_bench python bench_writes.py
+"""
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+POSTS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+WORKERS = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+
+def submit(app, user_ids, count):
+    client = app.test_client()
+    for i in range(count):
+        user_id = user_ids[i % len(user_ids)]
+        resp = client.post(f"/users/{user_id}/posts/new",
+                           data={'title': f"Bench {i}",
+                                 'content': 'Lorem ipsum dolor sit amet'})
+        assert resp.status_code == 302, resp.status_code
+
+
+def run(app, mode, user_ids):
+    from models import db, Post
+    from writebehind import post_writer
+
+    app.config['POST_WRITE_MODE'] = mode
+    with app.app_context():
+        Post.query.delete()
+        db.session.commit()
+    share = POSTS // WORKERS
+    threads = [threading.Thread(target=submit,
+                                args=(app, user_ids[n::WORKERS] or user_ids,
+                                      share))
+               for n in range(WORKERS)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    acknowledged = time.perf_counter() - started
+    post_writer.stop()
+    committed = time.perf_counter() - started
+    with app.app_context():
+        saved = Post.query.count()
+    assert saved == share * WORKERS, (mode, saved)
+    return saved, acknowledged, committed
+
+
+def main():
+    if 'BENCH_DATABASE_URI' in os.environ:
+        os.environ['DATABASE_URL'] = os.environ['BENCH_DATABASE_URI']
+    else:
+        directory = tempfile.mkdtemp()
+        atexit.register(shutil.rmtree, directory, ignore_errors=True)
+        os.environ['DATABASE_URL'] = \
+            f"sqlite:///{os.path.join(directory, 'bench_writes.db')}"
+    os.environ.setdefault('BLOGLY_ENV', 'production')
+    os.environ.setdefault('BLOGLY_SERVER_TIMING', '0')
+    from app import app
+    from models import db, User
+    from writebehind import MODES
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        users = [User(first_name="Bench", last_name=f"User{i}")
+                 for i in range(WORKERS * 4)]
+        db.session.add_all(users)
+        db.session.commit()
+        user_ids = [user.id for user in users]
+
+    print(f"{POSTS} posts, {WORKERS} workers, "
+          f"{app.config['SQLALCHEMY_DATABASE_URI'].split(':', 1)[0]}")
+    print(f"{'mode':>6} {'posts':>7} {'acked/s':>9} {'committed/s':>12}")
+    for mode in MODES:
+        saved, acknowledged, committed = run(app, mode, user_ids)
+        print(f"{mode:>6} {saved:>7} {saved / acknowledged:>9.0f} "
+              f"{saved / committed:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
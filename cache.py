@@ -0,0 +1,361 @@
+"""Rendered page cache for Blogly."""
+
+import inspect
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import session, make_response
+from werkzeug.http import parse_date
+
+from conditional import respond
+from metrics import registry
+from routing import pinned_to_primary
+
+
+class LocalBackend:
+    """In-process LRU cache whose entries also expire after ``ttl`` seconds"""
+
+    def __init__(self, max_entries=1024, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def generation(self, name):
+        with self._lock:
+            return self._generations.get(name, 0)
+
+    def bump(self, name):
+        with self._lock:
+            self._generations[name] = self._generations.get(name, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SharedBackend:
+    """Cache kept in a store shared by every worker.
+
+    ``client`` needs the Redis subset ``get``, ``set(ex=, nx=)``, ``delete``,
+    ``incr`` and ``scan_iter``, so a ``redis.Redis`` instance works as-is and
+    :class:`StubClient` stands in for it locally. LRU eviction is left to
+    the store (e.g. ``maxmemory-policy allkeys-lru``).
+    """
+
+    evictions = 0
+    expirations = 0
+
+    def __init__(self, client, ttl=60, prefix='blogly:cache:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return value.decode() if isinstance(value, bytes) else value
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, value, ex=self.ttl)
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*(self.prefix + key for key in keys))
+
+    def generation(self, name):
+        key = f"{self.prefix}gen:{name}"
+        value = self.client.get(key)
+        if value is None:
+            # Never restart from a number another worker may have used.
+            self.client.set(key, time.time_ns(), nx=True)
+            value = self.client.get(key)
+        return int(value)
+
+    def bump(self, name):
+        self.client.incr(f"{self.prefix}gen:{name}")
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+    def __len__(self):
+        return sum(1 for _ in self.client.scan_iter(match=self.prefix + '*'))
+
+
+class StubClient:
+    """Process-local stand-in for a Redis client"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key):
+        entry = self._data.get(key)
+        if entry is not None and entry[1] is not None \
+                and entry[1] <= time.monotonic():
+            del self._data[key]
+            return None
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live(key)
+            return None if entry is None else entry[0]
+
+    def set(self, key, value, ex=None, nx=False):
+        with self._lock:
+            if nx and self._live(key) is not None:
+                return False
+            self._data[key] = (value, None if ex is None
+                               else time.monotonic() + ex)
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+    def incr(self, key):
+        with self._lock:
+            entry = self._live(key)
+            value = int(entry[0]) + 1 if entry else 1
+            self._data[key] = (value, entry[1] if entry else None)
+            return value
+
+    def scan_iter(self, match='*'):
+        prefix = match.rstrip('*')
+        with self._lock:
+            keys = [key for key in self._data if key.startswith(prefix)]
+        return iter(keys)
+
+
+class PageCache:
+    """Caches rendered feed and post pages until a write touches them"""
+
+    def __init__(self):
+        self.backend = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        kind = app.config.get('PAGE_CACHE', 'local')
+        ttl = app.config.get('PAGE_CACHE_TTL', 60)
+        if kind == 'local':
+            self.backend = LocalBackend(
+                app.config.get('PAGE_CACHE_MAX_ENTRIES', 1024), ttl)
+        elif kind == 'shared':
+            self.backend = SharedBackend(
+                app.config.get('PAGE_CACHE_CLIENT') or StubClient(), ttl)
+        elif kind:
+            raise ValueError(f"Unknown PAGE_CACHE backend {kind!r}")
+
+    def cached(self, key_func):
+        """Serve a view's rendered body from the cache under ``key_func()``.
+
+        Validators set by :func:`conditional.conditional` are cached with the
+        body, so conditional requests that hit the cache skip the database.
+        Pages carrying flash messages are neither served from nor stored in
+        the cache, since the messages belong to one visitor. Visitors pinned
+        to the primary after a write render afresh (see routing.py).
+        Coroutine views (see asgi.py) are wrapped the same way.
+        """
+
+        def decorator(view):
+            if inspect.iscoroutinefunction(view):
+                @wraps(view)
+                async def async_wrapper(*args, **kwargs):
+                    if self.backend is None or session.get('_flashes'):
+                        return await view(*args, **kwargs)
+                    key = key_func(*args, **kwargs)
+                    response = self._lookup(key)
+                    if response is None:
+                        response = self._store(
+                            key, await view(*args, **kwargs))
+                    return response
+                return async_wrapper
+
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if self.backend is None or session.get('_flashes'):
+                    return view(*args, **kwargs)
+                key = key_func(*args, **kwargs)
+                response = self._lookup(key)
+                if response is None:
+                    response = self._store(key, view(*args, **kwargs))
+                return response
+            return wrapper
+        return decorator
+
+    def _lookup(self, key):
+        """The cached response under ``key``, or None"""
+        entry = self._get(key)
+        if entry is None:
+            return None
+        body, etag, last_modified = json.loads(entry)
+        if etag is None:
+            return make_response(body)
+        return respond(body, etag, parse_date(last_modified))
+
+    def _store(self, key, rv):
+        """Response for the view's return value ``rv``, cached if it can be"""
+        response = make_response(rv)
+        if response.status_code == 200 and not response.is_streamed:
+            self.backend.set(key, json.dumps([
+                response.get_data(as_text=True),
+                response.get_etag()[0],
+                response.headers.get('Last-Modified')]))
+        return response
+
+    def _key(self, name, parts):
+        generation = (self.backend.generation(name)
+                      if self.backend is not None else 0)
+        return ':'.join([name, str(generation), *map(str, parts)])
+
+    def feed_key(self, *parts):
+        """Key for a feed page; changes whenever any post changes"""
+        return self._key('feed', parts)
+
+    def users_key(self, *parts):
+        """Key for user directory data; changes whenever a user changes"""
+        return self._key('users', parts)
+
+    def memoize(self, key, compute):
+        """``compute()``, kept JSON-encoded in the cache under ``key``"""
+        if self.backend is None:
+            return compute()
+        entry = self._get(key)
+        if entry is not None:
+            return json.loads(entry)
+        value = compute()
+        self.backend.set(key, json.dumps(value))
+        return value
+
+    async def memoize_async(self, key, compute):
+        """:meth:`memoize` for a coroutine function ``compute``"""
+        if self.backend is None:
+            return await compute()
+        entry = self._get(key)
+        if entry is not None:
+            return json.loads(entry)
+        value = await compute()
+        self.backend.set(key, json.dumps(value))
+        return value
+
+    def _get(self, key):
+        if pinned_to_primary():
+            # A lagging replica may have stored this since the visitor's
+            # write; the primary's version replaces it.
+            return None
+        entry = self.backend.get(key)
+        self._record(entry is not None)
+        return entry
+
+    def _record(self, hit):
+        # Request threads share the counters; += is not atomic.
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def post_key(self, post_id):
+        """Key for a post page; changes whenever that post changes.
+
+        A render that began before an edit committed stores its page under
+        the old key, where no later request looks.
+        """
+        return self._key(f'post:{post_id}', [])
+
+    def invalidate_posts(self, *post_ids):
+        """Drop the pages of ``post_ids`` and every cached feed page"""
+        if self.backend is None:
+            return
+        for post_id in post_ids:
+            self.backend.bump(f'post:{post_id}')
+        self.backend.bump('feed')
+
+    def invalidate_users(self):
+        """Drop cached user directory data"""
+        if self.backend is not None:
+            self.backend.bump('users')
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        backend = self.backend
+        if backend is None:
+            return {'backend': None, 'entries': 0, 'hits': 0, 'misses': 0,
+                    'evictions': 0, 'expirations': 0}
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        return {
+            'backend': type(backend).__name__,
+            'entries': len(backend),
+            'hits': hits,
+            'misses': misses,
+            'evictions': backend.evictions,
+            'expirations': backend.expirations,
+        }
+
+
+page_cache = PageCache()
+
+
+def cache_collector(cache):
+    """Scrape-time exposition of :meth:`PageCache.stats`"""
+
+    def collect():
+        stats = cache.stats()
+        yield ('blogly_page_cache_entries', 'gauge',
+               'Pages held by the page cache.',
+               [('', {}, stats['entries'])])
+        for name in ('hits', 'misses', 'evictions', 'expirations'):
+            yield (f'blogly_page_cache_{name}_total', 'counter',
+                   f'Page cache {name}.', [('', {}, stats[name])])
+    return collect
+
+
+def connect_cache(app):
+    """Attach the page cache to the app."""
+
+    page_cache.init_app(app)
+    registry.register('page_cache', cache_collector(page_cache))
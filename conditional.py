@@ -0,0 +1,76 @@
+"""Conditional GET (ETag / Last-Modified / 304) support for Blogly."""
+
+import hashlib
+import inspect
+from datetime import UTC
+from functools import wraps
+
+from flask import request, session, make_response
+
+
+def make_validators(parts, timestamps):
+    """Strong ETag over ``parts`` and Last-Modified as the newest timestamp"""
+    etag = hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+    timestamps = [ts if ts.tzinfo else ts.replace(tzinfo=UTC)
+                  for ts in timestamps if ts is not None]
+    return etag, max(timestamps).replace(microsecond=0) if timestamps else None
+
+
+def is_not_modified(etag, last_modified):
+    """Whether the client's cached copy still matches"""
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    since = request.if_modified_since
+    return bool(since and last_modified and last_modified <= since)
+
+
+def respond(body, etag, last_modified):
+    """200 with validators, or a bodiless 304 if the client is current"""
+    response = make_response(body)
+    if is_not_modified(etag, last_modified):
+        response = make_response('', 304)
+    response.set_etag(etag)
+    if last_modified is not None:
+        # Werkzeug would stamp None as the current time.
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def conditional(validators):
+    """Answer conditional GETs before the view renders anything.
+
+    ``validators`` takes the view's arguments and returns ``(parts,
+    timestamps)`` from one cheap query: ``parts`` is everything the page
+    shows that can change, ``timestamps`` the created/modified times behind
+    it, or none for an ETag alone. Pages with pending flash messages are
+    always rendered, since a 304 would leave the message unseen. For a
+    coroutine view (see asgi.py), ``validators`` is a coroutine function
+    too.
+    """
+
+    def decorator(view):
+        if inspect.iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(*args, **kwargs):
+                if session.get('_flashes'):
+                    return await view(*args, **kwargs)
+                etag, last_modified = make_validators(
+                    *await validators(*args, **kwargs))
+                if is_not_modified(etag, last_modified):
+                    return respond('', etag, last_modified)
+                return respond(await view(*args, **kwargs), etag,
+                               last_modified)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if session.get('_flashes'):
+                return view(*args, **kwargs)
+            etag, last_modified = make_validators(*validators(*args,
+                                                              **kwargs))
+            if is_not_modified(etag, last_modified):
+                return respond('', etag, last_modified)
+            return respond(view(*args, **kwargs), etag, last_modified)
+        return wrapper
+    return decorator
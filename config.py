@@ -0,0 +1,179 @@
+"""Configuration profiles for Blogly.
+
+``BLOGLY_ENV`` picks a profile (development, testing or production). Any
+setting below can be overridden from the environment under the name shown.
+"""
+
+import os
+import tempfile
+
+from sqlalchemy.engine import make_url
+
+from instrumentation import TimedQueuePool
+
+
+def _env(name, default, cast=str):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    if cast is bool:
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    return cast(value)
+
+
+class Config:
+    """Settings shared by every profile"""
+
+    SQLALCHEMY_DATABASE_URI = _env('DATABASE_URL',
+                                   'postgresql:///blogly_part2')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = _env('BLOGLY_SQL_ECHO', False, bool)
+    SECRET_KEY = _env('SECRET_KEY', 'SECRET11!')
+
+    POSTS_PER_PAGE = 5
+    USERS_PER_PAGE = 50
+    STREAM_TEMPLATES = _env('BLOGLY_STREAM_TEMPLATES', False, bool)
+    STREAM_CHUNK_ROWS = 500
+    STREAM_BUFFER_SIZE = 8192
+    SEARCH_RESULTS_PER_PAGE = 10
+    QUERY_COUNT_HEADER = False
+    NOT_FOUND_SNAPSHOT_TTL = 30
+    NOT_FOUND_RATE = _env('BLOGLY_NOT_FOUND_RATE', 2.0, float)
+    NOT_FOUND_BURST = _env('BLOGLY_NOT_FOUND_BURST', 20, int)
+    # Reverse proxies in front of the app. Their X-Forwarded-For header then
+    # gives the client address, which the 404 limiter goes by.
+    PROXY_COUNT = _env('BLOGLY_PROXY_COUNT', 0, int)
+    SERVER_TIMING = _env('BLOGLY_SERVER_TIMING', True, bool)
+    PAGE_CACHE = _env('BLOGLY_PAGE_CACHE', 'local')
+    PAGE_CACHE_TTL = _env('BLOGLY_PAGE_CACHE_TTL', 60, int)
+
+    # How new posts are saved: sync, group or async (see writebehind.py).
+    POST_WRITE_MODE = _env('BLOGLY_POST_WRITE_MODE', 'sync')
+    WRITE_BEHIND_MAX_BATCH = _env('BLOGLY_WRITE_BEHIND_MAX_BATCH', 100, int)
+    WRITE_BEHIND_MAX_DELAY = _env('BLOGLY_WRITE_BEHIND_MAX_DELAY', 0.005,
+                                  float)
+    WRITE_BEHIND_QUEUE_SIZE = 10_000
+    WRITE_BEHIND_TIMEOUT = 10
+
+    # Connection pool. Sizes are per process.
+    DB_POOL_SIZE = _env('BLOGLY_DB_POOL_SIZE', 5, int)
+    DB_MAX_OVERFLOW = _env('BLOGLY_DB_MAX_OVERFLOW', 10, int)
+    DB_POOL_TIMEOUT = _env('BLOGLY_DB_POOL_TIMEOUT', 30, float)
+    DB_POOL_RECYCLE = _env('BLOGLY_DB_POOL_RECYCLE', 1800, int)
+    DB_PRE_PING = _env('BLOGLY_DB_PRE_PING', True, bool)
+    # 0 means no limit.
+    DB_STATEMENT_TIMEOUT_MS = _env('BLOGLY_DB_STATEMENT_TIMEOUT_MS', 0, int)
+
+    # Read replicas, comma separated; GET requests read from them.
+    READ_REPLICA_URLS = _env('BLOGLY_READ_REPLICA_URLS', '')
+    READ_YOUR_WRITES_SECONDS = _env('BLOGLY_READ_YOUR_WRITES_SECONDS', 5,
+                                    float)
+    REPLICA_CHECK_INTERVAL = 10
+
+    # Fingerprint static files at startup (see assets.py).
+    ASSETS_BUILD = _env('BLOGLY_ASSETS_BUILD', True, bool)
+
+    # Served by asgi.py: run the read pages as coroutines on the asyncio
+    # engine (see asyncreads.py), and everything else on this many threads.
+    ASYNC_READS = _env('BLOGLY_ASYNC_READS', False, bool)
+    ASGI_THREADS = _env('BLOGLY_ASGI_THREADS', 10, int)
+
+    # Avatar thumbnails (see avatars.py).
+    AVATAR_CACHE_DIR = _env('BLOGLY_AVATAR_CACHE_DIR',
+                            os.path.join(tempfile.gettempdir(),
+                                         'blogly-avatars'))
+    AVATAR_CACHE_MAX_BYTES = _env('BLOGLY_AVATAR_CACHE_MAX_BYTES', 64 << 20,
+                                  int)
+    AVATAR_SIZES = (50, 100)
+    AVATAR_FETCH_TIMEOUT = 5
+    AVATAR_MAX_SOURCE_BYTES = 5 << 20
+    AVATAR_MAX_AGE = 3600
+    # Seconds before a source that could not be fetched is tried again.
+    AVATAR_FAILURE_TTL = 300
+    AVATAR_ALLOW_PRIVATE = _env('BLOGLY_AVATAR_ALLOW_PRIVATE', False, bool)
+
+
+class DevelopmentConfig(Config):
+    SQLALCHEMY_ECHO = _env('BLOGLY_SQL_ECHO', True, bool)
+
+
+class TestingConfig(Config):
+    TESTING = True
+    # sqlite:// runs the suite in memory; each pytest-xdist worker gets its
+    # own database (see worker_database).
+    SQLALCHEMY_DATABASE_URI = _env('DATABASE_URL',
+                                   'postgresql:///sqla_intro_test2')
+    DB_PRE_PING = _env('BLOGLY_DB_PRE_PING', False, bool)
+    ASSETS_BUILD = False
+
+
+class ProductionConfig(Config):
+    DB_POOL_SIZE = _env('BLOGLY_DB_POOL_SIZE', 10, int)
+    DB_MAX_OVERFLOW = _env('BLOGLY_DB_MAX_OVERFLOW', 5, int)
+    DB_POOL_TIMEOUT = _env('BLOGLY_DB_POOL_TIMEOUT', 5, float)
+    DB_STATEMENT_TIMEOUT_MS = _env('BLOGLY_DB_STATEMENT_TIMEOUT_MS', 5000,
+                                   int)
+
+
+PROFILES = {
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+    'production': ProductionConfig,
+}
+
+
+def worker_database(uri, worker=None):
+    """``uri`` suffixed with the pytest-xdist worker id, if there is one"""
+    worker = worker or os.environ.get('PYTEST_XDIST_WORKER')
+    url = make_url(uri)
+    if not worker or url.database in (None, '', ':memory:'):
+        return uri
+    if url.get_backend_name() == 'sqlite':
+        root, extension = os.path.splitext(url.database)
+        database = f'{root}_{worker}{extension}'
+    else:
+        database = f'{url.database}_{worker}'
+    return url.set(database=database).render_as_string(hide_password=False)
+
+
+def engine_options(config, url=None):
+    """SQLAlchemy engine options for the pool settings in ``config``"""
+    url = make_url(url or config['SQLALCHEMY_DATABASE_URI'])
+    options = {'pool_pre_ping': config['DB_PRE_PING']}
+    if url.get_backend_name() == 'sqlite':
+        # SQLite pools are file handles; Flask-SQLAlchemy picks the class.
+        return options
+    options.update(poolclass=TimedQueuePool,
+                   pool_size=config['DB_POOL_SIZE'],
+                   max_overflow=config['DB_MAX_OVERFLOW'],
+                   pool_timeout=config['DB_POOL_TIMEOUT'],
+                   pool_recycle=config['DB_POOL_RECYCLE'])
+    if url.get_backend_name() == 'postgresql':
+        # Naive timestamps, from seed data or strings, are taken as UTC.
+        settings = ['-c timezone=UTC']
+        timeout = config['DB_STATEMENT_TIMEOUT_MS']
+        if timeout:
+            settings.append(f'-c statement_timeout={timeout}')
+        options['connect_args'] = {'options': ' '.join(settings)}
+    return options
+
+
+def load_config(app, name=None, overrides=None):
+    """Load the ``name`` profile (default: ``$BLOGLY_ENV``) into ``app``,
+    then any ``overrides``."""
+
+    name = name or os.environ.get('BLOGLY_ENV', 'development')
+    try:
+        app.config.from_object(PROFILES[name])
+    except KeyError:
+        raise ValueError(f"Unknown BLOGLY_ENV profile {name!r}") from None
+    app.config.update(overrides or {})
+    if app.config['TESTING']:
+        app.config['SQLALCHEMY_DATABASE_URI'] = worker_database(
+            app.config['SQLALCHEMY_DATABASE_URI'])
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+    urls = [url.strip() for url in app.config['READ_REPLICA_URLS'].split(',')
+            if url.strip()]
+    app.config['READ_REPLICAS'] = {
+        f'replica_{number}': {'url': url, **engine_options(app.config, url)}
+        for number, url in enumerate(urls, 1)}
@@ -0,0 +1,152 @@
+"""Synthetic data generation for Blogly."""
+
+import csv
+import io
+import time
+from array import array
+from datetime import datetime, timedelta
+from random import choice, randint, random
+
+import click
+from flask.cli import with_appcontext
+
+from models import db, User, Post, excerpt_of
+from activity import reconcile, reconcile_initials
+
+
+def generate_random_datetime_start(start_date=datetime(2021,5,1),
+                             end_date=datetime(2022,5,1)):
+    time_between_days = end_date - start_date
+    days_since_start = randint(0, time_between_days.days)
+    random_date = start_date + timedelta(days=days_since_start)
+    random_date += timedelta(seconds=randint(0, 24 * 60 * 60))
+    return random_date
+
+
+def generate_random_datetime_end(start_date=datetime(2022,5,2),
+                             end_date=datetime(2024,5,1)):
+    time_between_days = end_date - start_date
+    days_since_start = randint(0, time_between_days.days)
+    random_date = start_date + timedelta(days=days_since_start)
+    random_date += timedelta(seconds=randint(0, 24 * 60 * 60))
+    return random_date
+
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do '
+         'eiusmod tempor incididunt ut labore et dolore magna aliqua mauris '
+         'cursus mattis molestie fermentum dui faucibus in ornare quam '
+         'viverra orci sagittis nisi quis eleifend').split()
+
+
+def words(low, high):
+    return ' '.join(choice(WORDS) for _ in range(randint(low, high)))
+
+
+def user_batches(count, batch_size):
+    """Yield lists of at most ``batch_size`` user rows"""
+    for offset in range(0, count, batch_size):
+        yield [{'first_name': words(1, 1).title(),
+                'middle_name': None,
+                'last_name': words(1, 1).title(),
+                'image_url': 'https://via.placeholder.com/50'}
+               for _ in range(min(batch_size, count - offset))]
+
+
+def post_batches(count, batch_size, user_ids, pool_size=1000):
+    """Yield lists of at most ``batch_size`` post rows by ``user_ids``.
+
+    Titles and bodies are drawn from a pool built up front; composing fresh
+    text for every row would make generation, not the database, the
+    bottleneck.
+    """
+    titles = [words(2, 6).capitalize() for _ in range(pool_size)]
+    bodies = [words(5, 400).capitalize() + '.' for _ in range(pool_size)]
+    bodies = [(body, excerpt_of(body), len(body)) for body in bodies]
+    last_user = len(user_ids) - 1
+    for offset in range(0, count, batch_size):
+        batch = []
+        for _ in range(min(batch_size, count - offset)):
+            created_at = generate_random_datetime_start()
+            content, excerpt, length = choice(bodies)
+            batch.append({
+                'title': choice(titles),
+                'content': content,
+                'excerpt': excerpt,
+                'content_length': length,
+                'created_at': created_at,
+                'modified_on': (generate_random_datetime_end()
+                                if random() < 0.3 else created_at),
+                'user_id': user_ids[randint(0, last_user)]})
+        yield batch
+
+
+def insert_batch(table, rows):
+    """Multi-row INSERT of one batch through SQLAlchemy Core"""
+    db.session.execute(table.insert(), rows)
+
+
+def copy_batch(table, rows):
+    """COPY one batch into PostgreSQL"""
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['' if row[c] is None else row[c] for c in columns])
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(f"COPY {table.name} ({', '.join(columns)}) "
+                       "FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def load(table, batches, write, label):
+    """Write ``batches`` one transaction at a time, reporting throughput"""
+    started = time.perf_counter()
+    total = 0
+    for batch in batches:
+        write(table, batch)
+        db.session.commit()
+        total += len(batch)
+        elapsed = time.perf_counter() - started
+        click.echo(f"\r{label}: {total} rows, {total / elapsed:,.0f} rows/sec",
+                   nl=False)
+    click.echo()
+    return total
+
+
+@click.command('generate-data')
+@click.option('--users', default=1000, show_default=True,
+              help='Users to create.')
+@click.option('--posts', default=100_000, show_default=True,
+              help='Posts to create, spread over the new users.')
+@click.option('--batch-size', default=5000, show_default=True,
+              help='Rows per INSERT/COPY and per transaction.')
+@click.option('--method', type=click.Choice(['insert', 'copy']),
+              default='insert', show_default=True,
+              help='copy uses PostgreSQL COPY for posts.')
+@with_appcontext
+def generate_data(users, posts, batch_size, method):
+    """Stream synthetic users and posts into the database.
+
+    Rows are generated and written one batch at a time, so memory use does
+    not grow with --posts. Only the new user ids are kept, packed in an
+    array, to attach posts to.
+    """
+    if method == 'copy' and db.engine.dialect.name != 'postgresql':
+        raise click.UsageError('--method copy needs PostgreSQL')
+    users_table = User.__table__
+    user_ids = array('q')
+    started = time.perf_counter()
+    for batch in user_batches(users, batch_size):
+        user_ids.extend(db.session.execute(
+            users_table.insert().returning(users_table.c.id),
+            batch).scalars())
+        db.session.commit()
+    reconcile_initials()
+    click.echo(f"users: {len(user_ids)} rows, "
+               f"{len(user_ids) / (time.perf_counter() - started):,.0f} "
+               "rows/sec")
+    if not user_ids:
+        return
+    load(Post.__table__, post_batches(posts, batch_size, user_ids),
+         copy_batch if method == 'copy' else insert_batch, 'posts')
+    reconcile(batch_size, first_id=min(user_ids))
@@ -0,0 +1,49 @@
+"""Rebuilding stored post excerpts.
+
+``Post.excerpt`` and ``Post.content_length`` are set whenever
+``Post.content`` is assigned through the ORM, and Core inserts fill them
+from the column defaults. Rows written any other way, or before the
+columns existed, are rebuilt by ``flask backfill-excerpts``.
+"""
+
+import time
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import case, func, select, update
+
+from models import db, Post, EXCERPT_LENGTH
+
+posts = Post.__table__
+
+
+def backfill(batch_size=10_000, first_id=0):
+    """Recompute excerpts from content, one committed id range at a time"""
+    last_id = db.session.scalar(select(func.max(posts.c.id))) or 0
+    length = func.length(posts.c.content)
+    updated = 0
+    for low in range(first_id, last_id + 1, batch_size):
+        updated += db.session.execute(
+            update(posts)
+            .where(posts.c.id.between(low, low + batch_size - 1))
+            .values(excerpt=case(
+                        (length > 255,
+                         func.substr(posts.c.content, 1, EXCERPT_LENGTH)),
+                        else_=posts.c.content),
+                    content_length=length,
+                    # Not an edit; keep modified_on from bumping.
+                    modified_on=posts.c.modified_on)).rowcount
+        db.session.commit()
+    return updated
+
+
+@click.command('backfill-excerpts')
+@click.option('--batch-size', default=10_000, show_default=True,
+              help='Posts updated per transaction.')
+@with_appcontext
+def backfill_excerpts(batch_size):
+    """Rebuild posts.excerpt and posts.content_length from content."""
+    started = time.perf_counter()
+    updated = backfill(batch_size)
+    click.echo(f"posts: {updated} rows backfilled in "
+               f"{time.perf_counter() - started:.2f}s")
@@ -0,0 +1,262 @@
+"""Instrumentation for Blogly: per-request query counts and pool metrics."""
+
+import threading
+import time
+
+from flask import (g, has_app_context, request, before_render_template,
+                   template_rendered)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+from metrics import Histogram, registry, histogram_samples
+
+# Connection lifetimes run from seconds to hours.
+LIFETIME_BUCKETS = (1, 10, 60, 300, 900, 1800, 3600, 7200, 14400)
+
+# Nested-transaction bookkeeping; not counted as queries.
+SAVEPOINT_STATEMENTS = ('SAVEPOINT', 'RELEASE SAVEPOINT',
+                        'ROLLBACK TO SAVEPOINT')
+
+
+REQUESTS = registry.counter(
+    'blogly_requests_total', 'Requests handled.',
+    ['endpoint', 'method', 'status'])
+LATENCY = registry.histogram(
+    'blogly_request_duration_seconds', 'Wall time per request.',
+    ['endpoint'])
+SQL_TIME = registry.histogram(
+    'blogly_request_sql_duration_seconds',
+    'Time spent executing SQL per request.', ['endpoint'])
+SQL_STATEMENTS = registry.counter(
+    'blogly_sql_statements_total', 'SQL statements executed.', ['endpoint'])
+RENDER_TIME = registry.histogram(
+    'blogly_request_render_duration_seconds',
+    'Time spent rendering templates per request.', ['endpoint'])
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_query(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context():
+        if not statement.startswith(SAVEPOINT_STATEMENTS):
+            g.query_count = g.get('query_count', 0) + 1
+        if context is not None:
+            context.blogly_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _end_query(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'blogly_started', None)
+    if started is not None and has_app_context():
+        g.sql_time = g.get('sql_time', 0.0) + time.perf_counter() - started
+
+
+def _start_render(sender, template, context, **extra):
+    g.render_started = time.perf_counter()
+
+
+def _end_render(sender, template, context, **extra):
+    started = g.pop('render_started', None)
+    if started is not None:
+        g.render_time = g.get('render_time', 0.0) + \
+            time.perf_counter() - started
+
+
+def query_count():
+    """Statements sent to the database so far in this request"""
+    return g.get('query_count', 0)
+
+
+class PoolMetrics:
+    """Connection pool gauges and histograms for one engine.
+
+    Telling pool starvation from slow queries needs both sides: long
+    checkout waits with every connection in use mean the pool is too small;
+    short waits with slow requests point at the queries.
+    """
+
+    def __init__(self):
+        self.checkout_wait = Histogram()
+        self.lifetime = Histogram(LIFETIME_BUCKETS)
+        self.in_use = 0
+        self.open = 0
+        self.checkouts = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    def connected(self, dbapi_connection, record):
+        record.info['connected_at'] = time.monotonic()
+        with self._lock:
+            self.open += 1
+
+    def closed(self, dbapi_connection, record):
+        # Also handles 'detach': the pool no longer owns the connection.
+        connected_at = record.info.pop('connected_at', None)
+        if connected_at is None:
+            return
+        self.lifetime.observe(time.monotonic() - connected_at)
+        with self._lock:
+            self.open -= 1
+
+    def checked_out(self, dbapi_connection, record, proxy):
+        with self._lock:
+            self.in_use += 1
+            self.checkouts += 1
+
+    def checked_in(self, dbapi_connection, record):
+        with self._lock:
+            self.in_use -= 1
+
+    def invalidated(self, dbapi_connection, record, exception):
+        with self._lock:
+            self.invalidations += 1
+
+    @property
+    def idle(self):
+        return max(self.open - self.in_use, 0)
+
+    def snapshot(self):
+        return {'open': self.open, 'in_use': self.in_use, 'idle': self.idle,
+                'checkouts': self.checkouts,
+                'invalidations': self.invalidations,
+                'checkout_wait_seconds': self.checkout_wait.snapshot(),
+                'lifetime_seconds': self.lifetime.snapshot()}
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that times how long each checkout waits for a connection.
+
+    Pool events only fire once a connection has been handed out, so the
+    wait is measured around :meth:`connect` itself.
+    """
+
+    metrics = None
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            if self.metrics is not None:
+                self.metrics.checkout_wait.observe(time.perf_counter() -
+                                                   started)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+def instrument_pool(engine):
+    """Attach :class:`PoolMetrics` to ``engine``'s pool and return them"""
+    metrics = PoolMetrics()
+    if isinstance(engine.pool, TimedQueuePool):
+        engine.pool.metrics = metrics
+    event.listen(engine, 'connect', metrics.connected)
+    event.listen(engine, 'close', metrics.closed)
+    event.listen(engine, 'detach', metrics.closed)
+    event.listen(engine, 'checkout', metrics.checked_out)
+    event.listen(engine, 'checkin', metrics.checked_in)
+    event.listen(engine, 'invalidate', metrics.invalidated)
+    return metrics
+
+
+def pool_collector(pools):
+    """Scrape-time exposition of ``{bind: PoolMetrics}``"""
+
+    def collect():
+        yield ('blogly_pool_connections', 'gauge',
+               'Pooled connections by state.',
+               [('', {'bind': bind, 'state': state}, value)
+                for bind, metrics in pools.items()
+                for state, value in (('in_use', metrics.in_use),
+                                     ('idle', metrics.idle))])
+        yield ('blogly_pool_checkouts_total', 'counter',
+               'Connections handed out by the pool.',
+               [('', {'bind': bind}, metrics.checkouts)
+                for bind, metrics in pools.items()])
+        yield ('blogly_pool_checkout_wait_seconds', 'histogram',
+               'Time spent waiting for a pooled connection.',
+               [sample for bind, metrics in pools.items()
+                for sample in histogram_samples(metrics.checkout_wait,
+                                                {'bind': bind})])
+        yield ('blogly_pool_connection_lifetime_seconds', 'histogram',
+               'Age of database connections when closed.',
+               [sample for bind, metrics in pools.items()
+                for sample in histogram_samples(metrics.lifetime,
+                                                {'bind': bind})])
+    return collect
+
+
+def server_timing(sql_time, queries, render_time, total):
+    return (f'sql;dur={sql_time * 1000:.2f};desc="{queries} queries", '
+            f'render;dur={render_time * 1000:.2f}, '
+            f'total;dur={total * 1000:.2f}')
+
+
+def record_request(stats, endpoint, method, status):
+    """Count a finished request from its ``g``; returns its timings"""
+    total = time.perf_counter() - stats.get('request_started',
+                                            time.perf_counter())
+    queries, sql_time = stats.get('query_count', 0), stats.get('sql_time', 0.0)
+    render_time = stats.get('render_time', 0.0)
+    REQUESTS.labels(endpoint, method, str(status)).inc()
+    LATENCY.labels(endpoint).observe(total)
+    SQL_TIME.labels(endpoint).observe(sql_time)
+    SQL_STATEMENTS.labels(endpoint).inc(queries)
+    RENDER_TIME.labels(endpoint).observe(render_time)
+    return sql_time, queries, render_time, total
+
+
+def connect_instrumentation(app, db):
+    """Measure every request and instrument ``db``'s connection pools.
+
+    Each request records its SQL statement count and time, template render
+    time and wall time, labelled by endpoint, in :data:`metrics.registry`,
+    and reports them in a ``Server-Timing`` header (``SERVER_TIMING``).
+    With ``QUERY_COUNT_HEADER`` set, the count is also returned as
+    ``X-Query-Count`` so tests can catch N+1 regressions. A streamed
+    response renders and queries after its headers are sent, so it is
+    recorded once the body is finished and carries neither header. Pool
+    metrics are
+    kept per bind and per read replica in
+    ``app.extensions['pool_metrics']``.
+    """
+
+    with app.app_context():
+        engines = {key or 'default': engine
+                   for key, engine in db.engines.items()}
+    router = app.extensions.get('replica_router')
+    if router is not None:
+        engines.update((replica.name, replica.engine)
+                       for replica in router.replicas)
+    pools = app.extensions['pool_metrics'] = {
+        key: instrument_pool(engine) for key, engine in engines.items()}
+    registry.register('pools', pool_collector(pools))
+
+    before_render_template.connect(_start_render, app)
+    template_rendered.connect(_end_render, app)
+
+    @app.before_request
+    def start_request():
+        g.request_started = time.perf_counter()
+        g.query_count = 0
+        g.sql_time = 0.0
+        g.render_time = 0.0
+
+    @app.after_request
+    def finish_request(response):
+        # The streamed body keeps this request's g while it renders.
+        request_info = (g._get_current_object(),
+                        request.endpoint or 'unmatched', request.method,
+                        response.status_code)
+        if response.is_streamed:
+            response.call_on_close(lambda: record_request(*request_info))
+            return response
+        sql_time, queries, render_time, total = record_request(*request_info)
+        if app.config.get('SERVER_TIMING', True):
+            response.headers['Server-Timing'] = server_timing(
+                sql_time, queries, render_time, total)
+        if app.config.get('QUERY_COUNT_HEADER'):
+            response.headers['X-Query-Count'] = str(queries)
+        return response
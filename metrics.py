@@ -0,0 +1,153 @@
+"""Metric primitives and Prometheus text exposition for Blogly."""
+
+import threading
+from bisect import bisect_left
+
+# Seconds; suits both pool waits and request latencies.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Counter:
+    """A value that only goes up"""
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Histogram:
+    """Counts observations into fixed buckets, Prometheus style"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def cumulative(self):
+        """``(upper_bound, count)`` pairs, ending with ``('+Inf', count)``"""
+        with self._lock:
+            counts = list(self.counts)
+        total = 0
+        pairs = []
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+    def snapshot(self):
+        return {'count': self.count, 'sum': self.sum,
+                'buckets': dict((str(bound), count)
+                                for bound, count in self.cumulative())}
+
+
+class Family:
+    """A named metric split by label values, e.g. latency per endpoint"""
+
+    def __init__(self, name, kind, help, labelnames, factory):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._factory = factory
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._factory())
+        return child
+
+    def samples(self):
+        """``(suffix, labels, value)`` triples for the exposition format"""
+        with self._lock:
+            children = sorted(self._children.items())
+        for values, child in children:
+            labels = dict(zip(self.labelnames, values))
+            if isinstance(child, Histogram):
+                yield from histogram_samples(child, labels)
+            else:
+                yield '', labels, child.value
+
+
+def histogram_samples(histogram, labels):
+    """Exposition samples for one :class:`Histogram`"""
+    for bound, count in histogram.cumulative():
+        yield '_bucket', {**labels, 'le': str(bound)}, count
+    yield '_sum', labels, histogram.sum
+    yield '_count', labels, histogram.count
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"') \
+        .replace('\n', r'\n')
+
+
+def _format(name, labels, value):
+    if labels:
+        pairs = ','.join(f'{key}="{_escape(val)}"'
+                         for key, val in labels.items())
+        name = f'{name}{{{pairs}}}'
+    return f'{name} {value}'
+
+
+class Registry:
+    """Holds metric families and renders them for a Prometheus scrape.
+
+    ``collectors`` are called at scrape time and yield ``(name, kind, help,
+    samples)`` for values that already live elsewhere, such as pool gauges.
+    They are keyed by name, so an app built again replaces its collectors
+    rather than adding a second copy of every family.
+    """
+
+    def __init__(self):
+        self.families = []
+        self.collectors = {}
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Family(name, 'counter', help, labelnames, Counter))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Family(name, 'histogram', help, labelnames,
+                                lambda: Histogram(buckets)))
+
+    def register(self, name, collect):
+        """Call ``collect`` at scrape time, replacing any under ``name``"""
+        self.collectors[name] = collect
+
+    def _add(self, family):
+        self.families.append(family)
+        return family
+
+    def exposition(self):
+        lines = []
+        for family in self.families:
+            lines.append(f'# HELP {family.name} {family.help}')
+            lines.append(f'# TYPE {family.name} {family.kind}')
+            lines.extend(_format(family.name + suffix, labels, value)
+                         for suffix, labels, value in family.samples())
+        for collect in self.collectors.values():
+            for name, kind, help, samples in collect():
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} {kind}')
+                lines.extend(_format(name + suffix, labels, value)
+                             for suffix, labels, value in samples)
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
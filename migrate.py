@@ -0,0 +1,334 @@
+"""Versioned schema migrations for Blogly.
+
+Each file in ``migrations/`` is one revision: a module with ``revision``,
+``down_revision`` and ``upgrade(op)`` / ``downgrade(op)`` functions taking
+an :class:`Operations`. The applied revision is kept in the
+``schema_version`` table, and ``flask db`` applies, rolls back and reports
+them.
+
+A revision runs in a single transaction unless it sets
+``transactional = False``. Its operations then commit one at a time, which
+lets PostgreSQL build indexes ``CONCURRENTLY`` without blocking writes,
+and lets backfills commit batch by batch. Backfill progress is saved in
+``schema_backfills``, so an interrupted upgrade resumes where it stopped.
+"""
+
+import importlib.util
+import os
+import time
+from contextlib import contextmanager
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import (MetaData, Table, Column, Integer, String, inspect,
+                        select, text, func)
+from sqlalchemy.schema import CreateColumn
+
+from models import db
+
+DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'migrations')
+
+metadata = MetaData()
+schema_version = Table('schema_version', metadata,
+                       Column('version', String(32), primary_key=True))
+schema_backfills = Table('schema_backfills', metadata,
+                         Column('name', String(128), primary_key=True),
+                         Column('last_id', Integer, nullable=False))
+
+
+class MigrationError(Exception):
+    """The migration history is broken or a target does not exist"""
+
+
+class Operations:
+    """Schema operations a revision's ``upgrade`` and ``downgrade`` use"""
+
+    def __init__(self, engine, connection=None, batch_size=10_000):
+        self.engine = engine
+        self.connection = connection
+        self.batch_size = batch_size
+        self.dialect = engine.dialect.name
+
+    @contextmanager
+    def begin(self):
+        """The revision's transaction, or a new one per operation"""
+        if self.connection is not None:
+            yield self.connection
+        else:
+            with self.engine.begin() as connection:
+                yield connection
+
+    @property
+    def concurrent(self):
+        return self.connection is None and self.dialect == 'postgresql'
+
+    def execute(self, statement, **params):
+        with self.begin() as connection:
+            return connection.execute(text(statement), params)
+
+    def has_column(self, table, name):
+        with self.begin() as connection:
+            return name in {column['name'] for column in
+                            inspect(connection).get_columns(table)}
+
+    def create_table(self, name, *columns):
+        with self.begin() as connection:
+            # Reflected so foreign keys can find the tables they refer to.
+            existing = MetaData()
+            existing.reflect(connection)
+            Table(name, existing, *columns).create(connection)
+
+    def drop_table(self, name):
+        self.execute(f"DROP TABLE IF EXISTS {name}")
+
+    def rebuild_table(self, name, *columns):
+        """Recreate table ``name`` as ``columns``, keeping its rows.
+
+        For SQLite, which cannot change a column's type or default in
+        place. Rows are copied by column name; the table's indexes and
+        triggers are created again afterwards.
+        """
+        with self.begin() as connection:
+            existing = MetaData()
+            existing.reflect(connection)
+            old = existing.tables[name]
+            extras = connection.execute(text(
+                "SELECT sql FROM sqlite_master WHERE tbl_name = :name "
+                "AND type IN ('index', 'trigger') AND sql IS NOT NULL"),
+                {'name': name}).scalars().all()
+            new = Table(f"_{name}_rebuild", existing, *columns)
+            new.create(connection)
+            names = [column.name for column in new.columns
+                     if column.name in old.columns]
+            connection.execute(new.insert().from_select(
+                names, select(*(old.c[column] for column in names))))
+            connection.execute(text(f"DROP TABLE {name}"))
+            connection.execute(text(
+                f"ALTER TABLE {new.name} RENAME TO {name}"))
+            for statement in extras:
+                connection.execute(text(statement))
+
+    def add_column(self, table, column):
+        """Add ``column``; skipped if it is already there"""
+        if self.has_column(table, column.name):
+            return
+        Table(table, MetaData(), column)
+        ddl = CreateColumn(column).compile(dialect=self.engine.dialect)
+        self.execute(f"ALTER TABLE {table} ADD COLUMN {ddl}")
+
+    def drop_column(self, table, name):
+        if self.has_column(table, name):
+            self.execute(f"ALTER TABLE {table} DROP COLUMN {name}")
+
+    def create_index(self, name, table, *columns, unique=False, using=None):
+        """Create an index, ``CONCURRENTLY`` when the database allows it.
+
+        ``columns`` are SQL, e.g. ``'created_at DESC'``; ``using`` names
+        the index method, e.g. ``'GIN'``. A concurrent build
+        that failed part way leaves an invalid index behind; it is dropped
+        and built again.
+        """
+        concurrently = 'CONCURRENTLY ' if self.concurrent else ''
+        if self.concurrent and self.execute(
+                "SELECT NOT indisvalid FROM pg_index JOIN pg_class "
+                "ON pg_class.oid = indexrelid WHERE relname = :name",
+                name=name).scalar():
+            self.drop_index(name)
+        self._autocommit(
+            f"CREATE {'UNIQUE ' if unique else ''}INDEX {concurrently}"
+            f"IF NOT EXISTS {name} ON {table} "
+            f"{f'USING {using} ' if using else ''}({', '.join(columns)})")
+
+    def drop_index(self, name):
+        concurrently = 'CONCURRENTLY ' if self.concurrent else ''
+        self._autocommit(f"DROP INDEX {concurrently}IF EXISTS {name}")
+
+    def _autocommit(self, statement):
+        if not self.concurrent:
+            return self.execute(statement)
+        with self.engine.connect() as connection:
+            connection.execution_options(isolation_level='AUTOCOMMIT') \
+                .execute(text(statement))
+
+    def backfill(self, name, table, values, where=None):
+        """``UPDATE table SET values`` in committed id ranges.
+
+        ``table`` is a :class:`sqlalchemy.Table` or ``table()`` with an
+        ``id`` column. The last finished range is saved under ``name``;
+        running the same backfill again carries on from there. Returns the
+        number of rows updated.
+        """
+        with self.begin() as connection:
+            last_id = connection.scalar(select(func.max(table.c.id))) or 0
+            first_id = connection.scalar(
+                select(schema_backfills.c.last_id)
+                .where(schema_backfills.c.name == name))
+        low = 0 if first_id is None else first_id + 1
+        updated = 0
+        while low <= last_id:
+            high = low + self.batch_size - 1
+            statement = (table.update()
+                         .where(table.c.id.between(low, high))
+                         .values(values))
+            if where is not None:
+                statement = statement.where(where)
+            with self.begin() as connection:
+                updated += connection.execute(statement).rowcount
+                self._save_progress(connection, name, high)
+            low = high + 1
+        with self.begin() as connection:
+            connection.execute(schema_backfills.delete()
+                               .where(schema_backfills.c.name == name))
+        return updated
+
+    def _save_progress(self, connection, name, last_id):
+        if connection.execute(schema_backfills.update()
+                              .where(schema_backfills.c.name == name)
+                              .values(last_id=last_id)).rowcount == 0:
+            connection.execute(schema_backfills.insert()
+                               .values(name=name, last_id=last_id))
+
+
+def load_revisions(directory=DIRECTORY):
+    """Revision modules in order, oldest first"""
+    modules = {}
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith('.py') or filename.startswith('_'):
+            continue
+        spec = importlib.util.spec_from_file_location(
+            f"migrations.{filename[:-3]}", os.path.join(directory, filename))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        modules[module.revision] = module
+    ordered = []
+    down = None
+    while len(ordered) < len(modules):
+        following = [module for module in modules.values()
+                     if module.down_revision == down]
+        if len(following) != 1:
+            raise MigrationError(f"Expected one revision after {down!r}, "
+                                 f"found {len(following)}")
+        ordered.append(following[0])
+        down = following[0].revision
+    return ordered
+
+
+def current_revision(engine):
+    metadata.create_all(engine)
+    with engine.connect() as connection:
+        return connection.scalar(select(schema_version.c.version))
+
+
+def _set_revision(connection, revision):
+    connection.execute(schema_version.delete())
+    if revision is not None:
+        connection.execute(schema_version.insert().values(version=revision))
+
+
+def _index(revisions, revision):
+    """Position of ``revision`` in ``revisions``; -1 for ``None``/base"""
+    if revision in (None, 'base'):
+        return -1
+    if revision == 'head':
+        return len(revisions) - 1
+    for position, module in enumerate(revisions):
+        if module.revision == revision:
+            return position
+    raise MigrationError(f"Unknown revision {revision!r}")
+
+
+def _run(engine, module, step, revision, batch_size):
+    if getattr(module, 'transactional', True):
+        with engine.begin() as connection:
+            step(Operations(engine, connection, batch_size))
+            _set_revision(connection, revision)
+    else:
+        step(Operations(engine, batch_size=batch_size))
+        with engine.begin() as connection:
+            _set_revision(connection, revision)
+
+
+def upgrade(engine, target='head', batch_size=10_000, echo=None):
+    """Apply revisions after the current one up to ``target``"""
+    revisions = load_revisions()
+    start = _index(revisions, current_revision(engine)) + 1
+    for module in revisions[start:_index(revisions, target) + 1]:
+        if echo:
+            echo(f"upgrade {module.revision}: {module.__doc__.strip()}")
+        _run(engine, module, module.upgrade, module.revision, batch_size)
+
+
+def downgrade(engine, target=None, batch_size=10_000, echo=None):
+    """Roll back to ``target``, by default the revision before the current"""
+    revisions = load_revisions()
+    current = _index(revisions, current_revision(engine))
+    stop = current - 1 if target is None else _index(revisions, target)
+    if current < 0 or stop >= current:
+        return
+    for position in range(current, stop, -1):
+        module = revisions[position]
+        if echo:
+            echo(f"downgrade {module.revision}: {module.__doc__.strip()}")
+        _run(engine, module, module.downgrade, module.down_revision,
+             batch_size)
+
+
+def stamp(engine, revision):
+    """Record ``revision`` as applied without running anything"""
+    revisions = load_revisions()
+    position = _index(revisions, revision)
+    with engine.begin() as connection:
+        metadata.create_all(connection)
+        _set_revision(connection, revisions[position].revision
+                      if position >= 0 else None)
+
+
+@click.group('db')
+def db_cli():
+    """Apply, roll back and inspect schema migrations."""
+
+
+@db_cli.command('upgrade')
+@click.argument('target', default='head')
+@click.option('--batch-size', default=10_000, show_default=True,
+              help='Rows per backfill transaction.')
+@with_appcontext
+def upgrade_command(target, batch_size):
+    """Upgrade the schema to TARGET (default: head)."""
+    started = time.perf_counter()
+    upgrade(db.engine, target, batch_size, echo=click.echo)
+    click.echo(f"at {current_revision(db.engine) or 'base'} "
+               f"({time.perf_counter() - started:.2f}s)")
+
+
+@db_cli.command('downgrade')
+@click.argument('target', required=False)
+@click.option('--batch-size', default=10_000, show_default=True,
+              help='Rows per backfill transaction.')
+@with_appcontext
+def downgrade_command(target, batch_size):
+    """Roll back to TARGET, or one revision if none is given."""
+    downgrade(db.engine, target, batch_size, echo=click.echo)
+    click.echo(f"at {current_revision(db.engine) or 'base'}")
+
+
+@db_cli.command('status')
+@with_appcontext
+def status_command():
+    """List revisions, marking the applied ones."""
+    revisions = load_revisions()
+    current = _index(revisions, current_revision(db.engine))
+    for position, module in enumerate(revisions):
+        mark = '*' if position <= current else ' '
+        click.echo(f"{mark} {module.revision}  {module.__doc__.strip()}")
+    click.echo(f"{len(revisions) - current - 1} pending")
+
+
+@db_cli.command('stamp')
+@click.argument('revision')
+@with_appcontext
+def stamp_command(revision):
+    """Mark REVISION as applied without running it."""
+    stamp(db.engine, revision)
+    click.echo(f"at {current_revision(db.engine) or 'base'}")
@@ -0,0 +1,29 @@
+"""Users and posts, as first created with db.create_all()"""
+
+from sqlalchemy import Column, ForeignKey, Integer, String, TIMESTAMP
+
+revision = '0001'
+down_revision = None
+
+
+def upgrade(op):
+    op.create_table(
+        'users',
+        Column('id', Integer, primary_key=True, autoincrement=True),
+        Column('first_name', String(50), nullable=False),
+        Column('middle_name', String(50), nullable=True),
+        Column('last_name', String(50), nullable=False),
+        Column('image_url', String(255), nullable=False))
+    op.create_table(
+        'posts',
+        Column('id', Integer, primary_key=True, autoincrement=True),
+        Column('title', String(128), nullable=False),
+        Column('content', String(65535), nullable=False),
+        Column('created_at', TIMESTAMP, nullable=False),
+        Column('modified_on', TIMESTAMP, nullable=True),
+        Column('user_id', Integer, ForeignKey('users.id')))
+
+
+def downgrade(op):
+    op.drop_table('posts')
+    op.drop_table('users')
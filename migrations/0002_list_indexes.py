@@ -0,0 +1,22 @@
+"""Indexes for the paged feed, user pages and user directory"""
+
+revision = '0002'
+down_revision = '0001'
+
+# The indexes are built CONCURRENTLY, outside any transaction.
+transactional = False
+
+
+def upgrade(op):
+    op.create_index('ix_posts_created_at_id', 'posts',
+                    'created_at DESC', 'id DESC')
+    op.create_index('ix_posts_user_id_created_at', 'posts',
+                    'user_id', 'created_at')
+    op.create_index('ix_users_name_id', 'users',
+                    'last_name', 'first_name', 'id')
+
+
+def downgrade(op):
+    op.drop_index('ix_users_name_id')
+    op.drop_index('ix_posts_user_id_created_at')
+    op.drop_index('ix_posts_created_at_id')
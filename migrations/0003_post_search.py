@@ -0,0 +1,53 @@
+"""Full-text search over post titles and content"""
+
+revision = '0003'
+down_revision = '0002'
+
+# The GIN index is built CONCURRENTLY, outside any transaction.
+transactional = False
+
+SQLITE_SEARCH = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5("
+    "title, content, content='posts', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts "
+    "BEGIN INSERT INTO posts_fts (rowid, title, content) "
+    "VALUES (new.id, new.title, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS posts_fts_delete AFTER DELETE ON posts "
+    "BEGIN INSERT INTO posts_fts (posts_fts, rowid, title, content) "
+    "VALUES ('delete', old.id, old.title, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS posts_fts_update AFTER UPDATE ON posts "
+    "BEGIN INSERT INTO posts_fts (posts_fts, rowid, title, content) "
+    "VALUES ('delete', old.id, old.title, old.content); "
+    "INSERT INTO posts_fts (rowid, title, content) "
+    "VALUES (new.id, new.title, new.content); END",
+    # Index the posts written before the table existed.
+    "INSERT INTO posts_fts (posts_fts) VALUES ('rebuild')",
+]
+
+
+def upgrade(op):
+    if op.dialect == 'postgresql':
+        if not op.has_column('posts', 'search_vector'):
+            # Computing the stored column rewrites the table.
+            op.execute(
+                "ALTER TABLE posts ADD COLUMN search_vector tsvector "
+                "GENERATED ALWAYS AS "
+                "(setweight(to_tsvector('english', coalesce(title, '')), "
+                "'A') || "
+                "setweight(to_tsvector('english', coalesce(content, '')), "
+                "'B')) STORED")
+        op.create_index('ix_posts_search_vector', 'posts', 'search_vector',
+                        using='GIN')
+    elif op.dialect == 'sqlite':
+        for statement in SQLITE_SEARCH:
+            op.execute(statement)
+
+
+def downgrade(op):
+    if op.dialect == 'postgresql':
+        op.drop_index('ix_posts_search_vector')
+        op.drop_column('posts', 'search_vector')
+    elif op.dialect == 'sqlite':
+        for trigger in ('insert', 'delete', 'update'):
+            op.execute(f"DROP TRIGGER IF EXISTS posts_fts_{trigger}")
+        op.drop_table('posts_fts')
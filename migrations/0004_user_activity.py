@@ -0,0 +1,35 @@
+"""Per-user post_count and last_post_at, backfilled from posts"""
+
+from sqlalchemy import (Column, Integer, TIMESTAMP, column, func, select,
+                        table)
+
+revision = '0004'
+down_revision = '0003'
+
+# Commits each backfill batch on its own, so it can resume, and builds the
+# index CONCURRENTLY.
+transactional = False
+
+users = table('users', column('id'), column('post_count'),
+              column('last_post_at'))
+posts = table('posts', column('user_id'), column('created_at'))
+
+
+def upgrade(op):
+    op.add_column('users', Column('post_count', Integer, nullable=False,
+                                  server_default='0'))
+    op.add_column('users', Column('last_post_at', TIMESTAMP, nullable=True))
+    mine = posts.c.user_id == users.c.id
+    op.backfill('users_activity', users, {
+        'post_count': select(func.count()).select_from(posts).where(mine)
+        .scalar_subquery(),
+        'last_post_at': select(func.max(posts.c.created_at)).where(mine)
+        .scalar_subquery()})
+    op.create_index('ix_users_last_post_at_id', 'users',
+                    'last_post_at DESC', 'id DESC')
+
+
+def downgrade(op):
+    op.drop_index('ix_users_last_post_at_id')
+    op.drop_column('users', 'last_post_at')
+    op.drop_column('users', 'post_count')
@@ -0,0 +1,33 @@
+"""Stored post excerpts and content lengths"""
+
+from sqlalchemy import Column, Integer, String, case, column, func, table
+
+revision = '0005'
+down_revision = '0004'
+
+# Commits each backfill batch on its own, so it can resume.
+transactional = False
+
+posts = table('posts', column('id'), column('content'), column('excerpt'),
+              column('content_length'))
+
+
+def upgrade(op):
+    # Constant defaults let existing rows take the NOT NULL columns at once.
+    op.add_column('posts', Column('excerpt', String(255), nullable=False,
+                                  server_default=''))
+    op.add_column('posts', Column('content_length', Integer, nullable=False,
+                                  server_default='0'))
+    length = func.length(posts.c.content)
+    op.backfill('posts_excerpt', posts, {
+        'excerpt': case((length > 255, func.substr(posts.c.content, 1, 252)),
+                        else_=posts.c.content),
+        'content_length': length})
+    if op.dialect == 'postgresql':
+        op.execute("ALTER TABLE posts ALTER COLUMN excerpt DROP DEFAULT, "
+                   "ALTER COLUMN content_length DROP DEFAULT")
+
+
+def downgrade(op):
+    op.drop_column('posts', 'content_length')
+    op.drop_column('posts', 'excerpt')
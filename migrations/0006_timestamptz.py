@@ -0,0 +1,93 @@
+"""Timezone-aware post timestamps and the modified_on index"""
+
+import os
+
+from sqlalchemy import (Column, ForeignKey, Integer, String, TIMESTAMP,
+                        create_engine, text)
+from sqlalchemy.pool import NullPool
+
+revision = '0006'
+down_revision = '0005'
+
+# The index is built CONCURRENTLY, outside any transaction.
+transactional = False
+
+
+def sqlite_posts(defaults):
+    """The SQLite posts columns, with timestamps defaulting to now if
+    ``defaults``; otherwise as 0005 left them, with only excerpt and
+    content_length defaulted.
+    """
+    now = text('CURRENT_TIMESTAMP') if defaults else None
+    return [
+        Column('id', Integer, primary_key=True, autoincrement=True),
+        Column('title', String(128), nullable=False),
+        Column('content', String(65535), nullable=False),
+        Column('created_at', TIMESTAMP, nullable=False, server_default=now),
+        Column('modified_on', TIMESTAMP, nullable=True, server_default=now),
+        Column('user_id', Integer, ForeignKey('users.id')),
+        Column('excerpt', String(255), nullable=False,
+               server_default=None if defaults else ''),
+        Column('content_length', Integer, nullable=False,
+               server_default=None if defaults else '0')]
+
+
+def original_timezone(op):
+    """The TimeZone the naive timestamps were written in.
+
+    Before this revision the app's connections kept the database's own
+    TimeZone, and PostgreSQL stored each aware datetime converted to it.
+    The app's connections now set UTC, so the setting is read on a fresh
+    connection without that option. ``BLOGLY_LEGACY_TIMEZONE`` overrides
+    it, e.g. if the server's zone has changed since.
+    """
+    zone = os.environ.get('BLOGLY_LEGACY_TIMEZONE')
+    if zone:
+        return zone
+    engine = create_engine(op.engine.url, poolclass=NullPool)
+    try:
+        with engine.connect() as connection:
+            return connection.scalar(text("SHOW TimeZone"))
+    finally:
+        engine.dispose()
+
+
+def upgrade(op):
+    if op.dialect == 'postgresql':
+        # Rewrites both tables.
+        zone = original_timezone(op)
+        op.execute(
+            "ALTER TABLE posts "
+            "ALTER COLUMN created_at TYPE TIMESTAMPTZ "
+            "USING created_at AT TIME ZONE :zone, "
+            "ALTER COLUMN created_at SET DEFAULT now(), "
+            "ALTER COLUMN modified_on TYPE TIMESTAMPTZ "
+            "USING modified_on AT TIME ZONE :zone, "
+            "ALTER COLUMN modified_on SET DEFAULT now()", zone=zone)
+        op.execute("ALTER TABLE users ALTER COLUMN last_post_at "
+                   "TYPE TIMESTAMPTZ USING last_post_at AT TIME ZONE :zone",
+                   zone=zone)
+    elif op.dialect == 'sqlite':
+        # SQLite cannot alter a column's default, so the table is rebuilt.
+        op.rebuild_table('posts', *sqlite_posts(defaults=True))
+    op.create_index('ix_posts_modified_on_id', 'posts',
+                    'modified_on DESC', 'id DESC')
+
+
+def downgrade(op):
+    op.drop_index('ix_posts_modified_on_id')
+    if op.dialect == 'postgresql':
+        zone = original_timezone(op)
+        op.execute(
+            "ALTER TABLE posts "
+            "ALTER COLUMN created_at DROP DEFAULT, "
+            "ALTER COLUMN created_at TYPE TIMESTAMP "
+            "USING created_at AT TIME ZONE :zone, "
+            "ALTER COLUMN modified_on DROP DEFAULT, "
+            "ALTER COLUMN modified_on TYPE TIMESTAMP "
+            "USING modified_on AT TIME ZONE :zone", zone=zone)
+        op.execute("ALTER TABLE users ALTER COLUMN last_post_at "
+                   "TYPE TIMESTAMP USING last_post_at AT TIME ZONE :zone",
+                   zone=zone)
+    elif op.dialect == 'sqlite':
+        op.rebuild_table('posts', *sqlite_posts(defaults=False))
@@ -0,0 +1,30 @@
+"""Per-letter user counts for the /users jump links"""
+
+import string
+
+from sqlalchemy import Column, Integer, String, column, func, select, table
+
+revision = '0007'
+down_revision = '0006'
+
+users = table('users', column('last_name'))
+user_initials = table('user_initials', column('letter'),
+                      column('user_count'))
+
+
+def upgrade(op):
+    op.create_table(
+        'user_initials',
+        Column('letter', String(1), primary_key=True),
+        Column('user_count', Integer, nullable=False))
+    letter = func.upper(func.substr(users.c.last_name, 1, 1))
+    with op.begin() as connection:
+        connection.execute(user_initials.insert().from_select(
+            ['letter', 'user_count'],
+            select(letter, func.count())
+            .where(letter.in_(list(string.ascii_uppercase)))
+            .group_by(letter)))
+
+
+def downgrade(op):
+    op.drop_table('user_initials')
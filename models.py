@@ -1,9 +1,25 @@
 """Models for Blogly."""
 
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime, timezone, UTC
-import tzlocal
-db = SQLAlchemy()
+from sqlalchemy import event, orm
+import timefmt
+from routing import RoutingSession
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+# Characters of a long post shown on the feed.
+EXCERPT_LENGTH = 252
+
+# Shown for users without a picture of their own; served from static/.
+DEFAULT_IMAGE_URL = '/static/avatar.svg'
+
+
+def excerpt_of(content):
+    """The part of ``content`` the feed shows"""
+    return content[:EXCERPT_LENGTH] if len(content) > 255 else content
+
+
+def _content(context):
+    return context.get_current_parameters().get('content', 'Lorem Ipsum')
 
 
 def connect_db(app):
@@ -11,6 +27,9 @@ def connect_db(app):
 
     db.app = app
     db.init_app(app)
+    # Backrefs such as User.posts only exist once the mappers are
+    # configured; do it now rather than on a worker's first query.
+    orm.configure_mappers()
 
 
 class Post(db.Model):
@@ -30,68 +49,92 @@ class Post(db.Model):
                         nullable=False,
                         default='Lorem Ipsum')
 
-    created_at = db.Column(db.TIMESTAMP,
+    # Kept in step with content, so lists can leave the body unloaded.
+    # Core inserts get them from the column defaults.
+    excerpt = db.Column(db.String(255),
+                        nullable=False,
+                        default=lambda context: excerpt_of(_content(context)))
+
+    content_length = db.Column(db.Integer,
+                               nullable=False,
+                               default=lambda context: len(_content(context)))
+
+    # Both default to the database clock; any ORM update to a post bumps
+    # modified_on.
+    created_at = db.Column(db.DateTime(timezone=True),
                            nullable=False,
-                           default=datetime.now(UTC))
+                           server_default=db.func.now())
 
-    modified_on = db.Column(db.TIMESTAMP,
+    modified_on = db.Column(db.DateTime(timezone=True),
                             nullable=True,
-                            default=datetime.now(UTC))
+                            server_default=db.func.now(),
+                            onupdate=db.func.now())
 
     user_id = db.Column(db.Integer,
                         db.ForeignKey('users.id'))
 
     user = db.relationship("User", backref="posts")
 
+    # (created, modified, was_modified) when precomputed by timefmt.annotate
+    friendly_times = None
+
     @staticmethod
     def get_friendly(timediff):
-        seconds = timediff.total_seconds()
-        minutes = int(seconds / 60)
-        hours = int(minutes / 60)
-        days = int(hours / 24)
-        if days > 0:
-            return f"{days} day{'s' if days > 1 else ''} ago"
-        elif hours > 0:
-            return f"{hours} hour{'s' if hours > 1 else ''} ago"
-        elif minutes > 0:
-            return f"{minutes} minute{'s' if minutes > 1 else ''} ago"
-        else:
-            return "Just now"
+        return timefmt.describe(timediff)
 
     @property
     def friendly_created_at(self):
-        return Post.get_friendly(datetime.now(UTC) -
-                                 datetime.fromisoformat(
-                                     self.created_at.replace(
-                                         tzinfo=tzlocal.get_localzone())
-                                     .isoformat()))
+        if self.friendly_times is not None:
+            return self.friendly_times[0]
+        return timefmt.friendly(self.created_at)
 
     @property
     def friendly_modified_on(self):
-        return Post.get_friendly(datetime.now(UTC) -
-                                 datetime.fromisoformat(
-                                     self.modified_on.replace(
-                                         tzinfo=tzlocal.get_localzone())
-                                     .isoformat()))
+        if self.friendly_times is not None:
+            return self.friendly_times[1]
+        return timefmt.friendly(self.modified_on)
+
+    @property
+    def was_modified(self):
+        if self.friendly_times is not None:
+            return self.friendly_times[2]
+        return timefmt.was_modified(self.created_at, self.modified_on)
 
     @property
     def homepage_content(self):
-        return ((f"{self.content[:252]}" if len(self.content) > 255 else
-                 self.content))
+        return self.excerpt
 
     @property
     def homepage_minified(self):
-        return len(self.content) > 252
+        return self.content_length > EXCERPT_LENGTH
 
     def __repr__(self):
         """Show info about user."""
 
+        # SQLite hands back naive timestamps; show both backends' alike.
+        created_at = self.created_at and timefmt.to_utc(self.created_at)
         return (f"<Post ID={self.id} " +
                 f"Title={self.title[:32]} " +
                 f"Content=" +
                 ("[truncated]" if len(self.content) > 32 else "") +
                 f"{self.content[:32]} " +
-                f"Created At={self.created_at}>")
+                f"Created At={created_at}>")
+
+
+@event.listens_for(Post.content, 'set')
+def _content_set(post, value, oldvalue, initiator):
+    if value is not None:
+        post.excerpt = excerpt_of(value)
+        post.content_length = len(value)
+
+
+# Serves the /posts feed: newest first, id breaking ties, so keyset pages
+# are read straight off the index.
+db.Index('ix_posts_created_at_id', Post.created_at.desc(), Post.id.desc())
+# A user's posts, and their newest post for User.last_post_at.
+db.Index('ix_posts_user_id_created_at', Post.user_id, Post.created_at)
+# Recently modified posts, for /api/v1/posts?sort=modified.
+db.Index('ix_posts_modified_on_id', Post.modified_on.desc(), Post.id.desc())
 
 
 class User(db.Model):
@@ -114,7 +157,17 @@ class User(db.Model):
 
     image_url = db.Column(db.String(255),
                           nullable=False,
-                          default='https://via.placeholder.com/30')
+                          default=DEFAULT_IMAGE_URL)
+
+    # Maintained on write by activity.py; rebuilt by
+    # ``flask reconcile-activity``.
+    post_count = db.Column(db.Integer,
+                           nullable=False,
+                           default=0,
+                           server_default='0')
+
+    last_post_at = db.Column(db.DateTime(timezone=True),
+                             nullable=True)
 
     created_posts = db.relationship('Post', backref='created_posts',
                                     cascade="all, delete")
@@ -139,3 +192,25 @@ class User(db.Model):
                     not None and len(self.middle_name) > 0 else "") +
                 f"Last Name={self.last_name} " +
                 f"Image URL={self.image_url}>")
+
+
+# The /users directory pages through users by name.
+db.Index('ix_users_name_id', User.last_name, User.first_name, User.id)
+# /users?sort=active pages through users who have posted off this index.
+db.Index('ix_users_last_post_at_id', User.last_post_at.desc(),
+         User.id.desc())
+
+
+class UserInitial(db.Model):
+    """Users per initial A-Z of their last name, for the /users jump links"""
+
+    __tablename__ = "user_initials"
+
+    # Maintained on write by activity.py; rebuilt by
+    # ``flask reconcile-activity``.
+    letter = db.Column(db.String(1),
+                       primary_key=True)
+
+    user_count = db.Column(db.Integer,
+                           nullable=False,
+                           default=0)
@@ -0,0 +1,135 @@
+"""Keeping 404s cheap: a recent-posts snapshot and a per-client limiter.
+
+Scanners probing random URLs should not cost a query each. The 404 page's
+"recent posts" come from an in-process snapshot, reloaded when a write
+bumps the page cache's feed generation or after ``NOT_FOUND_SNAPSHOT_TTL``
+seconds. A client past ``NOT_FOUND_BURST`` misses, refilled at
+``NOT_FOUND_RATE`` per second, gets a bare 404 with no template at all.
+
+Clients are told apart by address: behind a reverse proxy, set
+``PROXY_COUNT`` so the address comes from ``X-Forwarded-For``. The buckets
+live in each worker process, so with N workers a client may get up to N
+times the limit.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+
+from cache import page_cache
+from models import db, User, Post
+from routing import pinned_to_primary
+import timefmt
+
+# Clients remembered by the limiter; the least recently seen are dropped.
+MAX_CLIENTS = 10_000
+
+
+class PostSummary:
+    """The parts of a post the 404 page shows, detached from any session"""
+
+    def __init__(self, row):
+        self.id = row.id
+        self.title = row.title
+        self.user_id = row.user_id
+        self.created_at = row.created_at
+        self.modified_on = row.modified_on
+        self.user = SimpleNamespace(full_name=User(
+            first_name=row.first_name, middle_name=row.middle_name,
+            last_name=row.last_name).full_name if row.user_id else '')
+
+    @property
+    def friendly_created_at(self):
+        return timefmt.friendly(self.created_at)
+
+    @property
+    def friendly_modified_on(self):
+        return timefmt.friendly(self.modified_on)
+
+    @property
+    def was_modified(self):
+        return timefmt.was_modified(self.created_at, self.modified_on)
+
+
+class RecentPosts:
+    """The newest posts, reloaded after writes or ``ttl`` seconds"""
+
+    def __init__(self, count=5, ttl=30):
+        self.count = count
+        self.ttl = ttl
+        self._posts = None
+        self._generation = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        if pinned_to_primary():
+            # Read past a snapshot a lagging replica may have refilled.
+            return self._query()
+        generation = page_cache.feed_key()
+        if self._stale(generation):
+            with self._lock:
+                if self._stale(generation):
+                    self._load(generation)
+        return self._posts
+
+    def clear(self):
+        self._posts = None
+
+    def _stale(self, generation):
+        return (self._posts is None or generation != self._generation or
+                time.monotonic() - self._loaded_at >= self.ttl)
+
+    def _load(self, generation):
+        self._posts = self._query()
+        self._generation = generation
+        self._loaded_at = time.monotonic()
+
+    def _query(self):
+        rows = (db.session.query(Post.id, Post.title, Post.user_id,
+                                 Post.created_at, Post.modified_on,
+                                 User.first_name, User.middle_name,
+                                 User.last_name)
+                .outerjoin(Post.user)
+                .order_by(Post.created_at.desc(), Post.id.desc())
+                .limit(self.count).all())
+        return [PostSummary(row) for row in rows]
+
+
+class RateLimiter:
+    """Token bucket per client: ``burst`` at once, ``rate`` per second"""
+
+    def __init__(self, rate=2.0, burst=20, max_clients=MAX_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, client):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            self._buckets[client] = (tokens - 1 if allowed else tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return allowed
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+recent_posts = RecentPosts()
+not_found_limiter = RateLimiter()
+
+
+def connect_not_found(app):
+    """Apply the app's 404 snapshot and rate limit settings."""
+
+    recent_posts.ttl = app.config.get('NOT_FOUND_SNAPSHOT_TTL', 30)
+    not_found_limiter.rate = app.config.get('NOT_FOUND_RATE', 2.0)
+    not_found_limiter.burst = app.config.get('NOT_FOUND_BURST', 20)
@@ -0,0 +1,103 @@
+"""Keyset (cursor) pagination for Blogly."""
+
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from models import db
+
+
+class InvalidCursor(ValueError):
+    """Cursor token could not be decoded"""
+
+
+def encode_cursor(values):
+    """Turn a list of key values into an opaque, URL-safe token"""
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v
+                      for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, columns):
+    """Turn a token back into key values typed like ``columns``"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise InvalidCursor(token) from e
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise InvalidCursor(token)
+    try:
+        return [_coerce(column, value)
+                for column, value in zip(columns, values)]
+    except (TypeError, ValueError) as e:
+        raise InvalidCursor(token) from e
+
+
+def _coerce(column, value):
+    python_type = column.type.python_type
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    return python_type(value)
+
+
+class KeysetPage:
+    """One page of rows plus the cursors needed to reach its neighbours"""
+
+    def __init__(self, items, key, has_next, has_prev):
+        self.items = items
+        self.next_cursor = (encode_cursor(key(items[-1]))
+                            if items and has_next else None)
+        self.prev_cursor = (encode_cursor(key(items[0]))
+                            if items and has_prev else None)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def keyset_query(query, columns, per_page, before=None, after=None,
+                 descending=True):
+    """``query`` narrowed to one page, for :func:`keyset_result`.
+
+    Works on a ``Query`` or a ``select()``. ``before`` pages forward
+    (towards the end of the ordering) and ``after`` pages backward; both
+    are tokens from a previous :class:`KeysetPage`. The row-value
+    comparison lets the database seek straight into a matching composite
+    index, so every page costs the same no matter how deep it is.
+    """
+    backward = after is not None and before is None
+    token = after if backward else before
+    if token is not None:
+        bound = db.tuple_(*columns)
+        values = db.tuple_(*decode_cursor(token, columns))
+        query = query.filter((bound > values) if descending == backward
+                             else (bound < values))
+    order = [c.asc() if descending == backward else c.desc()
+             for c in columns]
+    return query.order_by(*order).limit(per_page + 1)
+
+
+def keyset_result(rows, key, per_page, before=None, after=None):
+    """The :class:`KeysetPage` for the ``rows`` of a :func:`keyset_query`.
+
+    ``key`` maps a row to its values for the page's columns.
+    """
+    backward = after is not None and before is None
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backward:
+        rows.reverse()
+        return KeysetPage(rows, key, has_next=True, has_prev=more)
+    return KeysetPage(rows, key, has_next=more, has_prev=before is not None)
+
+
+def keyset_page(query, columns, key, per_page, before=None, after=None,
+                descending=True):
+    """Fetch one page of ``query`` ordered by ``columns``"""
+    rows = keyset_query(query, columns, per_page, before, after,
+                        descending).all()
+    return keyset_result(rows, key, per_page, before, after)
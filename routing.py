@@ -0,0 +1,154 @@
+"""Read-replica routing for Blogly.
+
+GET and HEAD requests read from a healthy replica; everything else,
+and anything flushed, goes to the primary. After a write request the
+visitor's session cookie pins them to the primary for
+``READ_YOUR_WRITES_SECONDS``, so the page they are redirected to shows
+their change even if the replicas lag behind. Meanwhile they also skip the
+page cache and the 404 snapshot, which a lagging replica may have refilled
+after their write invalidated them. Replicas are probed with
+``SELECT 1`` at most every ``REPLICA_CHECK_INTERVAL`` seconds; one that
+fails a probe, or drops a connection mid-request, is skipped until it
+passes again.
+"""
+
+import logging
+import random
+import threading
+import time
+
+from flask import (g, has_app_context, has_request_context, request,
+                   session)
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import SQLAlchemyError
+
+from metrics import registry
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+log = logging.getLogger(__name__)
+
+
+def pinned_to_primary():
+    """Whether this visitor wrote recently and so reads from the primary"""
+    return has_request_context() and \
+        session.get('_primary_until', 0) > time.time()
+
+
+class RoutingSession(Session):
+    """Session that sends a read-only request's queries to its replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.bind is not None:
+            # Bound to one connection, as the tests' sessions are.
+            return self.bind
+        if bind is None and not self._flushing and has_app_context():
+            replica = g.get('replica_engine')
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper, clause, bind, **kwargs)
+
+
+class Replica:
+    """One replica engine and its last known health"""
+
+    def __init__(self, name, engine, interval):
+        self.name = name
+        self.engine = engine
+        self.interval = interval
+        self.healthy = True
+        self.checked_at = 0.0
+        self._lock = threading.Lock()
+        event.listen(engine, 'handle_error', self._failed)
+
+    def _failed(self, context):
+        if context.is_disconnect or context.connection is None:
+            self.mark_down()
+
+    def mark_down(self):
+        if self.healthy:
+            log.warning("replica %s is down, reading from primary",
+                        self.name)
+        self.healthy = False
+        self.checked_at = time.monotonic()
+
+    def available(self):
+        if time.monotonic() - self.checked_at >= self.interval and \
+                self._lock.acquire(blocking=False):
+            # One request probes; the rest use the last result meanwhile.
+            try:
+                with self.engine.connect() as connection:
+                    connection.execute(text('SELECT 1'))
+                self.healthy = True
+            except SQLAlchemyError:
+                self.mark_down()
+            finally:
+                self.checked_at = time.monotonic()
+                self._lock.release()
+        return self.healthy
+
+
+class ReplicaRouter:
+    """Chooses the bind each request reads from"""
+
+    def __init__(self, app):
+        self.window = app.config.get('READ_YOUR_WRITES_SECONDS', 5)
+        interval = app.config.get('REPLICA_CHECK_INTERVAL', 10)
+        self.replicas = []
+        for name, options in app.config.get('READ_REPLICAS', {}).items():
+            if isinstance(options, str):
+                options = {'url': options}
+            options = dict(options)
+            self.replicas.append(Replica(
+                name, create_engine(options.pop('url'), **options),
+                interval))
+
+    def choose(self):
+        """Replica engine for this request, or None for the primary"""
+        if request.method not in SAFE_METHODS:
+            return None
+        if pinned_to_primary():
+            return None
+        healthy = [replica for replica in self.replicas
+                   if replica.available()]
+        return random.choice(healthy).engine if healthy else None
+
+    def pin_to_primary(self, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            session['_primary_until'] = time.time() + self.window
+        return response
+
+    def collect(self):
+        yield ('blogly_replica_healthy', 'gauge',
+               'Whether a read replica is in rotation.',
+               [('', {'bind': replica.name}, int(replica.healthy))
+                for replica in self.replicas])
+
+
+def connect_routing(app):
+    """Route read-only requests to the ``READ_REPLICAS``, if any.
+
+    ``READ_REPLICAS`` maps a name to a URL, or to a dict of
+    ``create_engine`` options with a ``url`` key. The replicas are not
+    Flask-SQLAlchemy binds, so ``db.create_all()`` never touches them.
+    """
+
+    router = app.extensions['replica_router'] = ReplicaRouter(app)
+    if not router.replicas:
+        return router
+
+    @app.before_request
+    def choose_bind():
+        g.replica_engine = router.choose()
+
+    @app.after_request
+    def remember_write(response):
+        return router.pin_to_primary(response)
+
+    @app.teardown_request
+    def forget_bind(exc):
+        g.pop('replica_engine', None)
+
+    registry.register('replicas', router.collect)
+    return router
@@ -0,0 +1,123 @@
+"""Full-text search over posts.
+
+PostgreSQL keeps a stored, generated ``tsvector`` column on ``posts`` with a
+GIN index. SQLite (used by the tests) gets an external-content FTS5 table
+kept in sync by triggers. Neither is mapped on :class:`models.Post`; both
+are created alongside the ``posts`` table.
+"""
+
+from markupsafe import Markup, escape
+from sqlalchemy import DDL, event, func, literal_column, table, column, text
+
+from models import db, Post, EXCERPT_LENGTH
+from pagination import keyset_page
+
+# Snippets get the same budget as Post.excerpt.
+SNIPPET_LENGTH = EXCERPT_LENGTH
+
+# Highlight markers: control characters can't come from form input, so
+# they survive until the snippet has been escaped.
+START, STOP = '\x02', '\x03'
+
+POSTGRES_DDL = [
+    "ALTER TABLE posts ADD COLUMN search_vector tsvector GENERATED ALWAYS AS "
+    "(setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(content, '')), 'B')) STORED",
+    "CREATE INDEX ix_posts_search_vector ON posts USING GIN (search_vector)",
+]
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE posts_fts USING fts5("
+    "title, content, content='posts', content_rowid='id')",
+    "CREATE TRIGGER posts_fts_insert AFTER INSERT ON posts BEGIN "
+    "INSERT INTO posts_fts (rowid, title, content) "
+    "VALUES (new.id, new.title, new.content); END",
+    "CREATE TRIGGER posts_fts_delete AFTER DELETE ON posts BEGIN "
+    "INSERT INTO posts_fts (posts_fts, rowid, title, content) "
+    "VALUES ('delete', old.id, old.title, old.content); END",
+    "CREATE TRIGGER posts_fts_update AFTER UPDATE ON posts BEGIN "
+    "INSERT INTO posts_fts (posts_fts, rowid, title, content) "
+    "VALUES ('delete', old.id, old.title, old.content); "
+    "INSERT INTO posts_fts (rowid, title, content) "
+    "VALUES (new.id, new.title, new.content); END",
+]
+
+for statement in POSTGRES_DDL:
+    event.listen(Post.__table__, 'after_create',
+                 DDL(statement).execute_if(dialect='postgresql'))
+for statement in SQLITE_DDL:
+    event.listen(Post.__table__, 'after_create',
+                 DDL(statement).execute_if(dialect='sqlite'))
+event.listen(Post.__table__, 'before_drop',
+             DDL("DROP TABLE IF EXISTS posts_fts").execute_if(
+                 dialect='sqlite'))
+
+
+def _postgres_query(terms):
+    query = func.websearch_to_tsquery('english', terms)
+    vector = literal_column('posts.search_vector')
+    # ts_rank_cd() is a float4; widen it so cursors round-trip exactly.
+    rank = func.ts_rank_cd(vector, query).cast(db.Float)
+    snippet = func.ts_headline(
+        'english', Post.content, query,
+        f'StartSel={START}, StopSel={STOP}, MaxWords=40, MinWords=20')
+    return (db.session.query(Post, rank.label('rank'),
+                             snippet.label('snippet'))
+            .filter(vector.op('@@')(query)), rank)
+
+
+fts = table('posts_fts', column('rowid'))
+
+
+def _sqlite_query(terms):
+    # Quote every word so user input can't use FTS5 query syntax.
+    match = ' '.join('"' + word.replace('"', '""') + '"'
+                     for word in terms.split())
+    # bm25() is lower for better matches; negate it to rank like Postgres.
+    rank = (-func.bm25(literal_column('posts_fts'), 10.0, 1.0)) \
+        .cast(db.Float)
+    snippet = func.snippet(literal_column('posts_fts'), 1, START, STOP,
+                           ' ... ', 40)
+    return (db.session.query(Post, rank.label('rank'),
+                             snippet.label('snippet'))
+            .join(fts, fts.c.rowid == Post.id)
+            .filter(text('posts_fts MATCH :match'))
+            .params(match=match), rank)
+
+
+def highlight(snippet):
+    """Escape a snippet, mark matches and truncate like homepage_content"""
+    truncated = len(snippet) > SNIPPET_LENGTH
+    snippet = snippet[:SNIPPET_LENGTH]
+    if snippet.count(START) > snippet.count(STOP):
+        snippet += STOP
+    html = str(escape(snippet)).replace(START, '<mark>') \
+        .replace(STOP, '</mark>')
+    return Markup(html + (' ...' if truncated else ''))
+
+
+class SearchResult:
+    """A matching post, its rank and a highlighted snippet"""
+
+    def __init__(self, row):
+        self.post = row.Post
+        self.rank = row.rank
+        self.snippet = highlight(row.snippet or '')
+
+
+def search_posts(terms, per_page, before=None, after=None):
+    """Ranked matches for ``terms`` as a :class:`pagination.KeysetPage`.
+
+    Pages are keyed on (rank, id), so deep result pages cost no more than
+    the first.
+    """
+    if db.session.get_bind(Post).dialect.name == 'postgresql':
+        query, rank = _postgres_query(terms)
+    else:
+        query, rank = _sqlite_query(terms)
+    query = query.options(db.joinedload(Post.user), db.defer(Post.content))
+    page = keyset_page(query, [rank, Post.id],
+                       lambda row: (row.rank, row.Post.id), per_page,
+                       before=before, after=after)
+    page.items = [SearchResult(row) for row in page.items]
+    return page
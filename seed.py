@@ -1,33 +1,19 @@
-from random import randint
-
 from models import User, Post, db
 from app import app
 import sqlalchemy as db2
 from sqlalchemy_utils import database_exists, create_database
-from datetime import datetime, timezone, UTC, timedelta
-
-def generate_random_datetime_start(start_date=datetime(2021,5,1),
-                             end_date=datetime(2022,5,1)):
-    time_between_days = end_date - start_date
-    days_since_start = randint(0, time_between_days.days)
-    random_date = start_date + timedelta(days=days_since_start)
-    random_date += timedelta(seconds=randint(0, 24 * 60 * 60))
-    return random_date
-
-def generate_random_datetime_end(start_date=datetime(2022,5,2),
-                             end_date=datetime(2024,5,1)):
-    time_between_days = end_date - start_date
-    days_since_start = randint(0, time_between_days.days)
-    random_date = start_date + timedelta(days=days_since_start)
-    random_date += timedelta(seconds=randint(0, 24 * 60 * 60))
-    return random_date
+from datagen import generate_random_datetime_start, \
+    generate_random_datetime_end
+from migrate import downgrade, upgrade
 
 engine = db2.create_engine('postgresql:///blogly_part1')
 if not database_exists(engine.url):
     create_database(engine.url, encoding='SQL_ASCII')
 with app.app_context():
+    downgrade(db.engine, 'base')
+    # Also clears tables made by db.create_all() before migrations existed.
     db.drop_all()
-    db.create_all()
+    upgrade(db.engine)
     user1 = User(first_name="Alice", last_name="Smith",
              image_url="https://via.placeholder.com/50")
     user2 = User(first_name="Bob", last_name="Johnson",
@@ -0,0 +1,280 @@
+"""Serve Blogly from several worker processes.
+
+Usage: python serve.py [--host H] [--port P] [--workers N] [--threads N]
+                       [--pool-size N] [--preload] [--access-log]
+
+The master process binds the socket and forks ``--workers`` processes that
+each accept on it with ``--threads`` threads. A worker serves at most
+``--threads`` connections at once; further ones wait in the socket's
+backlog for any worker with a free thread. An idle keep-alive connection
+gives its thread up after ``--keep-alive`` seconds. A worker's pool holds
+``--pool-size`` connections (default: one per thread), so the database sees
+at most workers x (pool size + ``--max-overflow``) of them.
+
+Without ``--preload`` each worker builds its own app after the fork. With
+it the app is built once in the master and shared copy-on-write; each
+worker then disposes the engines it inherited, since a connection opened
+before the fork must never be used by two processes.
+
+Static files are fingerprinted once, by a short-lived child of the
+master, before any worker starts (see assets.py); workers only read the
+manifest. The master itself never imports the app's modules unless
+preloading, so workers started by a reload import fresh copies.
+
+Signals to the master: ``HUP`` starts fresh workers (picking up new code,
+unless preloaded) and gracefully stops the old ones; ``TERM`` or ``INT``
+stops gracefully. A worker stopping gracefully finishes the requests it
+has accepted, for up to ``--graceful-timeout`` seconds. Workers that exit
+unexpectedly are replaced.
+"""
+import argparse
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+
+from werkzeug.serving import ThreadedWSGIServer, WSGIRequestHandler
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class BoundedServer(ThreadedWSGIServer):
+    """A threaded server handling at most ``threads`` connections at once"""
+
+    def __init__(self, *args, threads, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.slots = threading.BoundedSemaphore(threads)
+
+    def process_request(self, request, client_address):
+        # Waits for a free thread before starting one; meanwhile new
+        # connections stay in the backlog for the other workers.
+        self.slots.acquire()
+        try:
+            super().process_request(request, client_address)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self.slots.release()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000,
+                        help='0 picks a free port.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--threads', type=int, default=8,
+                        help='Threads, and so connections, per worker.')
+    parser.add_argument('--keep-alive', type=float, default=5,
+                        help='Seconds an idle connection keeps its thread.')
+    parser.add_argument('--pool-size', type=int,
+                        help='Connections per worker (default: --threads).')
+    parser.add_argument('--max-overflow', type=int, default=2,
+                        help='Extra connections per worker under load.')
+    parser.add_argument('--profile', help='Settings profile '
+                        '(default: $BLOGLY_ENV).')
+    parser.add_argument('--preload', action='store_true',
+                        help='Build the app once, before forking.')
+    parser.add_argument('--graceful-timeout', type=float, default=30)
+    parser.add_argument('--access-log', action='store_true')
+    return parser.parse_args(argv)
+
+
+def build_static(args):
+    """Build the static files for every worker, if the profile builds them.
+
+    The build runs in a child process, which imports the config and assets
+    modules in place of the master. Returns whether it succeeded.
+    """
+    pid = os.fork()
+    if pid == 0:
+        status = 0
+        try:
+            from flask import Flask
+
+            from assets import build
+            from config import load_config
+
+            app = Flask('app')
+            load_config(app, args.profile)
+            if app.config['ASSETS_BUILD']:
+                build(app.static_folder)
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+        finally:
+            os._exit(status)
+    return os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1]) == 0
+
+
+def build_app(args):
+    from app import create_app
+
+    # The master has built the static files already.
+    return create_app(args.profile, {
+        'DB_POOL_SIZE': args.pool_size or args.threads,
+        'DB_MAX_OVERFLOW': args.max_overflow,
+        'ASSETS_BUILD': False})
+
+
+def after_fork(app):
+    """Forget the connections ``app``'s engines opened in the parent.
+
+    ``close=False`` leaves the parent's connections open for the parent;
+    this process gets fresh pools.
+    """
+    from models import db
+
+    with app.app_context():
+        engines = list(db.engines.values())
+    router = app.extensions.get('replica_router')
+    if router is not None:
+        engines.extend(replica.engine for replica in router.replicas)
+    for engine in engines:
+        engine.dispose(close=False)
+
+
+def run_worker(listener, app, args):
+    """Serve ``listener`` until told to stop; runs in the forked child"""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    if app is None:
+        app = build_app(args)
+    else:
+        after_fork(app)
+    handler = type('Handler', (WSGIRequestHandler if args.access_log
+                               else QuietHandler,),
+                   {'timeout': args.keep_alive})
+    server = BoundedServer(args.host, 0, app, handler, fd=listener.fileno(),
+                           threads=args.threads)
+    # Let server_close() wait for the requests in progress.
+    server.daemon_threads = False
+    server.block_on_close = True
+
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown).start()
+        # After a reload nobody else enforces the timeout.
+        signal.alarm(max(int(args.graceful_timeout), 1))
+
+    signal.signal(signal.SIGTERM, stop)
+    server.serve_forever()
+    server.server_close()
+
+
+class Master:
+    """Keeps ``--workers`` children serving one socket"""
+
+    def __init__(self, listener, args, app=None):
+        self.listener = listener
+        self.args = args
+        self.app = app
+        self.workers = {}
+        self.generation = 0
+        self.reloading = False
+        self.stopping = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                run_worker(self.listener, self.app, self.args)
+            except BaseException:
+                traceback.print_exc()
+                status = 1
+            finally:
+                os._exit(status)
+        self.workers[pid] = (self.generation, time.monotonic())
+
+    def signal_workers(self, signum, generations=None):
+        for pid, (generation, _) in list(self.workers.items()):
+            if generations is None or generation in generations:
+                try:
+                    os.kill(pid, signum)
+                except ProcessLookupError:
+                    pass
+
+    def reap(self):
+        """Forget exited workers; True if one died young, i.e. crashed"""
+        crashed = False
+        while self.workers:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                break
+            generation, started = self.workers.pop(pid, (None, 0))
+            if (generation == self.generation and not self.stopping and
+                    time.monotonic() - started < 1):
+                crashed = True
+        return crashed
+
+    def run(self):
+        signal.signal(signal.SIGHUP, self.reload)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        deadline = None
+        while True:
+            if self.reap():
+                # Don't spin on a worker that cannot start.
+                time.sleep(1)
+            if self.stopping:
+                if not self.workers:
+                    return
+                if deadline is None:
+                    self.signal_workers(signal.SIGTERM)
+                    deadline = time.monotonic() + self.args.graceful_timeout
+                elif time.monotonic() > deadline:
+                    self.signal_workers(signal.SIGKILL)
+            elif self.reloading:
+                self.reloading = False
+                if self.app is None and not build_static(self.args):
+                    print("static build failed; keeping the old workers",
+                          file=sys.stderr, flush=True)
+                    continue
+                old = set(range(self.generation + 1))
+                self.generation += 1
+                for _ in range(self.args.workers):
+                    self.spawn()
+                self.signal_workers(signal.SIGTERM, old)
+            else:
+                running = sum(generation == self.generation
+                              for generation, _ in self.workers.values())
+                for _ in range(self.args.workers - running):
+                    self.spawn()
+            time.sleep(0.1)
+
+    def reload(self, signum, frame):
+        self.reloading = True
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    listener = socket.create_server((args.host, args.port), backlog=2048)
+    listener.set_inheritable(True)
+    if not build_static(args):
+        return 1
+    app = build_app(args) if args.preload else None
+    host, port = listener.getsockname()[:2]
+    print(f"serving on http://{host}:{port} with {args.workers} workers x "
+          f"{args.threads} threads", flush=True)
+    Master(listener, args, app).run()
+    listener.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
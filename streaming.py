@@ -0,0 +1,63 @@
+"""Opt-in streamed rendering for pages that list many rows.
+
+With ``STREAM_TEMPLATES`` set, or ``?stream=1`` on the request, list pages
+are sent while they render. Jinja's ``generate`` produces the HTML a piece
+at a time and it is flushed in ``STREAM_BUFFER_SIZE`` chunks; rows given as
+:func:`stream_rows` come off a server-side cursor ``STREAM_CHUNK_ROWS`` at a
+time. Neither the rows nor the whole page are ever held in memory, and the
+first bytes go out before the last row is read.
+"""
+
+from flask import current_app, request, render_template, stream_template, \
+    Response
+
+from models import db
+from timefmt import annotate
+
+
+def wants_stream():
+    if request.args.get('stream'):
+        return request.args['stream'] not in ('0', 'false')
+    return current_app.config.get('STREAM_TEMPLATES', False)
+
+
+def buffered(pieces, size):
+    """Join small template fragments into chunks of about ``size`` chars"""
+    chunk = []
+    length = 0
+    for piece in pieces:
+        chunk.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield ''.join(chunk)
+            chunk = []
+            length = 0
+    if chunk:
+        yield ''.join(chunk)
+
+
+def render_list(template, **context):
+    """``render_template``, or a streamed response when streaming is on"""
+    if not wants_stream():
+        return render_template(template, **context)
+    return Response(buffered(stream_template(template, **context),
+                             current_app.config.get('STREAM_BUFFER_SIZE',
+                                                    8192)),
+                    mimetype='text/html')
+
+
+def stream_rows(statement):
+    """Posts selected by ``statement``, read and annotated chunk by chunk.
+
+    Without streaming the rows are simply loaded and annotated up front.
+    """
+    if not wants_stream():
+        return annotate(db.session.scalars(statement).all())
+    chunk_rows = current_app.config.get('STREAM_CHUNK_ROWS', 500)
+
+    def generate():
+        result = db.session.scalars(
+            statement.execution_options(yield_per=chunk_rows))
+        for chunk in result.partitions():
+            yield from annotate(chunk)
+    return generate()
@@ -0,0 +1,130 @@
+import os
+
+os.environ.setdefault('BLOGLY_ENV', 'testing')
+
+from app import app
+from models import db, User, Post
+from testing import DatabaseTestCase, utc
+
+
+class ApiTests(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        app.config['QUERY_COUNT_HEADER'] = True
+        with app.app_context():
+            users = [User(first_name=f"First{i}", last_name=f"Last{i}")
+                     for i in range(3)]
+            db.session.add_all(users)
+            db.session.commit()
+            posts = [Post(title=f"Post {i}", content="Lorem ipsum",
+                          created_at=utc(2022, 1, i + 1, 4, 47, 4),
+                          user_id=users[i % 3].id)
+                     for i in range(6)]
+            db.session.add_all(posts)
+            db.session.commit()
+            self.user_ids = [user.id for user in users]
+            self.post_ids = [post.id for post in posts]
+
+    def tearDown(self):
+        app.config['QUERY_COUNT_HEADER'] = False
+        super().tearDown()
+
+    def test_sparse_fields(self):
+        with app.test_client() as client:
+            resp = client.get("/api/v1/posts?fields=id,title&limit=2")
+            self.assertEqual(resp.status_code, 200)
+            data = resp.json['data']
+            self.assertEqual(data, [
+                {'id': self.post_ids[5], 'title': "Post 5"},
+                {'id': self.post_ids[4], 'title': "Post 4"}])
+            older = client.get(f"/api/v1/posts?fields=title&limit=2"
+                               f"&before={resp.json['next']}").json
+            self.assertEqual([post['title'] for post in older['data']],
+                             ["Post 3", "Post 2"])
+            self.assertEqual(client.get("/api/v1/posts?fields=password")
+                             .status_code, 400)
+
+    def test_recently_modified(self):
+        with app.app_context():
+            db.session.execute(Post.__table__.update().values(
+                modified_on=Post.created_at))
+            db.session.commit()
+        with app.test_client() as client:
+            client.patch(f"/api/v1/posts/{self.post_ids[1]}",
+                         json={'title': "Edited"})
+            resp = client.get("/api/v1/posts?sort=modified&fields=id&limit=2")
+            self.assertEqual([post['id'] for post in resp.json['data']],
+                             [self.post_ids[1], self.post_ids[5]])
+            older = client.get(f"/api/v1/posts?sort=modified&fields=id"
+                               f"&before={resp.json['next']}").json
+            self.assertEqual([post['id'] for post in older['data']],
+                             [self.post_ids[i] for i in (4, 3, 2, 0)])
+            self.assertEqual(client.get("/api/v1/posts?sort=title")
+                             .status_code, 400)
+
+    def test_batch_fetch_is_one_query(self):
+        wanted = [self.post_ids[3], 0, self.post_ids[1]]
+        with app.test_client() as client:
+            resp = client.get("/api/v1/posts?ids=" +
+                              ",".join(map(str, wanted)))
+            self.assertEqual([post['id'] for post in resp.json['data']],
+                             [self.post_ids[3], self.post_ids[1]])
+            self.assertEqual(resp.headers['X-Query-Count'], '1')
+            self.assertEqual(client.get("/api/v1/posts?ids=1,x")
+                             .status_code, 400)
+
+    def test_user_detail_and_list(self):
+        with app.test_client() as client:
+            user = client.get(f"/api/v1/users/{self.user_ids[0]}").json['data']
+            self.assertEqual(user['first_name'], "First0")
+            self.assertEqual(user['post_count'], 2)
+            names = [u['last_name'] for u in
+                     client.get("/api/v1/users?fields=last_name").json['data']]
+            self.assertEqual(names, ["Last0", "Last1", "Last2"])
+            resp = client.get("/api/v1/users/0")
+            self.assertEqual(resp.status_code, 404)
+            self.assertEqual(resp.json['error'], "Not Found")
+
+    def test_create_update_delete(self):
+        with app.test_client() as client:
+            resp = client.post("/api/v1/posts", json={
+                'title': "New", 'content': "Body",
+                'user_id': self.user_ids[1]})
+            self.assertEqual(resp.status_code, 201)
+            post_id = resp.json['data']['id']
+            self.assertEqual(resp.headers['Location'],
+                             f"/api/v1/posts/{post_id}")
+            resp = client.patch(f"/api/v1/posts/{post_id}",
+                                json={'title': "Edited"})
+            self.assertEqual(resp.json['data']['title'], "Edited")
+            self.assertIsNotNone(resp.json['data']['modified_on'])
+            self.assertEqual(client.delete(f"/api/v1/posts/{post_id}")
+                             .status_code, 204)
+            self.assertEqual(client.get(f"/api/v1/posts/{post_id}")
+                             .status_code, 404)
+
+            resp = client.post("/api/v1/users", json={
+                'first_name': "Api", 'last_name': "User"})
+            self.assertEqual(resp.status_code, 201)
+            user_id = resp.json['data']['id']
+            resp = client.patch(f"/api/v1/users/{user_id}",
+                                json={'middle_name': "Q"})
+            self.assertEqual(resp.json['data']['middle_name'], "Q")
+            self.assertEqual(client.delete(f"/api/v1/users/{user_id}")
+                             .status_code, 204)
+
+    def test_invalid_payloads(self):
+        with app.test_client() as client:
+            for body in ({'title': "No user"},
+                         {'title': "x" * 200, 'user_id': self.user_ids[0]},
+                         {'title': "T", 'user_id': "1"},
+                         {'title': "T", 'user_id': self.user_ids[0],
+                          'verified': True}):
+                resp = client.post("/api/v1/posts", json=body)
+                self.assertEqual(resp.status_code, 400, body)
+            resp = client.post("/api/v1/posts", json={
+                'title': "T", 'user_id': 0})
+            self.assertEqual(resp.status_code, 404)
+            resp = client.patch(f"/api/v1/users/{self.user_ids[0]}",
+                                json={'first_name': None})
+            self.assertEqual(resp.status_code, 400)
@@ -0,0 +1,192 @@
+import asyncio
+import os
+import tempfile
+from unittest import TestCase
+from urllib.parse import urlsplit
+
+os.environ.setdefault('BLOGLY_ENV', 'testing')
+
+from app import app, create_app
+from asgi import BloglyASGI
+from asyncreads import async_reads, connect_async_reads
+from cache import page_cache
+from metrics import registry
+from models import db, User, Post
+from writebehind import post_writer
+from testing import DatabaseTestCase, requires_postgres, utc
+
+
+async def call(asgi, method, url, headers=(), body=b''):
+    """Send one request to ``asgi``; returns (status, headers, body)"""
+    parts = urlsplit(url)
+    if body:
+        headers = [*headers, ('Content-Length', str(len(body)))]
+    scope = {'type': 'http', 'http_version': '1.1', 'method': method,
+             'scheme': 'http', 'path': parts.path, 'root_path': '',
+             'raw_path': parts.path.encode(),
+             'query_string': parts.query.encode(),
+             'headers': [(name.lower().encode(), value.encode())
+                         for name, value in headers],
+             'client': ('127.0.0.1', 50000), 'server': ('localhost', 80)}
+    messages = []
+    requests = [{'type': 'http.request', 'body': body, 'more_body': False}]
+
+    async def receive():
+        if requests:
+            return requests.pop()
+        await asyncio.Event().wait()
+
+    async def send(message):
+        messages.append(message)
+
+    try:
+        await asgi(scope, receive, send)
+    finally:
+        # Pooled connections belong to this event loop.
+        await async_reads.dispose()
+    start = messages[0]
+    return (start['status'],
+            {name.decode(): value.decode()
+             for name, value in start['headers']},
+            b''.join(message.get('body', b'')
+                     for message in messages[1:]).decode())
+
+
+class AsyncReadsTests:
+    """Tests run against the database each subclass sets up"""
+
+    overrides = {}
+
+    def build(self, **overrides):
+        """A BloglyASGI over a fresh app, undone for ``app`` afterwards"""
+        self.addCleanup(registry.collectors.update, dict(registry.collectors))
+        self.addCleanup(page_cache.init_app, app)
+        self.addCleanup(post_writer.init_app, app)
+        self.addCleanup(async_reads.init_app, app)
+        built = create_app('testing', {'SQLALCHEMY_ECHO': False,
+                                       'QUERY_COUNT_HEADER': True,
+                                       **self.overrides, **overrides})
+        with built.app_context():
+            self.addCleanup(db.engine.dispose)
+        connect_async_reads(built)
+        return BloglyASGI(built)
+
+    def setUp(self):
+        super().setUp()
+        self.asgi = self.build(ASYNC_READS=True)
+        self.flask = self.asgi.app
+        with self.flask.app_context():
+            user = User(first_name="Tracy", middle_name="",
+                        last_name="Rera")
+            db.session.add(user)
+            db.session.flush()
+            self.user_id = user.id
+            for number in range(7):
+                db.session.add(Post(title=f"Post {number}",
+                                    content="Lorem ipsum " * number,
+                                    created_at=utc(2022, 1, number + 1),
+                                    user_id=user.id))
+            db.session.commit()
+            self.post_id = Post.query.filter_by(title="Post 3").one().id
+
+    def get(self, url, headers=(), asgi=None):
+        return asyncio.run(call(asgi or self.asgi, 'GET', url, headers))
+
+    def async_checkouts(self):
+        return self.flask.extensions['pool_metrics'][
+            'default_async'].checkouts
+
+    def test_read_pages_match_flask(self):
+        client = self.flask.test_client()
+        for url in ['/posts', f'/posts/{self.post_id}', '/users',
+                    '/users?letter=r', '/users?sort=active',
+                    f'/users/{self.user_id}']:
+            with self.subTest(url=url):
+                page_cache.clear()
+                status, headers, body = self.get(url)
+                page_cache.clear()
+                expected = client.get(url)
+                self.assertEqual(status, 200)
+                self.assertEqual(body, expected.get_data(as_text=True))
+                self.assertEqual(headers.get('etag'), expected.headers.get(
+                    'ETag'))
+
+    def test_feed_pages_through_cursors(self):
+        status, headers, body = self.get('/posts')
+        self.assertIn("Post 6", body)
+        self.assertNotIn("Post 1", body)
+        older = body.split('/posts?before=')[1].split('"')[0]
+        status, headers, body = self.get(f'/posts?before={older}')
+        self.assertIn("Post 1", body)
+        self.assertNotIn("Post 6", body)
+        self.assertEqual(self.get('/posts?before=nonsense')[0], 400)
+
+    def test_reads_run_on_async_engine(self):
+        checkouts = self.async_checkouts()
+        status, headers, body = self.get(f'/posts/{self.post_id}')
+        self.assertIn("Post 3", body)
+        # The ETag query and the post, both counted by instrumentation.
+        self.assertEqual(headers['x-query-count'], '2')
+        self.assertIn('sql;dur=', headers['server-timing'])
+        self.assertEqual(self.async_checkouts(), checkouts + 2)
+
+    def test_not_modified(self):
+        status, headers, body = self.get(f'/users/{self.user_id}')
+        status, headers, body = self.get(
+            f'/users/{self.user_id}', [('If-None-Match', headers['etag'])])
+        self.assertEqual(status, 304)
+        self.assertEqual(body, '')
+
+    def test_head(self):
+        status, headers, body = asyncio.run(call(self.asgi, 'HEAD',
+                                                 '/posts'))
+        self.assertEqual(status, 200)
+        self.assertEqual(body, '')
+        self.assertNotEqual(headers['content-length'], '0')
+
+    def test_missing_pages(self):
+        self.assertEqual(self.get('/posts/999999')[0], 404)
+        self.assertEqual(self.get('/users/999999')[0], 404)
+
+    def test_writes_and_streams_run_on_flask(self):
+        checkouts = self.async_checkouts()
+        status, headers, body = asyncio.run(call(
+            self.asgi, 'POST', '/users/new',
+            [('Content-Type', 'application/x-www-form-urlencoded')],
+            b'first_name=Ann&middle_name=&last_name=Ames&image_url='))
+        self.assertEqual(status, 302)
+        status, headers, body = self.get('/users?stream=1')
+        self.assertIn("Ann Ames", body)
+        self.assertNotIn('x-query-count', headers)
+        self.assertEqual(self.async_checkouts(), checkouts)
+        self.assertIn("Ann Ames", self.get('/users')[2])
+
+    def test_off_by_default(self):
+        asgi = self.build()
+        self.assertEqual(async_reads.engines, {})
+        status, headers, body = self.get(f'/posts/{self.post_id}',
+                                         asgi=asgi)
+        self.assertEqual(status, 200)
+        self.assertIn("Post 3", body)
+
+
+class SQLiteAsyncReadsTests(AsyncReadsTests, TestCase):
+    """On a SQLite file, through aiosqlite"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.overrides = {'SQLALCHEMY_DATABASE_URI':
+                          f"sqlite:///{directory.name}/blogly.db"}
+        built = self.build()
+        with built.app.app_context():
+            db.create_all()
+        super().setUp()
+
+
+@requires_postgres
+class PostgresAsyncReadsTests(AsyncReadsTests, DatabaseTestCase):
+    """On the test database, through asyncpg"""
+
+    # The async engine cannot join the test's transaction.
+    transactional = False
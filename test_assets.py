@@ -0,0 +1,97 @@
+import gzip
+import os
+import tempfile
+from unittest import TestCase
+
+from flask import Flask, url_for
+
+from assets import build, connect_assets, IMMUTABLE
+
+STYLES = "body { color: #333; }\n" * 40
+
+
+class AssetsTestCase(TestCase):
+    """Tests for fingerprinted, precompressed static files."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.static = os.path.join(self.tmp.name, 'static')
+        os.makedirs(self.static)
+        self.write('styles.css', STYLES)
+        self.write('tiny.js', "go();")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name, content):
+        with open(os.path.join(self.static, name), 'w') as f:
+            f.write(content)
+
+    def make_app(self):
+        app = Flask(__name__, static_folder=self.static)
+        app.config['ASSETS_BUILD'] = True
+        connect_assets(app)
+        return app
+
+    def test_fingerprint_changes_with_content(self):
+        first = build(self.static)['styles.css']
+        self.assertRegex(first, r'^build/styles\.[0-9a-f]{16}\.css$')
+        self.assertEqual(build(self.static)['styles.css'], first)
+        self.write('styles.css', STYLES + "p {}\n")
+        self.assertNotEqual(build(self.static)['styles.css'], first)
+
+    def test_build_leaves_no_temporary_files(self):
+        build(self.static)
+        self.write('styles.css', STYLES + "p {}\n")
+        manifest = build(self.static)
+        output = os.path.join(self.static, 'build')
+        self.assertEqual(
+            [name for name in os.listdir(output) if name.startswith('.')],
+            [])
+        self.assertTrue(os.path.exists(
+            os.path.join(self.static, manifest['styles.css'] + '.gz')))
+
+    def test_url_for_uses_manifest(self):
+        app = self.make_app()
+        with app.test_request_context():
+            self.assertRegex(url_for('static', filename='styles.css'),
+                             r'^/static/build/styles\.[0-9a-f]+\.css$')
+            self.assertEqual(url_for('static', filename='missing.css'),
+                             '/static/missing.css')
+
+    def test_serves_immutable_precompressed(self):
+        app = self.make_app()
+        with app.test_request_context():
+            url = url_for('static', filename='styles.css')
+        with app.test_client() as client:
+            resp = client.get(url, headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.headers['Cache-Control'], IMMUTABLE)
+            self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+            self.assertIn('Accept-Encoding', resp.headers['Vary'])
+            self.assertEqual(resp.mimetype, 'text/css')
+            self.assertEqual(gzip.decompress(resp.data).decode(), STYLES)
+            resp.close()
+
+            resp = client.get(url)
+            self.assertNotIn('Content-Encoding', resp.headers)
+            self.assertEqual(resp.get_data(as_text=True), STYLES)
+            resp.close()
+
+    def test_small_files_not_compressed(self):
+        app = self.make_app()
+        with app.test_request_context():
+            url = url_for('static', filename='tiny.js')
+        with app.test_client() as client:
+            resp = client.get(url, headers={'Accept-Encoding': 'gzip'})
+            self.assertNotIn('Content-Encoding', resp.headers)
+            self.assertEqual(resp.get_data(as_text=True), "go();")
+            resp.close()
+
+    def test_unbuilt_files_not_found(self):
+        app = self.make_app()
+        with app.test_client() as client:
+            self.assertEqual(
+                client.get('/static/build/styles.0000.css').status_code, 404)
+            self.assertEqual(client.get('/static/styles.css').status_code,
+                             200)
@@ -0,0 +1,204 @@
+import io
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+
+from PIL import Image
+
+from app import app
+from models import db, User, DEFAULT_IMAGE_URL
+from avatars import avatars, AvatarCache, FetchError
+from testing import DatabaseTestCase
+
+IMAGE = b'\x89PNG\r\n\x1a\n' + b'\x00' * 120
+
+
+def png(width, height):
+    output = io.BytesIO()
+    Image.new('RGB', (width, height), 'teal').save(output, 'PNG')
+    return output.getvalue()
+
+
+PICTURE = png(300, 200)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serves ``PICTURE`` at /avatar.png and HTML everywhere else"""
+
+    def do_GET(self):
+        self.server.hits += 1
+        image = self.path == '/avatar.png'
+        body = PICTURE if image else b'<html></html>'
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png' if image
+                         else 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class AvatarTests(DatabaseTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        cls.server.hits = 0
+        cls.base = f"http://127.0.0.1:{cls.server.server_port}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.saved = avatars.cache.directory, avatars.allow_private
+        avatars.cache.directory = self.tmp.name
+        avatars.allow_private = True
+        self.server.hits = 0
+        with app.app_context():
+            user = User(first_name="Ava", last_name="Tar",
+                        image_url=f"{self.base}/avatar.png")
+            db.session.add(user)
+            db.session.commit()
+            self.user_id = user.id
+
+    def tearDown(self):
+        avatars.cache.directory, avatars.allow_private = self.saved
+        self.tmp.cleanup()
+        super().tearDown()
+
+    def test_fetched_once_then_cached(self):
+        with app.test_client() as client:
+            resp = client.get(f"/avatars/{self.user_id}")
+            self.assertEqual(resp.status_code, 200)
+            self.assertTrue(resp.mimetype.startswith('image/'))
+            self.assertIn('max-age', resp.headers['Cache-Control'])
+            etag = resp.headers['ETag']
+            again = client.get(f"/avatars/{self.user_id}")
+            self.assertEqual(again.data, resp.data)
+            self.assertEqual(again.headers['ETag'], etag)
+        self.assertEqual(self.server.hits, 1)
+
+    def test_not_modified(self):
+        with app.test_client() as client:
+            etag = client.get(f"/avatars/{self.user_id}").headers['ETag']
+            resp = client.get(f"/avatars/{self.user_id}",
+                              headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.data, b'')
+
+    def test_sizes(self):
+        with app.test_client() as client:
+            for size, expected in ((50, (50, 33)), (100, (100, 67))):
+                resp = client.get(f"/avatars/{self.user_id}?size={size}")
+                self.assertEqual(resp.status_code, 200)
+                self.assertEqual(resp.mimetype, 'image/png')
+                self.assertEqual(Image.open(io.BytesIO(resp.data)).size,
+                                 expected)
+            self.assertEqual(
+                client.get(f"/avatars/{self.user_id}?size=7").status_code,
+                400)
+            self.assertEqual(client.get("/avatars/0").status_code, 404)
+
+    def test_unusable_source_redirects(self):
+        url = f"{self.base}/page.html"
+        with app.app_context():
+            db.session.get(User, self.user_id).image_url = url
+            db.session.commit()
+        with app.test_client() as client:
+            resp = client.get(f"/avatars/{self.user_id}")
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(resp.location, url)
+
+    def test_failure_remembered(self):
+        url = f"{self.base}/page.html"
+        with app.app_context():
+            db.session.get(User, self.user_id).image_url = url
+            db.session.commit()
+        with app.test_client() as client:
+            for _ in range(3):
+                self.assertEqual(
+                    client.get(f"/avatars/{self.user_id}").location, url)
+        self.assertEqual(self.server.hits, 1)
+
+    def test_static_image_redirects(self):
+        with app.app_context():
+            db.session.get(User, self.user_id).image_url = \
+                DEFAULT_IMAGE_URL
+            db.session.commit()
+        with app.test_client() as client:
+            resp = client.get(f"/avatars/{self.user_id}")
+            self.assertEqual(resp.status_code, 302)
+            self.assertRegex(resp.location, r'^/static/.*avatar.*\.svg$')
+        self.assertEqual(self.server.hits, 0)
+
+    def test_private_hosts_refused(self):
+        avatars.allow_private = False
+        with self.assertRaises(FetchError):
+            avatars.fetch(f"{self.base}/avatar.png")
+        self.assertEqual(self.server.hits, 0)
+        with self.assertRaises(FetchError):
+            avatars.fetch("file:///etc/passwd")
+
+    def test_users_page_links_avatar(self):
+        with app.test_client() as client:
+            html = client.get(f"/users/{self.user_id}").get_data(as_text=True)
+            self.assertIn(f'src="/avatars/{self.user_id}"', html)
+            self.assertNotIn('avatar.png', html)
+
+
+class AvatarCacheTestCase(TestCase):
+    """Tests for the content-addressed thumbnail cache."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = AvatarCache(self.tmp.name, max_bytes=250)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def blobs(self):
+        return os.listdir(os.path.join(self.tmp.name, 'blobs'))
+
+    def test_same_image_stored_once(self):
+        first = self.cache.put(self.cache.key('http://a/1', 50),
+                               'image/png', IMAGE)
+        second = self.cache.put(self.cache.key('http://b/2', 50),
+                                'image/png', IMAGE)
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.blobs()), 1)
+        self.assertEqual(self.cache.get(self.cache.key('http://b/2', 50)),
+                         (first, 'image/png', IMAGE))
+
+    def test_evicts_least_recently_used(self):
+        keys = [self.cache.key(f'http://a/{i}', 50) for i in range(3)]
+        for i, key in enumerate(keys):
+            self.cache.put(key, 'image/png', bytes([i]) * 100)
+            os.utime(os.path.join(self.tmp.name, 'blobs',
+                                  self.cache.get(key)[0]), (i, i))
+        self.assertEqual(self.cache.evictions, 1)
+        self.assertIsNone(self.cache.get(keys[0]))
+        self.assertIsNotNone(self.cache.get(keys[2]))
+        self.assertEqual(sorted(os.listdir(os.path.join(self.tmp.name,
+                                                        'index'))),
+                         sorted(keys[1:]))
+
+    def test_expired_failures_pruned(self):
+        for key in ('old', 'new'):
+            self.cache.put_failure(key)
+        failures = os.path.join(self.tmp.name, 'failures')
+        os.utime(os.path.join(failures, 'old'), (0, 0))
+        self.assertFalse(self.cache.failed('old'))
+        self.assertTrue(self.cache.failed('new'))
+        self.cache.prune_failures()
+        self.assertEqual(os.listdir(failures), ['new'])
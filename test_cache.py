@@ -0,0 +1,97 @@
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+
+from cache import LocalBackend, SharedBackend, StubClient, PageCache
+
+
+class LocalBackendTests(TestCase):
+    def test_lru_eviction(self):
+        cache = LocalBackend(max_entries=2, ttl=60)
+        cache.set("a", "1")
+        cache.set("b", "2")
+        cache.get("a")
+        cache.set("c", "3")
+        self.assertEqual(cache.get("a"), "1")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.evictions, 1)
+
+    def test_ttl_expiry(self):
+        cache = LocalBackend(ttl=60)
+        with patch("cache.time.monotonic", return_value=100):
+            cache.set("a", "1")
+        with patch("cache.time.monotonic", return_value=161):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.expirations, 1)
+
+    def test_generation_survives_eviction(self):
+        cache = LocalBackend(max_entries=1)
+        cache.bump("feed")
+        cache.set("a", "1")
+        cache.set("b", "2")
+        self.assertEqual(cache.generation("feed"), 1)
+
+
+class SharedBackendTests(TestCase):
+    def test_round_trip_and_clear(self):
+        client = StubClient()
+        cache = SharedBackend(client)
+        cache.set("post:1", "<html>")
+        self.assertEqual(cache.get("post:1"), "<html>")
+        client.set("other:key", "kept")
+        cache.clear()
+        self.assertIsNone(cache.get("post:1"))
+        self.assertEqual(client.get("other:key"), "kept")
+
+    def test_generation_shared_between_workers(self):
+        client = StubClient()
+        first, second = SharedBackend(client), SharedBackend(client)
+        before = first.generation("feed")
+        self.assertEqual(second.generation("feed"), before)
+        second.bump("feed")
+        self.assertEqual(first.generation("feed"), before + 1)
+
+
+class PageCacheMemoizeTests(TestCase):
+    def test_memoize_until_invalidated(self):
+        cache = PageCache()
+        cache.backend = LocalBackend()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return {'A': len(calls)}
+
+        self.assertEqual(cache.memoize(cache.users_key('letters'), compute),
+                         {'A': 1})
+        self.assertEqual(cache.memoize(cache.users_key('letters'), compute),
+                         {'A': 1})
+        cache.invalidate_users()
+        self.assertEqual(cache.memoize(cache.users_key('letters'), compute),
+                         {'A': 2})
+
+    def test_render_racing_an_edit_is_not_served(self):
+        cache = PageCache()
+        cache.backend = LocalBackend()
+        # A render reads the old post, then an edit commits before the
+        # render stores its page.
+        key = cache.post_key(1)
+        cache.invalidate_posts(1)
+        cache.backend.set(key, "stale")
+        self.assertIsNone(cache.backend.get(cache.post_key(1)))
+
+    def test_counters_from_many_threads(self):
+        cache = PageCache()
+        cache.backend = LocalBackend()
+
+        def lookups():
+            for i in range(2000):
+                cache.memoize(f"key:{i % 10}", lambda: i)
+
+        threads = [threading.Thread(target=lookups) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = cache.stats()
+        self.assertEqual(stats['hits'] + stats['misses'], 8 * 2000)
@@ -0,0 +1,47 @@
+from unittest import TestCase
+
+from flask import Flask
+
+from config import (load_config, engine_options, worker_database,
+                    ProductionConfig)
+from instrumentation import TimedQueuePool
+
+
+class EngineOptionsTestCase(TestCase):
+    def options(self, uri, **settings):
+        app = Flask(__name__)
+        load_config(app, 'production')
+        app.config['SQLALCHEMY_DATABASE_URI'] = uri
+        app.config.update(settings)
+        return engine_options(app.config)
+
+    def test_postgres_pool(self):
+        options = self.options('postgresql:///blogly',
+                               DB_STATEMENT_TIMEOUT_MS=250)
+        self.assertIs(options['poolclass'], TimedQueuePool)
+        self.assertEqual(options['pool_size'], ProductionConfig.DB_POOL_SIZE)
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertEqual(options['connect_args'],
+                         {'options': '-c timezone=UTC '
+                                     '-c statement_timeout=250'})
+
+    def test_sqlite_keeps_default_pool(self):
+        options = self.options('sqlite://')
+        self.assertNotIn('poolclass', options)
+        self.assertNotIn('connect_args', options)
+
+    def test_unknown_profile(self):
+        with self.assertRaises(ValueError):
+            load_config(Flask(__name__), 'staging')
+
+    def test_production_quiet(self):
+        app = Flask(__name__)
+        load_config(app, 'production')
+        self.assertFalse(app.config['SQLALCHEMY_ECHO'])
+
+    def test_worker_database(self):
+        self.assertEqual(worker_database('postgresql:///blogly_test', 'gw1'),
+                         'postgresql:///blogly_test_gw1')
+        self.assertEqual(worker_database('sqlite:///blogly.db', 'gw1'),
+                         'sqlite:///blogly_gw1.db')
+        self.assertEqual(worker_database('sqlite://', 'gw1'), 'sqlite://')
@@ -1,30 +1,51 @@
+import os
+import re
+import threading
 from unittest import TestCase
+from unittest.mock import patch
+
+from sqlalchemy import event
+
+os.environ.setdefault('BLOGLY_ENV', 'testing')
 
 from app import app
-from models import db, User, Post
+from models import db, User, Post, UserInitial
+from cache import page_cache
+from writebehind import post_writer, WriteFailed
+from notfound import not_found_limiter, RateLimiter
+from instrumentation import SQL_STATEMENTS
+from testing import DatabaseTestCase, requires_postgres, utc
 
-# Use test database and don't clutter tests with SQL
-app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///sqla_intro_test2'
+# Don't clutter tests with SQL
 app.config['SQLALCHEMY_ECHO'] = False
 
-with app.app_context():
-    db.drop_all()
-    db.create_all()
 
+def build_app(test, **overrides):
+    """Another app from create_app(), undone for ``app`` after ``test``"""
+    from app import create_app
+    from metrics import registry
+
+    test.addCleanup(registry.collectors.update, dict(registry.collectors))
+    test.addCleanup(page_cache.init_app, app)
+    test.addCleanup(post_writer.init_app, app)
+    built = create_app('testing', {'SQLALCHEMY_ECHO': False, **overrides})
+    with built.app_context():
+        test.addCleanup(db.engine.dispose)
+    return built
 
-class UserModelTests(TestCase):
+
+class UserModelTests(DatabaseTestCase):
     def setUp(self):
+        super().setUp()
         self.user_id = 0
         with app.app_context():
             with app.test_client() as client:
-                Post.query.delete()
-                User.query.delete()
                 user = User(first_name="Tracy", middle_name="", last_name=
                             "Rera", image_url="https://via.placeholder.com/50")
                 db.session.add(user)
                 db.session.commit()
                 post = Post(title='Mauris cursus mattis molestie',
-                     created_at="2022-01-30 04:47:04",
+                     created_at=utc(2022, 1, 30, 4, 47, 4),
                      content='Lorem ipsum dolor sit amet',
                      user_id=user.id)
                 db.session.add(post)
@@ -32,12 +53,6 @@ class UserModelTests(TestCase):
                 self.post_id = post.id
                 self.user_id = user.id
 
-    def tearDown(self):
-        """Clean up any fouled transaction."""
-        with app.app_context():
-            with app.test_client() as client:
-                db.session.rollback()
-
     def test_show_404(self):
         with app.app_context():
             with app.test_client() as client:
@@ -175,4 +190,707 @@ class UserModelTests(TestCase):
                 html = resp.get_data(as_text=True)
 
                 self.assertEqual(resp.status_code, 200)
-                self.assertNotIn("Tracy", html)
\ No newline at end of file
+                self.assertNotIn("Tracy", html)
+
+
+class PostPaginationTests(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        with app.app_context():
+            user = User(first_name="Tracy", middle_name="", last_name=
+                        "Rera", image_url="https://via.placeholder.com/50")
+            db.session.add(user)
+            db.session.commit()
+            db.session.add_all([
+                Post(title=f"Paged post {i:02}",
+                     created_at=utc(2022, 1, i + 1, 4, 47, 4),
+                     content='Lorem ipsum dolor sit amet',
+                     user_id=user.id)
+                for i in range(7)])
+            db.session.commit()
+
+    def test_first_page(self):
+        with app.app_context():
+            with app.test_client() as client:
+                resp = client.get("/posts")
+                html = resp.get_data(as_text=True)
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn("Paged post 06", html)
+                self.assertIn("Paged post 02", html)
+                self.assertNotIn("Paged post 01", html)
+                self.assertIn("OLDER POSTS", html)
+                self.assertNotIn("NEWER POSTS", html)
+
+    def test_next_and_prev_pages(self):
+        with app.app_context():
+            with app.test_client() as client:
+                html = client.get("/posts").get_data(as_text=True)
+                older = html.split('href="/posts?before=')[1].split('"')[0]
+
+                resp = client.get(f"/posts?before={older}")
+                html = resp.get_data(as_text=True)
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn("Paged post 01", html)
+                self.assertIn("Paged post 00", html)
+                self.assertNotIn("Paged post 02", html)
+                self.assertNotIn("OLDER POSTS", html)
+
+                newer = html.split('href="/posts?after=')[1].split('"')[0]
+                html = client.get(f"/posts?after={newer}")\
+                    .get_data(as_text=True)
+                self.assertIn("Paged post 06", html)
+                self.assertIn("Paged post 02", html)
+                self.assertNotIn("Paged post 01", html)
+
+    def test_bad_cursor(self):
+        with app.app_context():
+            with app.test_client() as client:
+                resp = client.get("/posts?before=not-a-cursor")
+                self.assertEqual(resp.status_code, 400)
+
+
+class QueryCountTests(DatabaseTestCase):
+    """Page views must not issue one query per post or author."""
+
+    def setUp(self):
+        super().setUp()
+        app.config['QUERY_COUNT_HEADER'] = True
+        with app.app_context():
+            users = [User(first_name=f"Author{i}", last_name="Rera")
+                     for i in range(5)]
+            db.session.add_all(users)
+            db.session.commit()
+            db.session.add_all([
+                Post(title=f"Post {i}", content='Lorem ipsum',
+                     created_at=utc(2022, 1, i + 1, 4, 47, 4),
+                     user_id=users[i % 5].id)
+                for i in range(10)])
+            db.session.commit()
+            self.user_id = users[0].id
+
+    def tearDown(self):
+        app.config['QUERY_COUNT_HEADER'] = False
+        super().tearDown()
+
+    def query_count(self, url, status=200):
+        with app.app_context():
+            with app.test_client() as client:
+                resp = client.get(url)
+                self.assertEqual(resp.status_code, status)
+                return int(resp.headers['X-Query-Count'])
+
+    # Feed, post and user pages also run one light query for their ETag.
+
+    def test_posts_feed(self):
+        self.assertEqual(self.query_count("/posts"), 2)
+
+    def test_404_page(self):
+        # Recent posts are loaded once, then served from a snapshot.
+        self.assertEqual(self.query_count("/no/such/page", 404), 1)
+        self.assertEqual(self.query_count("/no/such/page", 404), 0)
+
+    def test_user_details(self):
+        self.assertEqual(self.query_count(f"/users/{self.user_id}"), 3)
+
+    def test_user_list(self):
+        # One page of users, plus the A-Z counts until they are cached.
+        self.assertEqual(self.query_count("/users"), 2)
+        self.assertEqual(self.query_count("/users"), 1)
+
+    def test_feed_leaves_bodies_unloaded(self):
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with app.app_context():
+            db.session.add(Post(title="Long", content="x" * 5000 + "END",
+                                created_at=utc(2022, 2, 1, 4, 47, 4),
+                                user_id=self.user_id))
+            db.session.commit()
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                with app.test_client() as client:
+                    html = client.get("/posts").get_data(as_text=True)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertIn("x" * 252 + " ...", html)
+        self.assertNotIn("END", html)
+        self.assertFalse([s for s in statements
+                          if re.search(r'posts\.content\b', s)])
+
+
+class PageCacheTests(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        app.config['QUERY_COUNT_HEADER'] = True
+        with app.app_context():
+            user = User(first_name="Tracy", last_name="Rera")
+            db.session.add(user)
+            db.session.commit()
+            post = Post(title='Cached title', content='Cached content',
+                        created_at=utc(2022, 1, 30, 4, 47, 4), user_id=user.id)
+            db.session.add(post)
+            db.session.commit()
+            self.user_id = user.id
+            self.post_id = post.id
+
+    def tearDown(self):
+        app.config['QUERY_COUNT_HEADER'] = False
+        super().tearDown()
+
+    def get(self, client, url):
+        resp = client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        return resp.get_data(as_text=True), int(resp.headers['X-Query-Count'])
+
+    def test_repeat_views_skip_database(self):
+        with app.app_context():
+            with app.test_client() as client:
+                for url in ("/posts", f"/posts/{self.post_id}"):
+                    first, queries = self.get(client, url)
+                    self.assertGreater(queries, 0)
+                    second, queries = self.get(client, url)
+                    self.assertEqual(queries, 0)
+                    self.assertEqual(first, second)
+        self.assertGreaterEqual(page_cache.stats()['hits'], 2)
+
+    def test_edit_post_invalidates(self):
+        with app.app_context():
+            with app.test_client() as client:
+                self.get(client, "/posts")
+                self.get(client, f"/posts/{self.post_id}")
+                client.post(f"/posts/{self.post_id}/edit",
+                            data={"title": "Fresh title",
+                                  "content": "Fresh content"})
+                client.get("/posts")  # consume the flash message
+                self.assertIn("Fresh title", self.get(client, "/posts")[0])
+                self.assertIn("Fresh content",
+                              self.get(client, f"/posts/{self.post_id}")[0])
+
+    def test_new_post_invalidates(self):
+        with app.app_context():
+            with app.test_client() as client:
+                self.get(client, "/posts")
+                client.post(f"/users/{self.user_id}/posts/new",
+                            data={"title": "Brand new", "content": "Body"},
+                            follow_redirects=True)
+                self.assertIn("Brand new", self.get(client, "/posts")[0])
+
+    def test_delete_user_invalidates(self):
+        with app.app_context():
+            with app.test_client() as client:
+                self.get(client, "/posts")
+                self.get(client, f"/posts/{self.post_id}")
+                client.post(f"/users/{self.user_id}/delete",
+                            follow_redirects=True)
+                self.assertNotIn("Cached title",
+                                 self.get(client, "/posts")[0])
+                resp = client.get(f"/posts/{self.post_id}")
+                self.assertEqual(resp.status_code, 404)
+
+    def test_stats_endpoint(self):
+        with app.app_context():
+            with app.test_client() as client:
+                resp = client.get("/_stats/cache")
+                self.assertEqual(resp.status_code, 200)
+                self.assertEqual(resp.json['backend'], 'LocalBackend')
+                self.assertIn('evictions', resp.json)
+
+
+class ConditionalGetTests(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        app.config['QUERY_COUNT_HEADER'] = True
+        with app.app_context():
+            user = User(first_name="Tracy", last_name="Rera")
+            db.session.add(user)
+            db.session.commit()
+            post = Post(title='Validated title', content='Lorem ipsum',
+                        created_at=utc(2022, 1, 30, 4, 47, 4),
+                        modified_on=utc(2022, 2, 1, 10), user_id=user.id)
+            db.session.add(post)
+            db.session.commit()
+            self.user_id = user.id
+            self.post_id = post.id
+
+    def tearDown(self):
+        app.config['QUERY_COUNT_HEADER'] = False
+        super().tearDown()
+
+    def urls(self):
+        return ["/posts", f"/posts/{self.post_id}", f"/users/{self.user_id}"]
+
+    def test_validators_sent(self):
+        with app.app_context():
+            with app.test_client() as client:
+                for url in self.urls():
+                    resp = client.get(url)
+                    self.assertEqual(resp.status_code, 200)
+                    etag, weak = resp.get_etag()
+                    self.assertTrue(etag)
+                    self.assertFalse(weak)
+                resp = client.get(f"/posts/{self.post_id}")
+                self.assertEqual(resp.last_modified.date().isoformat(),
+                                 "2022-02-01")
+
+    def test_if_none_match_short_circuits(self):
+        with app.app_context():
+            with app.test_client() as client:
+                for url in self.urls():
+                    etag = client.get(url).get_etag()[0]
+                    page_cache.clear()
+                    resp = client.get(url, headers={
+                        "If-None-Match": f'"{etag}"'})
+                    self.assertEqual(resp.status_code, 304)
+                    self.assertEqual(resp.get_data(), b"")
+                    self.assertLessEqual(int(resp.headers['X-Query-Count']),
+                                         1)
+
+    def test_cached_page_revalidates_without_queries(self):
+        with app.app_context():
+            with app.test_client() as client:
+                etag = client.get("/posts").get_etag()[0]
+                resp = client.get("/posts", headers={
+                    "If-None-Match": f'"{etag}"'})
+                self.assertEqual(resp.status_code, 304)
+                self.assertEqual(resp.headers['X-Query-Count'], "0")
+
+    def test_if_modified_since(self):
+        with app.app_context():
+            with app.test_client() as client:
+                resp = client.get(f"/posts/{self.post_id}", headers={
+                    "If-Modified-Since": "Wed, 02 Feb 2022 00:00:00 GMT"})
+                self.assertEqual(resp.status_code, 304)
+                resp = client.get(f"/posts/{self.post_id}", headers={
+                    "If-Modified-Since": "Mon, 31 Jan 2022 00:00:00 GMT"})
+                self.assertEqual(resp.status_code, 200)
+
+    def test_list_pages_not_modified_by_date(self):
+        with app.app_context():
+            older = Post(title='Older post', content='Lorem ipsum',
+                         created_at=utc(2022, 1, 1), user_id=self.user_id)
+            db.session.add(older)
+            db.session.commit()
+            with app.test_client() as client:
+                for url in ("/posts", f"/users/{self.user_id}"):
+                    self.assertIsNone(client.get(url).last_modified)
+                client.post(f"/posts/{older.id}/delete",
+                            follow_redirects=True)
+                for url in ("/posts", f"/users/{self.user_id}"):
+                    resp = client.get(url, headers={
+                        "If-Modified-Since": "Wed, 02 Feb 2022 00:00:00 GMT"})
+                    self.assertEqual(resp.status_code, 200)
+                    self.assertNotIn("Older post", resp.get_data(as_text=True))
+
+    def test_edit_changes_etag(self):
+        with app.app_context():
+            with app.test_client() as client:
+                urls = [f"/posts/{self.post_id}", f"/users/{self.user_id}"]
+                etags = [client.get(url).get_etag()[0] for url in urls]
+                client.post(f"{urls[0]}/edit", data={"title": "New title",
+                                                     "content": "New content"},
+                            follow_redirects=True)
+                for url, etag in zip(urls, etags):
+                    resp = client.get(url, headers={
+                        "If-None-Match": f'"{etag}"'})
+                    self.assertEqual(resp.status_code, 200)
+                    self.assertIn("New title", resp.get_data(as_text=True))
+
+
+class SearchTests(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        with app.app_context():
+            user = User(first_name="Tracy", last_name="Rera")
+            db.session.add(user)
+            db.session.commit()
+            db.session.add_all([
+                Post(title=f"Parrots {i}", content="Parrots talk. " * (i + 1),
+                     created_at=utc(2022, 1, 30, 4, 47, 4), user_id=user.id)
+                for i in range(12)])
+            db.session.add(Post(title="Other", content="<i>Cats</i> nap",
+                                created_at=utc(2022, 1, 30, 4, 47, 4),
+                                user_id=user.id))
+            db.session.commit()
+
+    def test_search_form(self):
+        with app.app_context():
+            with app.test_client() as client:
+                resp = client.get("/search")
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn("SEARCH POSTS", resp.get_data(as_text=True))
+
+    def test_search_results_paged(self):
+        with app.app_context():
+            with app.test_client() as client:
+                html = client.get("/search?q=parrots").get_data(as_text=True)
+                self.assertEqual(html.count("<b>Parrots"), 10)
+                self.assertIn("<mark>Parrots</mark>", html)
+                self.assertNotIn("<b>Other</b>", html)
+                more = html.split('&before=')[1].split('"')[0]
+                html = client.get(f"/search?q=parrots&before={more}")\
+                    .get_data(as_text=True)
+                self.assertEqual(html.count("<b>Parrots"), 2)
+                self.assertIn("BETTER MATCHES", html)
+
+    def test_search_snippet_escaped(self):
+        with app.app_context():
+            with app.test_client() as client:
+                html = client.get("/search?q=cats").get_data(as_text=True)
+                self.assertIn("<mark>Cats</mark>", html)
+                self.assertNotIn("<i>Cats", html)
+
+    def test_no_results(self):
+        with app.app_context():
+            with app.test_client() as client:
+                html = client.get("/search?q=zebras").get_data(as_text=True)
+                self.assertIn("No posts match", html)
+
+
+class UserDirectoryTests(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        with app.app_context():
+            quiet = User(first_name="Quiet", last_name="Abbott")
+            busy = User(first_name="Busy", last_name="Zed")
+            db.session.add_all([quiet, busy])
+            db.session.commit()
+            self.busy_id = busy.id
+
+    def test_new_and_deleted_posts_update_counts(self):
+        with app.test_client() as client:
+            client.post(f"/users/{self.busy_id}/posts/new",
+                        data={'title': 'Hi', 'content': 'Lorem'})
+            html = client.get("/users").get_data(as_text=True)
+            self.assertIn("1 post<", html.replace("\n", ""))
+            with app.app_context():
+                post_id = Post.query.one().id
+            client.post(f"/posts/{post_id}/delete")
+            with app.app_context():
+                self.assertEqual(db.session.get(User, self.busy_id)
+                                 .post_count, 0)
+
+    def test_sort_by_activity(self):
+        with app.test_client() as client:
+            client.post(f"/users/{self.busy_id}/posts/new",
+                        data={'title': 'Hi', 'content': 'Lorem'})
+            by_name = client.get("/users").get_data(as_text=True)
+            self.assertLess(by_name.index("Quiet"), by_name.index("Busy"))
+            active = client.get("/users?sort=active").get_data(as_text=True)
+            self.assertIn("Busy", active)
+            self.assertNotIn("Quiet", active)
+            self.assertIn("SORT BY NAME", active)
+
+    def test_letter_counts_follow_writes(self):
+        def counts():
+            with app.app_context():
+                return dict(db.session.query(UserInitial.letter,
+                                             UserInitial.user_count)
+                            .filter(UserInitial.user_count > 0).all())
+
+        self.assertEqual(counts(), {'A': 1, 'Z': 1})
+        with app.test_client() as client:
+            client.post(f"/users/{self.busy_id}/edit",
+                        data={'first_name': 'Busy', 'last_name': 'moss'})
+            self.assertEqual(counts(), {'A': 1, 'M': 1})
+            client.post(f"/users/{self.busy_id}/delete")
+            self.assertEqual(counts(), {'A': 1})
+            html = client.get("/users?letter=yz").get_data(as_text=True)
+            self.assertIn("Abbott", html)
+            self.assertNotIn("PREVIOUS", html)
+
+    def test_pages_and_letters(self):
+        app.config['USERS_PER_PAGE'] = 2
+        try:
+            with app.app_context():
+                db.session.add_all([User(first_name=f"Extra{i}",
+                                         last_name="Moss")
+                                    for i in range(3)])
+                db.session.commit()
+            page_cache.invalidate_users()
+            with app.test_client() as client:
+                html = client.get("/users").get_data(as_text=True)
+                self.assertIn('href="/users?letter=M" title="3"', html)
+                self.assertIn("Abbott", html)
+                self.assertNotIn("Zed", html)
+                self.assertNotIn("PREVIOUS", html)
+                jump = client.get("/users?letter=m").get_data(as_text=True)
+                self.assertNotIn("Abbott", jump)
+                self.assertIn("Extra0 Moss", jump)
+                self.assertIn("Extra1 Moss", jump)
+                self.assertIn("PREVIOUS", jump)
+                cursor = jump.split('before=')[1].split('"')[0]
+                last = client.get(f"/users?before={cursor}&stream=1") \
+                    .get_data(as_text=True)
+                self.assertIn("Extra2 Moss", last)
+                self.assertIn("Busy Zed", last)
+                self.assertNotIn("NEXT", last)
+                self.assertEqual(client.get("/users?before=junk")
+                                 .status_code, 400)
+        finally:
+            app.config['USERS_PER_PAGE'] = 50
+
+
+class StreamingTests(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        app.config['STREAM_CHUNK_ROWS'] = 7
+        with app.app_context():
+            user = User(first_name="Tracy", last_name="Rera")
+            db.session.add(user)
+            db.session.commit()
+            db.session.add_all([Post(title=f"Post {i:02}",
+                                     content='Lorem ipsum', user_id=user.id)
+                                for i in range(30)])
+            db.session.commit()
+            self.user_id = user.id
+
+    def tearDown(self):
+        app.config['STREAM_CHUNK_ROWS'] = 500
+        super().tearDown()
+
+    def test_user_details_streamed(self):
+        with app.test_client() as client:
+            whole = client.get(f"/users/{self.user_id}")
+            streamed = client.get(f"/users/{self.user_id}?stream=1")
+            self.assertEqual(streamed.status_code, 200)
+            html = streamed.get_data(as_text=True)
+            self.assertEqual(html, whole.get_data(as_text=True))
+            self.assertEqual(html.count("Post "), 30)
+            self.assertLess(html.index("Post 00"), html.index("Post 29"))
+
+    def test_streamed_feed_not_cached(self):
+        with app.test_client() as client:
+            resp = client.get("/posts?stream=1")
+            self.assertIn("Post ", resp.get_data(as_text=True))
+            self.assertEqual(page_cache.stats()['entries'], 0)
+            client.get("/posts")
+            self.assertEqual(page_cache.stats()['entries'], 1)
+
+
+@requires_postgres
+class WriteBehindTests(DatabaseTestCase):
+    # The writer thread commits on its own connection, which in-memory
+    # SQLite cannot give it.
+    transactional = False
+
+    def setUp(self):
+        super().setUp()
+        with app.app_context():
+            user = User(first_name="Tracy", last_name="Rera")
+            db.session.add(user)
+            db.session.commit()
+            self.user_id = user.id
+
+    def tearDown(self):
+        post_writer.stop()
+        app.config['POST_WRITE_MODE'] = 'sync'
+        super().tearDown()
+
+    def test_group_mode_commits_before_redirect(self):
+        app.config['POST_WRITE_MODE'] = 'group'
+        with app.test_client() as client:
+            resp = client.post(f"/users/{self.user_id}/posts/new",
+                               data={'title': 'Queued', 'content': 'Lorem'},
+                               follow_redirects=True)
+            html = resp.get_data(as_text=True)
+            self.assertIn("Post has been added to the list!", html)
+            self.assertIn("Queued", html)
+        with app.app_context():
+            self.assertEqual(db.session.get(User, self.user_id).post_count, 1)
+
+    def test_async_mode_batches(self):
+        app.config['POST_WRITE_MODE'] = 'async'
+        with app.test_client() as client:
+            for i in range(5):
+                resp = client.post(f"/users/{self.user_id}/posts/new",
+                                   data={'title': f'Async {i}',
+                                         'content': 'Lorem'})
+                self.assertEqual(resp.status_code, 302)
+        post_writer.stop()
+        with app.app_context():
+            self.assertEqual(Post.query.count(), 5)
+            self.assertEqual(db.session.get(User, self.user_id).post_count, 5)
+
+    def test_bad_row_fails_alone(self):
+        app.config['POST_WRITE_MODE'] = 'group'
+        with app.app_context():
+            with self.assertRaises(WriteFailed):
+                post_writer.submit(self.user_id + 1000, 'Orphan', 'Lorem')
+            self.assertTrue(post_writer.submit(self.user_id, 'Fine', 'Lorem'))
+            self.assertEqual([post.title for post in Post.query], ['Fine'])
+
+    def test_unexpected_error_fails_batch_not_writer(self):
+        app.config['POST_WRITE_MODE'] = 'group'
+        with app.app_context():
+            with patch('writebehind.insert_posts',
+                       side_effect=RuntimeError("disk on fire")):
+                with self.assertRaisesRegex(WriteFailed, "disk on fire"):
+                    post_writer.submit(self.user_id, 'Lost', 'Lorem')
+            self.assertTrue(post_writer.submit(self.user_id, 'Fine', 'Lorem'))
+            self.assertEqual([post.title for post in Post.query], ['Fine'])
+
+    def test_timeout_is_not_a_failure(self):
+        app.config['POST_WRITE_MODE'] = 'group'
+        release = threading.Event()
+        self.addCleanup(release.set)
+        self.addCleanup(setattr, post_writer, 'timeout', post_writer.timeout)
+        post_writer.timeout = 0.05
+        with app.test_client() as client:
+            with patch('writebehind.insert_posts',
+                       side_effect=lambda rows: release.wait(5)):
+                resp = client.post(f"/users/{self.user_id}/posts/new",
+                                   data={'title': 'Slow', 'content': 'Lorem'},
+                                   follow_redirects=True)
+                release.set()
+        self.assertIn("taking a while to save", resp.get_data(as_text=True))
+
+    def test_title_required(self):
+        with app.test_client() as client:
+            resp = client.post(f"/users/{self.user_id}/posts/new",
+                               data={'title': ' ', 'content': 'Lorem'})
+            self.assertEqual(resp.location,
+                             f"/users/{self.user_id}/posts/new")
+        with app.app_context():
+            self.assertEqual(Post.query.count(), 0)
+
+
+class NotFoundTests(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        not_found_limiter.clear()
+        with app.app_context():
+            user = User(first_name="Tracy", last_name="Rera")
+            db.session.add(user)
+            db.session.commit()
+            self.user_id = user.id
+
+    def test_snapshot_refreshed_on_write(self):
+        with app.test_client() as client:
+            self.assertNotIn("Fresh post",
+                             client.get("/nowhere").get_data(as_text=True))
+            client.post(f"/users/{self.user_id}/posts/new",
+                        data={'title': 'Fresh post', 'content': 'Lorem'})
+            html = client.get("/nowhere").get_data(as_text=True)
+            self.assertIn("Fresh post", html)
+            self.assertIn("by <a href=/users/", html)
+            self.assertIn("Tracy Rera", html)
+
+    def test_rate_limited_misses_are_bare(self):
+        burst = not_found_limiter.burst
+        not_found_limiter.burst = 2
+        try:
+            with app.test_client() as client:
+                for _ in range(2):
+                    self.assertIn("Oops!", client.get("/nowhere")
+                                  .get_data(as_text=True))
+                resp = client.get("/nowhere")
+                self.assertEqual(resp.status_code, 404)
+                self.assertEqual(resp.get_data(as_text=True), "Not Found")
+        finally:
+            not_found_limiter.burst = burst
+            not_found_limiter.clear()
+
+    def test_limit_per_forwarded_client(self):
+        burst = not_found_limiter.burst
+        self.addCleanup(setattr, not_found_limiter, 'burst', burst)
+        self.addCleanup(not_found_limiter.clear)
+        proxied = build_app(self, PROXY_COUNT=1)
+        not_found_limiter.burst = 1
+        with proxied.test_client() as client:
+            for address in ("203.0.113.1", "203.0.113.2"):
+                resp = client.get("/nowhere", headers={
+                    "X-Forwarded-For": address})
+                self.assertIn("Oops!", resp.get_data(as_text=True))
+            resp = client.get("/nowhere", headers={
+                "X-Forwarded-For": "203.0.113.1"})
+            self.assertEqual(resp.get_data(as_text=True), "Not Found")
+
+    def test_token_bucket_refills(self):
+        limiter = RateLimiter(rate=2, burst=1, max_clients=2)
+        with patch('notfound.time.monotonic', return_value=100.0) as clock:
+            self.assertTrue(limiter.allow("a"))
+            self.assertFalse(limiter.allow("a"))
+            clock.return_value = 100.5
+            self.assertTrue(limiter.allow("a"))
+            limiter.allow("b")
+            limiter.allow("c")
+        self.assertEqual(list(limiter._buckets), ["b", "c"])
+
+
+@requires_postgres
+class PoolStatsTests(DatabaseTestCase):
+    # A test transaction would hold a connection checked out, and in-memory
+    # SQLite has no pool to report on.
+    transactional = False
+
+    def test_pool_stats(self):
+        # No outer app context: each request must return its connection.
+        with app.test_client() as client:
+            client.get("/users")
+            resp = client.get("/_stats/pool")
+            self.assertEqual(resp.status_code, 200)
+            stats = resp.json['default']
+            self.assertGreaterEqual(stats['checkouts'], 1)
+            self.assertEqual(stats['in_use'], 0)
+            self.assertGreaterEqual(stats['idle'], 1)
+            self.assertGreaterEqual(
+                stats['checkout_wait_seconds']['count'], 1)
+
+
+class RequestMetricsTests(DatabaseTestCase):
+    def test_server_timing(self):
+        with app.test_client() as client:
+            resp = client.get("/users")
+            timing = resp.headers['Server-Timing']
+            self.assertRegex(timing, r'sql;dur=[\d.]+;desc="\d+ queries"')
+            self.assertIn("render;dur=", timing)
+            self.assertIn("total;dur=", timing)
+
+    def test_streamed_request_recorded_after_body(self):
+        with app.app_context():
+            user = User(first_name="Tracy", last_name="Rera")
+            user.posts = [Post(title=f"Post {i}", content='Lorem')
+                          for i in range(3)]
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.id
+        statements = SQL_STATEMENTS.labels('blog.show_user')
+        counted = []
+        with app.test_client() as client:
+            for stream in ('0', '1'):
+                before = statements.value
+                resp = client.get(f"/users/{user_id}?stream={stream}",
+                                  buffered=True)
+                self.assertIn("Post 2", resp.get_data(as_text=True))
+                counted.append(statements.value - before)
+        self.assertNotIn('Server-Timing', resp.headers)
+        self.assertEqual(counted[1], counted[0])
+
+    def test_metrics_endpoint(self):
+        with app.test_client() as client:
+            client.get("/users")
+            resp = client.get("/_metrics")
+            self.assertEqual(resp.status_code, 200)
+            self.assertTrue(resp.content_type.startswith('text/plain'))
+            text = resp.get_data(as_text=True)
+            self.assertIn('# TYPE blogly_request_duration_seconds histogram',
+                          text)
+            self.assertIn('blogly_request_duration_seconds_bucket'
+                          '{endpoint="blog.list_users",le="+Inf"}', text)
+            self.assertRegex(text, r'blogly_requests_total\{endpoint='
+                             r'"blog\.list_users",method="GET",'
+                             r'status="200"\} \d+')
+            self.assertIn('blogly_pool_connections{bind="default",'
+                          'state="in_use"}', text)
+            self.assertIn('blogly_page_cache_hits_total', text)
+
+    def test_metrics_families_once_after_rebuilding(self):
+        apps = [build_app(self) for _ in range(2)]
+        with apps[1].test_client() as client:
+            client.get("/users")
+            text = client.get("/_metrics").get_data(as_text=True)
+        families = re.findall(r'^# TYPE (\S+)', text, re.M)
+        self.assertIn('blogly_pool_connections', families)
+        self.assertEqual(len(families), len(set(families)))
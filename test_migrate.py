@@ -0,0 +1,174 @@
+import tempfile
+from unittest import TestCase
+
+from flask import Flask
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy_utils import create_database, database_exists, drop_database
+
+from models import db, connect_db, User, Post
+from migrate import (upgrade, downgrade, stamp, current_revision, db_cli,
+                     MigrationError)
+from testing import app, requires_postgres, utc
+
+
+def make_engine():
+    return create_engine(f"sqlite:///{tempfile.mkdtemp()}/blogly.db")
+
+
+class MigrationTests(TestCase):
+    def test_upgrade_matches_models(self):
+        engine = make_engine()
+        upgrade(engine)
+        inspector = inspect(engine)
+        for table in db.metadata.sorted_tables:
+            # Column names, and which of them the database fills in.
+            self.assertEqual(
+                {(column['name'], column['default'] is not None)
+                 for column in inspector.get_columns(table.name)},
+                {(column.name, column.server_default is not None)
+                 for column in table.columns}, table.name)
+            self.assertLessEqual(
+                {index.name for index in table.indexes},
+                {index['name'] for index in
+                 inspector.get_indexes(table.name)}, table.name)
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = engine.url
+        connect_db(app)
+        with app.app_context():
+            user = User(first_name='Ada', last_name='Lovelace')
+            db.session.add(Post(title='Engines', content='Analytical',
+                                user=user))
+            db.session.commit()
+            post = db.session.scalars(db.select(Post)).one()
+            self.assertIsNotNone(post.created_at)
+            self.assertEqual(post.modified_on, post.created_at)
+            db.session.remove()
+
+    def test_downgrade_and_back(self):
+        engine = make_engine()
+        upgrade(engine)
+        downgrade(engine)
+        self.assertEqual(current_revision(engine), '0006')
+        self.assertNotIn('user_initials', inspect(engine).get_table_names())
+        downgrade(engine)
+        self.assertEqual(current_revision(engine), '0005')
+        self.assertNotIn('ix_posts_modified_on_id',
+                         {index['name'] for index in
+                          inspect(engine).get_indexes('posts')})
+        downgrade(engine, 'base')
+        self.assertIsNone(current_revision(engine))
+        self.assertNotIn('posts', inspect(engine).get_table_names())
+        upgrade(engine)
+        self.assertEqual(current_revision(engine), '0007')
+
+    def test_downgrade_at_base_does_nothing(self):
+        engine = make_engine()
+        downgrade(engine)
+        downgrade(engine, 'base')
+        self.assertIsNone(current_revision(engine))
+
+    def test_downgrade_to_unknown_or_later_revision(self):
+        engine = make_engine()
+        upgrade(engine, '0002')
+        with self.assertRaises(MigrationError):
+            downgrade(engine, '9999')
+        downgrade(engine, 'head')
+        self.assertEqual(current_revision(engine), '0002')
+        self.assertIn('posts', inspect(engine).get_table_names())
+
+    def test_backfill_resumes(self):
+        engine = make_engine()
+        upgrade(engine, '0001')
+        with engine.begin() as connection:
+            for i in range(1, 6):
+                connection.execute(text(
+                    "INSERT INTO posts (id, title, content, created_at) "
+                    "VALUES (:id, 'Post', :content, '2022-01-01')"),
+                    {'id': i, 'content': "x" * (100 * i)})
+            # As if an earlier run had finished the batch ending at id 2.
+            connection.execute(text(
+                "INSERT INTO schema_backfills (name, last_id) "
+                "VALUES ('posts_excerpt', 2)"))
+        upgrade(engine, batch_size=2)
+        with engine.connect() as connection:
+            lengths = connection.execute(text(
+                "SELECT content_length FROM posts ORDER BY id")).scalars()
+            self.assertEqual(list(lengths), [0, 0, 300, 400, 500])
+            self.assertEqual(connection.scalar(text(
+                "SELECT count(*) FROM schema_backfills")), 0)
+
+    def test_upgrade_from_baseline(self):
+        engine = make_engine()
+        upgrade(engine, '0001')
+        with engine.begin() as connection:
+            connection.execute(text(
+                "INSERT INTO users (id, first_name, last_name, image_url) "
+                "VALUES (1, 'Ada', 'Lovelace', ''), "
+                "(2, 'Alan', 'Turing', '')"))
+            connection.execute(text(
+                "INSERT INTO posts (id, title, content, created_at, user_id) "
+                "VALUES (1, 'Engines', 'Analytical', '2022-01-01', 1), "
+                "(2, 'Notes', 'On engines', '2022-02-01', 1)"))
+        upgrade(engine, batch_size=1)
+        with engine.connect() as connection:
+            activity = connection.execute(text(
+                "SELECT id, post_count, last_post_at FROM users ORDER BY id"))
+            self.assertEqual(
+                [(id, count, at and at[:10]) for id, count, at in activity],
+                [(1, 2, '2022-02-01'), (2, 0, None)])
+            self.assertEqual(connection.scalar(text(
+                "SELECT count(*) FROM posts_fts "
+                "WHERE posts_fts MATCH 'engines'")), 2)
+            self.assertEqual(list(connection.execute(text(
+                "SELECT letter, user_count FROM user_initials "
+                "ORDER BY letter"))), [('L', 1), ('T', 1)])
+
+    def test_status_command(self):
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = \
+            f"sqlite:///{tempfile.mkdtemp()}/blogly.db"
+        connect_db(app)
+        runner = app.test_cli_runner()
+        result = runner.invoke(db_cli, ['status'])
+        self.assertIn("7 pending", result.output)
+        result = runner.invoke(db_cli, ['upgrade', '0001'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        with app.app_context():
+            stamp(db.engine, 'head')
+        result = runner.invoke(db_cli, ['status'])
+        self.assertIn("* 0007", result.output)
+        self.assertIn("0 pending", result.output)
+
+
+class PostgresMigrationTests(TestCase):
+    @requires_postgres
+    def test_timestamps_keep_their_original_zone(self):
+        url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+        url = url.set(database=f"{url.database}_migrate")
+        if database_exists(url):
+            drop_database(url)
+        create_database(url, template='template0')
+        self.addCleanup(drop_database, url)
+        with create_engine(url).begin() as connection:
+            connection.execute(text(
+                f"ALTER DATABASE {url.database} "
+                "SET timezone TO 'America/New_York'"))
+        # As the app connects: in UTC.
+        engine = create_engine(url, connect_args={
+            'options': '-c timezone=UTC'})
+        self.addCleanup(engine.dispose)
+        upgrade(engine, '0001')
+        with engine.begin() as connection:
+            # Written by the baseline app at noon, New York time.
+            connection.execute(text(
+                "INSERT INTO posts (title, content, created_at) "
+                "VALUES ('Post', 'Content', '2022-01-01 12:00')"))
+        upgrade(engine)
+        with engine.connect() as connection:
+            self.assertEqual(connection.scalar(text(
+                "SELECT created_at FROM posts")), utc(2022, 1, 1, 17))
+        downgrade(engine, '0005')
+        with engine.connect() as connection:
+            self.assertEqual(str(connection.scalar(text(
+                "SELECT created_at FROM posts"))), '2022-01-01 12:00:00')
@@ -1,27 +1,26 @@
+import os
 from unittest import TestCase
+os.environ.setdefault('BLOGLY_ENV', 'testing')
+
 from app import app
 from models import db, User, Post
-from seed import generate_random_datetime_start, generate_random_datetime_end
+from datagen import generate_data, generate_random_datetime_start, \
+    generate_random_datetime_end
+from activity import reconcile_activity
+from excerpts import backfill_excerpts
+from timefmt import annotate, friendly, to_utc
+from datetime import datetime, timedelta, UTC
+from testing import DatabaseTestCase, requires_postgres, utc
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///sqla_intro_test2'
 app.config['SQLALCHEMY_ECHO'] = False
 
 
-class UserModelTestCase(TestCase):
+class UserModelTestCase(DatabaseTestCase):
     """Tests for model for User."""
 
     def setUp(self):
-        """Clean up any existing Users."""
-
-        with app.app_context():
-            db.drop_all()
-            db.create_all()
-            self.client = app.test_client()
-
-    def tearDown(self):
-        """Clean up any fouled transaction."""
-        with app.app_context():
-            db.session.rollback()
+        super().setUp()
+        self.client = app.test_client()
 
     def test_no_middle_name(self):
         user = User(first_name="Tracy", middle_name="", last_name="Rera",
@@ -46,16 +45,16 @@ class UserModelTestCase(TestCase):
         with app.app_context():
             db.session.add(user1)
             self.assertEqual(str(User.query.first()),
-                         "<User ID=1 First Name=Alice Last Name="
-                         "Smith Image URL=https://via.placeholder.com/30>")
+                         f"<User ID={user1.id} First Name=Alice Last Name="
+                         "Smith Image URL=/static/avatar.svg>")
     def test_create_user_delete(self):
         user1 = User(first_name="Alice", last_name="Smith")
         with app.app_context():
             db.session.add(user1)
             db.session.commit()
             self.assertEqual(str(User.query.first()),
-                         "<User ID=1 First Name=Alice Last Name="
-                         "Smith Image URL=https://via.placeholder.com/30>")
+                         f"<User ID={user1.id} First Name=Alice Last Name="
+                         "Smith Image URL=/static/avatar.svg>")
             db.session.delete(User.query.first())
             db.session.commit()
             self.assertFalse(bool(User.query.first()))
@@ -66,8 +65,8 @@ class UserModelTestCase(TestCase):
             db.session.add(user1)
             db.session.commit()
             self.assertEqual(str(User.query.first()),
-                         "<User ID=1 First Name=Alice Last Name="
-                         "Smith Image URL=https://via.placeholder.com/30>")
+                         f"<User ID={user1.id} First Name=Alice Last Name="
+                         "Smith Image URL=/static/avatar.svg>")
             db.session.delete(User.query.first())
             db.session.commit()
             self.assertFalse(bool(User.query.first()))
@@ -75,28 +74,19 @@ class UserModelTestCase(TestCase):
             db.session.add(user1)
             db.session.commit()
             self.assertEqual(str(User.query.first()),
-                         "<User ID=2 First Name=Alice Last Name="
-                         "Smith Image URL=https://via.placeholder.com/30>")
+                         f"<User ID={user1.id} First Name=Alice Last Name="
+                         "Smith Image URL=/static/avatar.svg>")
             db.session.delete(User.query.first())
             db.session.commit()
             self.assertFalse(bool(User.query.first()))
 
 
-class PostModelTestCase(TestCase):
+class PostModelTestCase(DatabaseTestCase):
     """Tests for model for Post."""
 
     def setUp(self):
-        """Clean up any existing Post."""
-
-        with app.app_context():
-            db.drop_all()
-            db.create_all()
-            self.client = app.test_client()
-
-    def tearDown(self):
-        """Clean up any fouled transaction."""
-        with app.app_context():
-            db.session.rollback()
+        super().setUp()
+        self.client = app.test_client()
 
     def test_repl(self):
         with app.app_context():
@@ -104,20 +94,20 @@ class PostModelTestCase(TestCase):
             db.session.add(user1)
             db.session.commit()
             self.assertEqual(str(User.query.first()),
-                         "<User ID=1 First Name=Alice Last Name="
-                         "Smith Image URL=https://via.placeholder.com/30>")
+                         f"<User ID={user1.id} First Name=Alice Last Name="
+                         "Smith Image URL=/static/avatar.svg>")
             newUser = User.query.first()
             db.session.add(Post(title='Mauris cursus mattis molestie',
-                                created_at="2022-01-30 04:47:04",
+                                created_at=utc(2022, 1, 30, 4, 47, 4),
                                 content='Lorem ipsum dolor sit amet',
                                 user_id=newUser.id))
             db.session.commit()
             post = Post.query.first()
             self.assertTrue(bool(post))
-            self.assertEquals(str(post), "<Post ID=1 Title=Mauris "
+            self.assertEquals(str(post), f"<Post ID={post.id} Title=Mauris "
                                          "cursus mattis molestie Content=Lorem "
                                          "ipsum dolor sit amet Created At="
-                                         "2022-01-30 04:47:04>")
+                                         "2022-01-30 04:47:04+00:00>")
 
     def test_cascade_post_delete(self):
         with app.app_context():
@@ -125,8 +115,8 @@ class PostModelTestCase(TestCase):
             db.session.add(user1)
             db.session.commit()
             self.assertEqual(str(User.query.first()),
-                         "<User ID=1 First Name=Alice Last Name="
-                         "Smith Image URL=https://via.placeholder.com/30>")
+                         f"<User ID={user1.id} First Name=Alice Last Name="
+                         "Smith Image URL=/static/avatar.svg>")
             newUser = User.query.first()
             db.session.add(Post(title='Mauris cursus mattis molestie',
                                 created_at=generate_random_datetime_start(),
@@ -146,8 +136,9 @@ class PostModelTestCase(TestCase):
                     db.session.add(user1)
                     db.session.commit()
                     self.assertEqual(str(User.query.first()),
-                                     "<User ID=1 First Name=Alice Last Name="
-                                     "Smith Image URL=https://via.placeholder.com/30>")
+                                     f"<User ID={user1.id} First Name=Alice "
+                                     "Last Name=Smith "
+                                     "Image URL=/static/avatar.svg>")
                     db.session.delete(User.query.first())
                     db.session.commit()
                     self.assertFalse(bool(User.query.first()))
@@ -155,8 +146,9 @@ class PostModelTestCase(TestCase):
                     db.session.add(user1)
                     db.session.commit()
                     self.assertEqual(str(User.query.first()),
-                                     "<User ID=2 First Name=Alice Last Name="
-                                     "Smith Image URL=https://via.placeholder.com/30>")
+                                     f"<User ID={user1.id} First Name=Alice "
+                                     "Last Name=Smith "
+                                     "Image URL=/static/avatar.svg>")
                     db.session.delete(User.query.first())
                     db.session.commit()
                     self.assertFalse(bool(User.query.first()))
@@ -167,31 +159,211 @@ class PostModelTestCase(TestCase):
             db.session.add(user1)
             db.session.commit()
             self.assertEqual(str(User.query.first()),
-                         "<User ID=1 First Name=Alice Last Name="
-                         "Smith Image URL=https://via.placeholder.com/30>")
+                         f"<User ID={user1.id} First Name=Alice Last Name="
+                         "Smith Image URL=/static/avatar.svg>")
             newUser = User.query.first()
             db.session.add(Post(title='Mauris cursus mattis molestie',
-                                created_at="2022-01-30 04:47:04",
+                                created_at=utc(2022, 1, 30, 4, 47, 4),
                                 content='Lorem ipsum dolor sit amet',
                                 user_id=newUser.id))
             db.session.commit()
             post = Post.query.first()
             self.assertTrue(bool(post))
-            self.assertEquals(str(post), "<Post ID=1 Title=Mauris "
+            self.assertEquals(str(post), f"<Post ID={post.id} Title=Mauris "
                                          "cursus mattis molestie Content=Lorem "
                                          "ipsum dolor sit amet Created At="
-                                         "2022-01-30 04:47:04>")
+                                         "2022-01-30 04:47:04+00:00>")
             db.session.delete(Post.query.first())
             db.session.commit()
             self.assertFalse(bool(Post.query.first()))
             db.session.add(Post(title='Mauris cursus mattis molestie',
-                                created_at="2022-01-30 04:47:04",
+                                created_at=utc(2022, 1, 30, 4, 47, 4),
                                 content='Lorem ipsum dolor sit amet',
                                 user_id=newUser.id))
             db.session.commit()
             post = Post.query.first()
             self.assertTrue(bool(post))
-            self.assertEquals(str(post), "<Post ID=2 Title=Mauris "
+            self.assertEquals(str(post), f"<Post ID={post.id} Title=Mauris "
                                          "cursus mattis molestie Content=Lorem "
                                          "ipsum dolor sit amet Created At="
-                                         "2022-01-30 04:47:04>")
\ No newline at end of file
+                                         "2022-01-30 04:47:04+00:00>")
+
+
+@requires_postgres
+class PostTimestampTestCase(DatabaseTestCase):
+    """Tests for database-clock created_at and modified_on."""
+
+    def test_defaults_use_database_clock(self):
+        with app.app_context():
+            post = Post(title="Post", content="Lorem ipsum")
+            db.session.add(post)
+            db.session.commit()
+            created_at = post.created_at
+            self.assertIsNotNone(created_at.tzinfo)
+            self.assertLess(abs(datetime.now(UTC) - created_at),
+                            timedelta(minutes=1))
+            self.assertEqual(post.modified_on, created_at)
+            self.assertFalse(post.was_modified)
+
+            db.session.execute(Post.__table__.update().values(
+                modified_on=datetime(2022, 1, 1, tzinfo=UTC)))
+            db.session.commit()
+            post.title = "Edited"
+            db.session.commit()
+            self.assertGreater(post.modified_on,
+                               datetime(2022, 1, 2, tzinfo=UTC))
+            self.assertEqual(post.created_at, created_at)
+
+
+class FriendlyTimeTestCase(TestCase):
+    """Tests for precomputed friendly timestamps."""
+
+    def test_describe(self):
+        self.assertEqual(Post.get_friendly(timedelta(days=2)), "2 days ago")
+        self.assertEqual(Post.get_friendly(timedelta(hours=1)), "1 hour ago")
+        self.assertEqual(Post.get_friendly(timedelta(seconds=5)), "Just now")
+
+    def test_annotate_shares_now(self):
+        now = datetime(2022, 2, 1, 12, tzinfo=UTC)
+        posts = [Post(created_at=datetime(2022, 1, 30, 12, tzinfo=UTC),
+                      modified_on=datetime(2022, 2, 1, 9, tzinfo=UTC)),
+                 Post(created_at=datetime(2022, 2, 1, 11, 59, tzinfo=UTC),
+                      modified_on=None)]
+        annotate(posts, now)
+        self.assertEqual(posts[0].friendly_created_at, "2 days ago")
+        self.assertEqual(posts[0].friendly_modified_on, "3 hours ago")
+        self.assertTrue(posts[0].was_modified)
+        self.assertEqual(posts[1].friendly_created_at, "1 minute ago")
+        self.assertFalse(posts[1].was_modified)
+
+    def test_naive_timestamps_are_utc(self):
+        naive = datetime(2022, 1, 30, 4, 47, 4)
+        self.assertEqual(to_utc(naive), naive.replace(tzinfo=UTC))
+        self.assertEqual(friendly(naive, to_utc(naive) + timedelta(days=1)),
+                         "1 day ago")
+
+
+class GenerateDataTestCase(DatabaseTestCase):
+    """Tests for the generate-data command."""
+
+    def test_generate_in_batches(self):
+        result = app.test_cli_runner().invoke(generate_data, [
+            '--users', '3', '--posts', '20', '--batch-size', '7'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("posts: 20 rows", result.output)
+        with app.app_context():
+            self.assertEqual(User.query.count(), 3)
+            self.assertEqual(Post.query.count(), 20)
+            self.assertEqual(Post.query.filter(Post.user_id.is_(None))
+                             .count(), 0)
+            self.assertEqual(sum(user.post_count for user in User.query), 20)
+
+    @requires_postgres
+    def test_generate_with_copy(self):
+        result = app.test_cli_runner().invoke(generate_data, [
+            '--users', '2', '--posts', '15', '--batch-size', '4',
+            '--method', 'copy'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        with app.app_context():
+            self.assertEqual(Post.query.count(), 15)
+
+
+class UserActivityTestCase(DatabaseTestCase):
+    """Tests for the maintained post_count and last_post_at columns."""
+
+    def setUp(self):
+        super().setUp()
+        with app.app_context():
+            user = User(first_name="Tracy", last_name="Rera")
+            db.session.add(user)
+            db.session.commit()
+            self.user_id = user.id
+
+    def add_post(self, created_at):
+        post = Post(title="Post", content="Lorem ipsum",
+                    created_at=created_at, user_id=self.user_id)
+        db.session.add(post)
+        db.session.commit()
+        return post
+
+    def test_counters_follow_posts(self):
+        with app.app_context():
+            first = self.add_post(datetime(2022, 1, 1))
+            second = self.add_post(datetime(2022, 3, 1))
+            user = db.session.get(User, self.user_id)
+            self.assertEqual(user.post_count, 2)
+            self.assertEqual(to_utc(user.last_post_at),
+                             datetime(2022, 3, 1, tzinfo=UTC))
+
+            db.session.delete(second)
+            db.session.commit()
+            self.assertEqual(user.post_count, 1)
+            self.assertEqual(to_utc(user.last_post_at),
+                             datetime(2022, 1, 1, tzinfo=UTC))
+
+            db.session.delete(first)
+            db.session.commit()
+            self.assertEqual(user.post_count, 0)
+            self.assertIsNone(user.last_post_at)
+
+    def test_delete_user_cascades(self):
+        with app.app_context():
+            self.add_post(datetime(2022, 1, 1))
+            db.session.delete(db.session.get(User, self.user_id))
+            db.session.commit()
+            self.assertEqual(Post.query.count(), 0)
+
+    def test_reconcile(self):
+        with app.app_context():
+            self.add_post(datetime(2022, 1, 1))
+            db.session.execute(User.__table__.update().values(
+                post_count=7, last_post_at=None))
+            db.session.commit()
+            result = app.test_cli_runner().invoke(reconcile_activity,
+                                                  ['--batch-size', '1'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            user = db.session.get(User, self.user_id)
+            self.assertEqual(user.post_count, 1)
+            self.assertEqual(to_utc(user.last_post_at),
+                             datetime(2022, 1, 1, tzinfo=UTC))
+
+
+class PostExcerptTestCase(DatabaseTestCase):
+    """Tests for the stored excerpt and content length."""
+
+    def test_kept_with_content(self):
+        with app.app_context():
+            post = Post(title="Post", content="a" * 300)
+            db.session.add(post)
+            db.session.commit()
+            self.assertEqual(post.excerpt, "a" * 252)
+            self.assertEqual(post.content_length, 300)
+            self.assertTrue(post.homepage_minified)
+            post.content = "Short"
+            db.session.commit()
+            self.assertEqual((post.excerpt, post.content_length),
+                             ("Short", 5))
+            self.assertFalse(post.homepage_minified)
+
+    def test_core_insert_and_backfill(self):
+        with app.app_context():
+            db.session.execute(Post.__table__.insert(),
+                               [{'title': "Core", 'content': "b" * 254}])
+            db.session.execute(Post.__table__.insert(),
+                               [{'title': "Default"}])
+            db.session.commit()
+            rows = db.session.execute(
+                db.select(Post.title, Post.excerpt, Post.content_length)
+                .order_by(Post.title)).all()
+            self.assertEqual([tuple(row) for row in rows],
+                             [("Core", "b" * 254, 254),
+                              ("Default", "Lorem Ipsum", 11)])
+            db.session.execute(Post.__table__.update().values(
+                excerpt='', content_length=0))
+            db.session.commit()
+            result = app.test_cli_runner().invoke(backfill_excerpts,
+                                                  ['--batch-size', '1'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertEqual([tuple(row) for row in db.session.execute(
+                db.select(Post.title, Post.excerpt, Post.content_length)
+                .order_by(Post.title))], [tuple(row) for row in rows])
@@ -0,0 +1,91 @@
+import os
+import tempfile
+import time
+from unittest import TestCase
+
+from flask import Flask, redirect, request
+
+from cache import PageCache
+from models import db, connect_db, User
+from routing import connect_routing
+
+
+def make_app(replica_url):
+    """A small app over two SQLite files standing in for primary/replica"""
+    directory = tempfile.mkdtemp()
+    app = Flask(__name__)
+    app.config.update(
+        SECRET_KEY='test',
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{directory}/primary.db",
+        READ_REPLICAS={'replica_1': replica_url or
+                       f"sqlite:///{directory}/replica.db"},
+        READ_YOUR_WRITES_SECONDS=60)
+    connect_db(app)
+    connect_routing(app)
+    cache = PageCache()
+    cache.init_app(app)
+
+    @app.route("/names")
+    def names():
+        return ",".join(user.first_name
+                        for user in User.query.order_by(User.id))
+
+    app.add_url_rule("/cached-names", 'cached_names',
+                     cache.cached(lambda: cache.feed_key('names'))(names))
+
+    @app.route("/names", methods=["POST"])
+    def add_name():
+        db.session.add(User(first_name=request.form['name'], last_name="X"))
+        db.session.commit()
+        return redirect("/names")
+
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(first_name="Primary", last_name="X"))
+        db.session.commit()
+        if replica_url is None:
+            replica = app.extensions['replica_router'].replicas[0].engine
+            db.metadata.create_all(replica)
+            with replica.begin() as connection:
+                connection.execute(User.__table__.insert(),
+                                   {'first_name': "Replica",
+                                    'last_name': "X"})
+    return app
+
+
+class ReplicaRoutingTests(TestCase):
+    def test_reads_go_to_replica(self):
+        app = make_app(None)
+        with app.test_client() as client:
+            self.assertEqual(client.get("/names").get_data(as_text=True),
+                             "Replica")
+
+    def test_read_your_writes_window(self):
+        app = make_app(None)
+        with app.test_client() as client:
+            resp = client.post("/names", data={'name': "New"},
+                               follow_redirects=True)
+            self.assertEqual(resp.get_data(as_text=True), "Primary,New")
+            with client.session_transaction() as session:
+                session['_primary_until'] = time.time() - 1
+            self.assertEqual(client.get("/names").get_data(as_text=True),
+                             "Replica")
+
+    def test_falls_back_to_primary(self):
+        missing = os.path.join(tempfile.mkdtemp(), "no", "such", "dir.db")
+        app = make_app(f"sqlite:///{missing}")
+        router = app.extensions['replica_router']
+        with app.test_client() as client:
+            self.assertEqual(client.get("/names").get_data(as_text=True),
+                             "Primary")
+        self.assertFalse(router.replicas[0].healthy)
+
+    def test_writer_skips_pages_cached_from_replica(self):
+        app = make_app(None)
+        with app.test_client() as reader:
+            self.assertEqual(reader.get("/cached-names")
+                             .get_data(as_text=True), "Replica")
+        with app.test_client() as writer:
+            writer.post("/names", data={'name': "New"})
+            self.assertEqual(writer.get("/cached-names")
+                             .get_data(as_text=True), "Primary,New")
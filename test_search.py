@@ -0,0 +1,78 @@
+from unittest import TestCase
+
+from flask import Flask
+
+from models import db, connect_db, User, Post
+from search import search_posts, highlight
+
+# Search runs on SQLite's FTS5 here, so no PostgreSQL server is needed.
+sqlite_app = Flask(__name__)
+sqlite_app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+connect_db(sqlite_app)
+
+
+class SqliteSearchTestCase(TestCase):
+    """Tests for the SQLite full-text search fallback."""
+
+    def setUp(self):
+        with sqlite_app.app_context():
+            db.drop_all()
+            db.create_all()
+            user = User(first_name="Tracy", last_name="Rera")
+            db.session.add(user)
+            db.session.commit()
+            db.session.add_all([
+                Post(title=f"Cats {i}",
+                     content="Cats and dogs. " * (i + 1), user_id=user.id)
+                for i in range(5)])
+            db.session.add(Post(title="Unrelated", content="Nothing here",
+                                user_id=user.id))
+            db.session.commit()
+
+    def test_ranked_and_paged(self):
+        with sqlite_app.app_context():
+            first = search_posts("cats", 3)
+            self.assertEqual(len(first), 3)
+            ranks = [result.rank for result in first]
+            self.assertEqual(ranks, sorted(ranks, reverse=True))
+            second = search_posts("cats", 3, before=first.next_cursor)
+            self.assertEqual(len(second), 2)
+            self.assertIsNone(second.next_cursor)
+            seen = {r.post.id for r in first} | {r.post.id for r in second}
+            self.assertEqual(len(seen), 5)
+            back = search_posts("cats", 3, after=second.prev_cursor)
+            self.assertEqual([r.post.id for r in back],
+                             [r.post.id for r in first])
+
+    def test_snippet_highlighted(self):
+        with sqlite_app.app_context():
+            result = search_posts("dogs", 1).items[0]
+            self.assertIn("<mark>dogs</mark>", result.snippet)
+
+    def test_edits_and_deletes_reindexed(self):
+        with sqlite_app.app_context():
+            post = Post.query.filter_by(title="Unrelated").first()
+            post.content = "Now about parrots"
+            db.session.commit()
+            self.assertEqual(len(search_posts("parrots", 5)), 1)
+            db.session.delete(post)
+            db.session.commit()
+            self.assertEqual(len(search_posts("parrots", 5)), 0)
+
+    def test_query_syntax_is_literal(self):
+        with sqlite_app.app_context():
+            self.assertEqual(len(search_posts('cats" OR "', 5)), 0)
+            self.assertEqual(len(search_posts('NEAR(', 5)), 0)
+
+
+class HighlightTestCase(TestCase):
+    def test_escapes_and_truncates(self):
+        snippet = highlight("<b>\x02cats\x03</b> " + "x" * 300)
+        self.assertTrue(snippet.startswith(
+            "&lt;b&gt;<mark>cats</mark>&lt;/b&gt;"))
+        self.assertTrue(snippet.endswith(" ..."))
+
+    def test_closes_cut_highlight(self):
+        snippet = highlight("x" * 250 + "\x02cats\x03")
+        self.assertEqual(snippet.count("<mark>"),
+                         snippet.count("</mark>"))
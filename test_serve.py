@@ -0,0 +1,83 @@
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from unittest import TestCase
+
+from serve import BoundedServer, QuietHandler
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class ServeTests(TestCase):
+    """Runs serve.py as a real pre-forking server."""
+
+    def setUp(self):
+        env = dict(os.environ, BLOGLY_ENV='testing')
+        self.server = subprocess.Popen(
+            [sys.executable, '-W', 'ignore', 'serve.py', '--port', '0',
+             '--workers', '2', '--threads', '2', '--graceful-timeout', '5'],
+            cwd=HERE, env=env, stdout=subprocess.PIPE, text=True)
+        line = self.server.stdout.readline()
+        self.base = re.search(r'http://\S+', line).group()
+
+    def tearDown(self):
+        if self.server.poll() is None:
+            self.server.kill()
+        self.server.wait()
+        self.server.stdout.close()
+
+    def get(self, path, attempts=50):
+        # Workers may still be starting.
+        for _ in range(attempts):
+            try:
+                with urllib.request.urlopen(self.base + path,
+                                            timeout=5) as resp:
+                    return resp.status
+            except OSError:
+                time.sleep(0.1)
+        raise AssertionError(f"{path} never answered")
+
+    def test_serves_reloads_and_stops(self):
+        self.assertEqual(self.get('/_stats/cache'), 200)
+        self.server.send_signal(signal.SIGHUP)
+        for _ in range(10):
+            self.assertEqual(self.get('/_stats/cache'), 200)
+        self.server.send_signal(signal.SIGTERM)
+        self.assertEqual(self.server.wait(timeout=10), 0)
+
+
+class BoundedServerTests(TestCase):
+    def test_threads_bound_concurrent_requests(self):
+        entered = []
+        release = threading.Event()
+
+        def app(environ, start_response):
+            entered.append(environ['PATH_INFO'])
+            release.wait(5)
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return [b'ok']
+
+        server = BoundedServer('127.0.0.1', 0, app, QuietHandler, threads=1)
+        serving = threading.Thread(target=server.serve_forever)
+        serving.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(serving.join)
+        self.addCleanup(server.shutdown)
+        base = f"http://127.0.0.1:{server.server_port}"
+        clients = [threading.Thread(target=urllib.request.urlopen,
+                                    args=(f"{base}/{n}",),
+                                    kwargs={'timeout': 10})
+                   for n in range(2)]
+        for client in clients:
+            client.start()
+        time.sleep(0.5)
+        self.assertEqual(len(entered), 1)
+        release.set()
+        for client in clients:
+            client.join()
+        self.assertEqual(sorted(entered), ['/0', '/1'])
@@ -0,0 +1,120 @@
+"""Database fixtures for Blogly's tests.
+
+The schema is created once per test process. Each
+:class:`DatabaseTestCase` test then runs inside a transaction on a single
+connection that every session in the app is bound to; the app's own
+commits only release SAVEPOINTs, and the whole transaction is rolled back
+when the test ends.
+
+``DATABASE_URL`` picks the database: a local PostgreSQL by default, or
+``sqlite://`` to run in memory. Under pytest-xdist each worker uses its
+own database (see :func:`config.worker_database`), created on first use.
+"""
+
+import os
+from datetime import datetime, UTC
+from unittest import TestCase, skipUnless
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy_utils import database_exists, create_database
+
+os.environ.setdefault('BLOGLY_ENV', 'testing')
+
+from app import app
+from cache import page_cache
+from models import db
+from notfound import recent_posts
+
+_ready = False
+
+
+def dialect():
+    return make_url(app.config['SQLALCHEMY_DATABASE_URI']).get_backend_name()
+
+
+def utc(*args):
+    """``datetime(*args)`` in UTC"""
+    return datetime(*args, tzinfo=UTC)
+
+
+def requires_postgres(test):
+    """Skip ``test`` when the suite runs on SQLite"""
+    return skipUnless(dialect() == 'postgresql',
+                      "needs PostgreSQL")(test)
+
+
+def _sqlite_savepoints(engine):
+    # pysqlite's own transaction handling breaks SAVEPOINT; let SQLAlchemy
+    # emit BEGIN itself.
+    @event.listens_for(engine, 'connect')
+    def no_driver_transactions(dbapi_connection, record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def begin(connection):
+        connection.exec_driver_sql('BEGIN')
+
+
+def prepare_database():
+    """Create the test database and its schema, once per process"""
+    global _ready
+    if _ready:
+        return
+    with app.app_context():
+        engine = db.engine
+        if engine.dialect.name == 'sqlite':
+            _sqlite_savepoints(engine)
+        elif not database_exists(engine.url):
+            create_database(engine.url)
+        db.drop_all()
+        db.create_all()
+    _ready = True
+
+
+def empty_tables():
+    with app.app_context():
+        for table in reversed(db.metadata.sorted_tables):
+            db.session.execute(table.delete())
+        db.session.commit()
+
+
+class DatabaseTestCase(TestCase):
+    """A test whose database changes are rolled back afterwards.
+
+    Tests that write from other threads, which cannot share the test's
+    connection, set ``transactional = False``; their tables are emptied
+    instead.
+    """
+
+    transactional = True
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        prepare_database()
+
+    def setUp(self):
+        super().setUp()
+        page_cache.clear()
+        recent_posts.clear()
+        if not self.transactional:
+            empty_tables()
+            return
+        with app.app_context():
+            self._connection = db.engine.connect()
+        self._transaction = self._connection.begin()
+        db.session.session_factory.configure(
+            bind=self._connection, join_transaction_mode='create_savepoint')
+
+    def tearDown(self):
+        if self.transactional:
+            db.session.session_factory.configure(
+                bind=None, join_transaction_mode='conditional_savepoint')
+            self._transaction.rollback()
+            self._connection.close()
+        else:
+            empty_tables()
+        page_cache.clear()
+        recent_posts.clear()
+        super().tearDown()
@@ -0,0 +1,62 @@
+"""Friendly ("3 days ago") timestamps for Blogly."""
+
+from datetime import datetime, UTC
+
+# Post timestamps are stored timezone-aware. SQLite hands them back naive,
+# in UTC, as does anything written by seed data.
+
+
+def to_utc(timestamp):
+    """Aware UTC datetime for a naive (UTC) or aware ``timestamp``"""
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=UTC)
+    return timestamp.astimezone(UTC)
+
+
+def describe(timediff):
+    """Turn an elapsed ``timedelta`` into words"""
+    seconds = int(timediff.total_seconds())
+    if seconds >= 86400:
+        days = seconds // 86400
+        return f"{days} day{'s' if days > 1 else ''} ago"
+    elif seconds >= 3600:
+        hours = seconds // 3600
+        return f"{hours} hour{'s' if hours > 1 else ''} ago"
+    elif seconds >= 60:
+        minutes = seconds // 60
+        return f"{minutes} minute{'s' if minutes > 1 else ''} ago"
+    else:
+        return "Just now"
+
+
+def friendly(timestamp, now=None):
+    """How long ago ``timestamp`` was, in words"""
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=UTC)
+    return describe((now or datetime.now(UTC)) - timestamp)
+
+
+def was_modified(created_at, modified_on):
+    """Whether a post was edited at least a second after it was created"""
+    if modified_on is None:
+        return False
+    if (created_at.tzinfo is None) != (modified_on.tzinfo is None):
+        created_at, modified_on = to_utc(created_at), to_utc(modified_on)
+    return (modified_on - created_at).total_seconds() >= 1
+
+
+def annotate(posts, now=None):
+    """Precompute the friendly times of a whole result set.
+
+    Every post is measured against the same ``now``, and the results are
+    stored on the posts so the templates read them instead of recomputing.
+    Returns ``posts`` for chaining.
+    """
+    now = now or datetime.now(UTC)
+    for post in posts:
+        created_at, modified_on = post.created_at, post.modified_on
+        post.friendly_times = (
+            friendly(created_at, now),
+            modified_on and friendly(modified_on, now),
+            was_modified(created_at, modified_on))
+    return posts
@@ -0,0 +1,248 @@
+"""Write-behind queue for new posts.
+
+``POST_WRITE_MODE`` picks how ``new_post_apply`` persists a post:
+
+``sync``
+    Add and commit in the request, one transaction per post (default).
+``group``
+    Queue the post and wait for the background writer to commit the batch
+    it lands in. As durable as ``sync``, but concurrent submits share one
+    commit (and one fsync) per batch.
+``async``
+    Queue the post and answer at once. A crash loses posts still in the
+    queue, and the post may not be visible on the very next page load.
+
+A batch takes every post that queued up while the previous one committed,
+up to ``WRITE_BEHIND_MAX_BATCH``, and lingers at most
+``WRITE_BEHIND_MAX_DELAY`` seconds for more. When the queue
+(``WRITE_BEHIND_QUEUE_SIZE``) is full, posts are written synchronously.
+
+A ``group`` submit that gets no answer within ``WRITE_BEHIND_TIMEOUT``
+raises :class:`WriteTimedOut`: the post may yet be committed, so it must
+not simply be submitted again.
+"""
+
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from datetime import datetime, UTC
+
+from activity import adjust
+from cache import page_cache
+from metrics import registry
+from models import db, Post
+
+MODES = ('sync', 'group', 'async')
+
+log = logging.getLogger(__name__)
+
+BATCH_SIZE = registry.histogram(
+    'blogly_write_behind_batch_size', 'Posts committed per batch.',
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500))
+FAILURES = registry.counter(
+    'blogly_write_behind_failures_total', 'Queued posts that failed to save.')
+
+
+class WriteFailed(Exception):
+    """A queued post could not be committed"""
+
+
+class WriteTimedOut(Exception):
+    """A queued post was neither committed nor failed in time"""
+
+
+class PendingPost:
+    """A post row waiting in the queue, and its outcome once written"""
+
+    def __init__(self, row):
+        self.row = row
+        self.error = None
+        self._done = threading.Event()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def finish(self, error=None):
+        self.error = error
+        self._done.set()
+
+    def wait(self, timeout):
+        if not self._done.wait(timeout):
+            raise WriteTimedOut(f"no outcome for the post after {timeout}s")
+        if self.error is not None:
+            raise WriteFailed(str(self.error)) from self.error
+
+
+def insert_posts(rows):
+    """Insert ``rows`` and bump their authors' counters in one transaction"""
+    db.session.execute(Post.__table__.insert(), rows)
+    connection = db.session.connection()
+    for user_id, count in Counter(row['user_id'] for row in rows).items():
+        adjust(connection, user_id, count)
+    db.session.commit()
+
+
+def write_posts(rows):
+    """:func:`insert_posts`, then drop the cached pages they change"""
+    insert_posts(rows)
+    page_cache.invalidate_posts()
+
+
+class PostWriter:
+    """Commits queued posts in batches from a background thread"""
+
+    def __init__(self):
+        self.app = None
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        mode = app.config.get('POST_WRITE_MODE', 'sync')
+        if mode not in MODES:
+            raise ValueError(f"Unknown POST_WRITE_MODE {mode!r}")
+        self.app = app
+        self.max_batch = app.config.get('WRITE_BEHIND_MAX_BATCH', 100)
+        self.max_delay = app.config.get('WRITE_BEHIND_MAX_DELAY', 0.005)
+        self.timeout = app.config.get('WRITE_BEHIND_TIMEOUT', 10)
+        if self._queue is None:
+            # Kept if another app is built: the writer thread waits on it.
+            self._queue = queue.Queue(
+                app.config.get('WRITE_BEHIND_QUEUE_SIZE', 10_000))
+        registry.register('post_writer', self.collect)
+
+    @property
+    def mode(self):
+        return self.app.config.get('POST_WRITE_MODE', 'sync')
+
+    def submit(self, user_id, title, content):
+        """Save a new post according to the current mode.
+
+        Returns True once the post is committed, False if it was only
+        queued. Raises :class:`WriteFailed` if a ``group`` write fails,
+        or :class:`WriteTimedOut` if its outcome is not known in time.
+        """
+        mode = self.mode
+        if mode == 'sync':
+            db.session.add(Post(title=title, content=content,
+                                user_id=user_id))
+            db.session.commit()
+            page_cache.invalidate_posts()
+            return True
+        self._ensure_started()
+        # Stamped now, not when the batch commits.
+        now = datetime.now(UTC)
+        pending = PendingPost({'title': title, 'content': content,
+                               'user_id': user_id,
+                               'created_at': now, 'modified_on': now})
+        try:
+            self._queue.put_nowait(pending)
+        except queue.Full:
+            write_posts([pending.row])
+            return True
+        if mode == 'group':
+            pending.wait(self.timeout)
+            return True
+        return False
+
+    def _ensure_started(self):
+        # A forked worker inherits the queue but not the thread.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                if self._pid is None:
+                    atexit.register(self.stop)
+                else:
+                    self._queue = queue.Queue(self._queue.maxsize)
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run,
+                                                name='post-writer',
+                                                daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """Commit everything still queued and stop the writer thread"""
+        thread = self._thread
+        if thread is None or self._pid != os.getpid():
+            return
+        self._queue.put(None)
+        thread.join()
+        self._thread = None
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                # Take whatever queued up during the last commit, then
+                # linger briefly for stragglers.
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                with self.app.app_context():
+                    self._commit(batch)
+            except Exception as e:
+                # Whatever went wrong, the thread lives on for the next
+                # batch; the waiters on this one learn why it failed.
+                log.exception("write-behind batch failed")
+                for pending in batch:
+                    if not pending.done:
+                        FAILURES.labels().inc()
+                        pending.finish(e)
+
+    def _commit(self, batch):
+        try:
+            insert_posts([pending.row for pending in batch])
+        except Exception as e:
+            db.session.rollback()
+            if len(batch) > 1:
+                # Retry one by one so a single bad row can't sink the rest.
+                for pending in batch:
+                    self._commit([pending])
+                return
+            FAILURES.labels().inc()
+            log.error("could not save queued post %r: %s", batch[0].row, e)
+            batch[0].finish(e)
+            return
+        BATCH_SIZE.labels().observe(len(batch))
+        for pending in batch:
+            pending.finish()
+        # The posts are saved whether or not this succeeds.
+        page_cache.invalidate_posts()
+
+    def collect(self):
+        yield ('blogly_write_behind_queued', 'gauge',
+               'Posts waiting for the background writer.',
+               [('', {}, self._queue.qsize())])
+
+
+post_writer = PostWriter()
+
+
+def connect_writer(app):
+    """Attach the post writer to the app."""
+
+    post_writer.init_app(app)